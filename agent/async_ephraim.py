@@ -0,0 +1,399 @@
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+from rich.console import Console
+from rich.panel import Panel
+
+from cache import CacheEntry, ResponseCache
+from channels import SPEAKER_PREFIX, USER_PREFIX, AsyncConsoleChannel, ScriptedChannel, ThreadBridgeChannel
+from consts import API_KEY_ENV_VAR_NAME, DATABASE_FILE_NAME, MODEL_NAME, SQLITE_DATABASE_FILE_NAME
+from executor import ExecutionOutcome, PlanExecutor
+from helpers import is_error
+from identity import FailureLimiter, IdentityCache
+from memory import SummaryJob
+from pipeline import DecisionStream, EphraimPipeline
+from plan_schema import check_decision
+from prompt_builder import RESPONSE_CACHE_KEY, build_response_messages, build_summary_messages
+from responses import CACHE_PATH, LLM_PATH, TEMPLATE_PATH
+from snapshots import open_followed_store
+from storage import STORAGE_BACKENDS, BaseStore
+from tools import PharmacyTools
+from tracing import TRACER, log_usage, record_usage, traced
+
+LOAD_TEST_MESSAGES = (
+    "What medications do you have in stock?",
+    "What are the side effects of PainAway?",
+    "My name is Alice and my date of birth is 1995-04-12. What are my prescriptions and their side effects?",
+    "Can you show my prescription history?",
+)
+LOAD_TEST_ANSWERS = ("Alice", "1995-04-12")
+
+
+@dataclass
+class TurnResult:
+    """What one handle_user_message call decided, executed and answered, with stage timings in seconds."""
+    plan: Optional[Dict[str, Any]] = None
+    outcome: Optional[ExecutionOutcome] = None
+    response: str = ""
+    path: str = ""
+    language: str = ""
+    timings: Dict[str, float] = field(default_factory=dict)
+    # Set by replay_decision when the answer still needs the LLM responder
+    responder_messages: Optional[list] = None
+    # Token usage per LLM call ("decide", "respond"), see tracing.usage_counts
+    usage: Dict[str, Dict[str, int]] = field(default_factory=dict)
+
+
+class AsyncEphraim(EphraimPipeline):
+    """
+    Async, single-conversation variant of Ephraim on AsyncOpenAI.
+
+    Many instances can share one event loop, store, client and PlanExecutor; each instance
+    keeps its own toolbox state (language, identity prompts) and writes to its own channel.
+    Identity-gated steps run on the instance's own one-thread prompt pool; interrupt() releases
+    a prompt left waiting by a cancelled message, and close() the pool. The decisions of a
+    turn are EphraimPipeline's; this class only awaits the LLM and the executor.
+    """
+
+    def __init__(self, store: BaseStore, client: AsyncOpenAI, channel, executor: PlanExecutor,
+                 logger: logging.Logger | None = None, response_cache: ResponseCache | None = None,
+                 failures: FailureLimiter | None = None) -> None:
+        """Initialize a conversation over shared resources (`failures` counts failed DOB checks across them)."""
+        logger = logger or logging.getLogger(__name__)
+        # Only non-user-specific responses are cached, so one cache can serve every conversation
+        super().__init__(
+            store=store,
+            tools=PharmacyTools(store=store, channel=None, logger=logger, identity=IdentityCache(failures=failures)),
+            executor=executor,
+            response_cache=response_cache or ResponseCache(),
+            logger=logger,
+        )
+        self.client: AsyncOpenAI = client
+        self.channel = channel
+        self._summary_task: Optional[asyncio.Task] = None
+        # Identity prompts wait for the user on this conversation's own thread, never on the shared pool
+        self._prompt_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ephraim-prompt")
+        self._bridge: Optional[ThreadBridgeChannel] = None
+
+    def _attach_channel(self) -> None:
+        """Give the toolbox (running in worker threads) a blocking bridge to this conversation's channel."""
+        loop = asyncio.get_running_loop()
+        if self._bridge is None or self._bridge.loop is not loop:
+            self._bridge = ThreadBridgeChannel(self.channel, loop)
+        self.tools.channel = self._bridge
+
+    def interrupt(self) -> None:
+        """
+        Release tool calls waiting on the channel (e.g. an identity prompt) when the message is
+        cancelled: they get an empty answer at once instead of holding their thread until the
+        prompt times out.
+        """
+        if self._bridge is not None:
+            self._bridge.close()
+            self._bridge = None
+
+    def close(self) -> None:
+        """Interrupt pending prompts and release the conversation's prompt thread."""
+        self.interrupt()
+        self._prompt_pool.shutdown(wait=False, cancel_futures=True)
+
+    @traced("decide")
+    async def _decide_tool(self, user_message: str, cached: CacheEntry | None = None, context: str = "") -> dict:
+        """
+        Ask the LLM for a plan (unless cached) and write its explanation to the channel.
+        The decider reply is streamed and completed steps start executing immediately.
+        """
+        TRACER.current().set_attribute("cache.hit", cached is not None)
+        if cached is not None:
+            explanation = self._replay_cached_decision(cached)
+            if explanation:
+                await self.channel.write(SPEAKER_PREFIX, end="")
+                await self.channel.write(explanation, markup=False, kind="explanation")
+            return cached.plan
+
+        with TRACER.span("detect_language"):
+            language = self.language_detector.quick(user_message)
+            if language is None:
+                # Only ambiguous text needs the statistical detector; keep it off the event loop
+                language = await asyncio.to_thread(self.language_detector.detect, user_message)
+            self.tools.language = language
+
+        messages = self._decider_messages(user_message, context)
+        stream = await self._stream_decision(messages)
+
+        decision = check_decision(stream.content, self.tools.__class__)
+        if is_error(decision):
+            decision = await self._repair_decision(messages, stream.content, decision)
+        abandoned = self._abandoned_run(decision, stream)
+        if abandoned is not None:
+            await self.executor.cancel_async(abandoned)
+        return self._settle_decision(user_message, context, decision, stream)
+
+    async def _repair_decision(self, messages: list, content: str, failure: dict) -> tuple | dict:
+        """One structured-outputs repair request for a plan that failed to parse or validate (see Ephraim)."""
+        request = self._repair_request(messages, content, failure)
+        with TRACER.span("repair_plan"):
+            completion = await self.client.chat.completions.create(**request)
+        return self._read_repair(content, completion, failure)
+
+    async def _stream_decision(self, messages: list) -> DecisionStream:
+        """Stream the decider reply, writing the explanation (unless the plan reports a broken rule) while completed steps are dispatched."""
+        self._attach_channel()
+        decision = self._start_decision_stream()
+        writing = False
+
+        async with self.client.chat.completions.stream(
+                model=MODEL_NAME,
+                messages=messages,
+                stream_options={"include_usage": True},
+                prompt_cache_key=self.decider_prompt_builder.cache_key,
+        ) as stream:
+            async for event in stream:
+                if event.type != "content.delta":
+                    continue
+                explanation, explanation_ended = decision.feed(event.delta)
+                if explanation:
+                    if not writing:
+                        await self.channel.write(SPEAKER_PREFIX, end="")
+                        writing = True
+                    await self.channel.write(explanation, end="", markup=False, kind="explanation")
+                if explanation_ended and writing:
+                    await self.channel.write("", markup=False, kind="explanation")
+                    writing = False
+            self.turn_usage["decide"] = record_usage("decide", (await stream.get_final_completion()).usage)
+        explanation, _ = decision.finish()
+        if explanation:
+            if not writing:
+                await self.channel.write(SPEAKER_PREFIX, end="")
+                writing = True
+            await self.channel.write(explanation, end="", markup=False, kind="explanation")
+        if writing:
+            await self.channel.write("", markup=False, kind="explanation")
+        return decision
+
+    @traced("execute")
+    async def _execute_tool(self, plan: dict) -> ExecutionOutcome:
+        """Execute the plan on the shared executor (joining steps started while deciding)."""
+        self._attach_channel()
+        run = self._take_speculative_run(plan)
+        if run is not None:
+            outcome = await self.executor.finish_async(run)
+        else:
+            outcome = await self.executor.execute_async(plan, self.tools, self._prompt_pool)
+        return outcome.to_json()
+
+    @traced("respond")
+    async def _stream_response(self, user_content: str, execution_summary: str, context: str = "") -> str:
+        """Stream the final answer to the channel as the LLM produces it and return its text."""
+        messages = build_response_messages(user_content, execution_summary, context)
+
+        parts: list = []
+        async with self.client.chat.completions.stream(
+                model=MODEL_NAME,
+                messages=messages,
+                stream_options={"include_usage": True},
+                prompt_cache_key=RESPONSE_CACHE_KEY,
+        ) as stream:
+            await self.channel.write(SPEAKER_PREFIX, end="")
+            async for event in stream:
+                if event.type == "content.delta":
+                    parts.append(event.delta)
+                    await self.channel.write(event.delta, end="", markup=False, kind="delta")
+            self.turn_usage["respond"] = record_usage("respond", (await stream.get_final_completion()).usage)
+            await self.channel.write("\n")
+        return "".join(parts)
+
+    async def _write_response(self, response: str) -> None:
+        await self.channel.write(SPEAKER_PREFIX, end="")
+        await self.channel.write(response, end="\n\n", markup=False, kind="delta")
+
+    async def _lookup_cache(self, user_message: str) -> CacheEntry | None:
+        if self.response_cache.embed is None:
+            return self.response_cache.lookup(user_message)
+        return await asyncio.to_thread(self.response_cache.lookup, user_message)
+
+    async def logout(self) -> bool:
+        """Forget the verified identity (REPL `logout` command), confirm it, and report whether anyone was logged in."""
+        message, logged_in = self._forget_identity()
+        await self._write_response(message)
+        return logged_in
+
+    def _start_summary(self, job: SummaryJob) -> None:
+        self._summary_task = asyncio.create_task(self._summarize(job))
+
+    async def _summarize(self, job: SummaryJob) -> None:
+        """Fold evicted turns into the conversation summary, in the background of the next turns."""
+        summary = None
+        try:
+            summary = self._summary_text(await self.client.chat.completions.create(
+                model=MODEL_NAME, messages=build_summary_messages(job.transcript())))
+        except Exception as e:
+            self.logger.warning(f"Conversation summary failed: {e}")
+        self.memory.finish_summary(job, summary)
+
+    @traced("turn")
+    async def handle_user_message(self, user_message: str) -> TurnResult:
+        """Full pipeline: decide which tool(s) to call, execute them, and stream the result."""
+        with self._pinned_snapshot() as snapshot:
+            started = time.perf_counter()
+            self.turn_usage = {}
+            context = self.memory.context()
+            data_version = snapshot.data_version()
+            cached = self._cache_entry(await self._lookup_cache(user_message), user_message, context)
+            cached_response = self._cached_response(cached, data_version)
+            if cached_response is not None:
+                await self._write_response(cached_response)
+                self._remember(user_message, cached_response)
+                return TurnResult(plan=cached.plan, response=cached_response, path=CACHE_PATH,
+                                  language=cached.language, timings={"total": time.perf_counter() - started})
+
+            decision: dict = await self._decide_tool(user_message, cached, context)
+            decided = time.perf_counter()
+            outcome: ExecutionOutcome = await self._execute_tool(decision)
+            executed = time.perf_counter()
+
+            response = self.response_renderer.render(decision, outcome, self.tools.language)
+            path = TEMPLATE_PATH
+            if response is None:
+                path = LLM_PATH
+                response = await self._stream_response(user_message, outcome.summary, context)
+            else:
+                await self._write_response(response)
+
+            self._finish_turn(user_message, context, decision, outcome, response, data_version)
+            finished = time.perf_counter()
+            log_usage(self.logger, self.turn_usage)
+            return TurnResult(plan=decision, outcome=outcome, response=response, path=path,
+                              language=self.tools.language,
+                              timings={"decide": decided - started, "execute": executed - decided,
+                                       "respond": finished - executed, "total": finished - started},
+                              usage=self.turn_usage)
+
+    async def replay_decision(self, user_message: str, decider_reply: str) -> TurnResult:
+        """
+        Execute a decider reply obtained outside this conversation (e.g. from an OpenAI Batch
+        job) and render the template response. Nothing is written to the channel; if the
+        answer needs the LLM, the result has an empty response and the responder request
+        in responder_messages.
+        """
+        started = time.perf_counter()
+        self.tools.language = await asyncio.to_thread(self.language_detector.detect, user_message)
+        parsed = check_decision(decider_reply, self.tools.__class__)
+        decision = parsed if is_error(parsed) else parsed[1]
+        decided = time.perf_counter()
+        outcome = await self._execute_tool(decision)
+        executed = time.perf_counter()
+
+        result = TurnResult(plan=decision, outcome=outcome, path=TEMPLATE_PATH, language=self.tools.language)
+        response = self.response_renderer.render(decision, outcome, self.tools.language)
+        if response is None:
+            result.path = LLM_PATH
+            result.responder_messages = build_response_messages(user_message, outcome.summary)
+        else:
+            result.response = response
+        finished = time.perf_counter()
+        result.timings = {"decide": decided - started, "execute": executed - decided,
+                          "respond": finished - executed, "total": finished - started}
+        return result
+
+
+def create_client(base_url: str | None = None) -> AsyncOpenAI:
+    """Create the shared AsyncOpenAI client; a base URL (e.g. mock_llm.py) needs no real key."""
+    load_dotenv()
+    api_key = os.getenv(API_KEY_ENV_VAR_NAME)
+    if not api_key:
+        if base_url is None:
+            raise ValueError("API key not found. Set OPENAI_API_KEY in .env file.")
+        api_key = "offline"
+    return AsyncOpenAI(api_key=api_key, base_url=base_url)
+
+
+async def run_repl(store: BaseStore, client: AsyncOpenAI, executor: PlanExecutor) -> None:
+    console = Console()
+    channel = AsyncConsoleChannel(console)
+    agent = AsyncEphraim(store, client, channel, executor)
+    console.print(Panel(
+        "Hi! I'm EphrAIm, your AI pharmacy assistant. How may I help you?",
+        title="[bold green]Ephraim[/bold green]",
+        border_style="green",
+        expand=False
+    ))
+    while True:
+        try:
+            await asyncio.to_thread(channel.renderer.drain)
+            user_msg = (await asyncio.to_thread(console.input, USER_PREFIX)).strip()
+        except (KeyboardInterrupt, EOFError):
+            break
+        if user_msg.lower() in ["exit", "quit"]:
+            break
+        if user_msg.lower() == "logout":
+            await agent.logout()
+            continue
+        await agent.handle_user_message(user_msg)
+
+
+async def run_load_test(store: BaseStore, client: AsyncOpenAI, executor: PlanExecutor, conversations: int) -> None:
+    """Run many scripted conversations concurrently and print latency and throughput."""
+    latencies: list = []
+    response_paths: Counter = Counter()
+    response_cache = ResponseCache()
+
+    async def conversation() -> None:
+        channel = ScriptedChannel(list(LOAD_TEST_ANSWERS) * len(LOAD_TEST_MESSAGES))
+        agent = AsyncEphraim(store, client, channel, executor, response_cache=response_cache)
+        for message in LOAD_TEST_MESSAGES:
+            started = time.perf_counter()
+            await agent.handle_user_message(message)
+            latencies.append(time.perf_counter() - started)
+        response_paths.update(agent.response_renderer.counters)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(conversation() for _ in range(conversations)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"conversations: {conversations}  messages: {len(latencies)}  wall: {elapsed:.2f}s")
+    print(f"throughput: {len(latencies) / elapsed:.1f} msg/s  "
+          f"p50: {statistics.median(latencies) * 1000:.1f} ms  p99: {p99 * 1000:.1f} ms")
+    print(f"response paths: {dict(response_paths)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--debug", action="store_true", help="Enable debug logging")
+    parser.add_argument("--storage", choices=STORAGE_BACKENDS, default="json", help="Storage backend to query")
+    parser.add_argument("--database", default=None, help="Database file for the selected storage backend")
+    parser.add_argument("--base-url", default=None, help="OpenAI-compatible endpoint, e.g. a local mock_llm.py server")
+    parser.add_argument("--max-workers", type=int, default=32, help="Concurrent tool calls across conversations")
+    parser.add_argument("--load-test", type=int, default=0, metavar="N",
+                        help="Run N concurrent scripted conversations instead of the REPL")
+    parser.add_argument("--watch", type=float, default=0, metavar="SECONDS",
+                        help="Reload the database in the background when it changes, checking every SECONDS")
+    cmd_args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if cmd_args.debug else logging.WARNING,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        datefmt="%H:%M:%S"
+    )
+    database_path = cmd_args.database or (
+        SQLITE_DATABASE_FILE_NAME if cmd_args.storage == "sqlite" else DATABASE_FILE_NAME)
+    shared_store = open_followed_store(cmd_args.storage, database_path, cmd_args.watch)
+    shared_client = create_client(cmd_args.base_url)
+    shared_executor = PlanExecutor(max_workers=cmd_args.max_workers)
+
+    if cmd_args.load_test:
+        asyncio.run(run_load_test(shared_store, shared_client, shared_executor, cmd_args.load_test))
+    else:
+        asyncio.run(run_repl(shared_store, shared_client, shared_executor))
@@ -0,0 +1,460 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, TextIO
+
+from async_ephraim import AsyncEphraim, TurnResult, create_client
+from cache import ResponseCache
+from channels import ScriptedChannel
+from consts import DATABASE_FILE_NAME, MODEL_NAME, SQLITE_DATABASE_FILE_NAME
+from executor import PlanExecutor
+from helpers import generate_tool_map, is_error
+from prompt_builder import DeciderPromptBuilder, build_decider_messages
+from responses import LLM_PATH
+from storage import STORAGE_BACKENDS, BaseStore, open_store
+from tools import PharmacyTools
+
+DEFAULT_CONCURRENCY = 16
+OUTPUT_FORMATS = ("ephraim", "openai")
+BATCH_ENDPOINT = "/v1/chat/completions"
+TURN_SEPARATOR = "#"
+
+
+@dataclass
+class BatchItem:
+    """One conversation of a batch: its user messages in order and the answers to identity prompts."""
+    id: str
+    messages: List[str]
+    answers: List[str] = field(default_factory=list)
+
+
+def parse_item(record: Dict[str, Any], line_number: int) -> BatchItem:
+    """
+    Read one input line: either {"id", "message" | "messages", "answers"} (workflows/scenarios.jsonl
+    uses "workflow" as the id), or an OpenAI Batch request line {"custom_id", "body": {"messages"}},
+    whose user messages become the turns. Lines without an id are numbered.
+    """
+    if isinstance(record.get("body"), dict):
+        item_id = record.get("custom_id")
+        messages = [m.get("content") for m in record["body"].get("messages", ()) if m.get("role") == "user"]
+    else:
+        item_id = record.get("id", record.get("custom_id", record.get("workflow")))
+        messages = record.get("messages", record.get("message"))
+        if isinstance(messages, str):
+            messages = [messages]
+    if not messages or not all(isinstance(message, str) and message.strip() for message in messages):
+        raise ValueError(f"line {line_number}: expected a non-empty message")
+    answers = [str(answer) for answer in record.get("answers", ())]
+    return BatchItem(id=str(item_id) if item_id is not None else str(line_number), messages=messages, answers=answers)
+
+
+def read_items(path: str) -> List[BatchItem]:
+    """Read and validate every conversation of a JSONL file ("-" reads stdin)."""
+    source = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    items: List[BatchItem] = []
+    seen: Set[str] = set()
+    try:
+        for line_number, line in enumerate(source, start=1):
+            if not line.strip():
+                continue
+            try:
+                item = parse_item(json.loads(line), line_number)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"line {line_number}: invalid JSON ({e})") from e
+            if item.id in seen:
+                raise ValueError(f"line {line_number}: duplicate id {item.id!r}")
+            seen.add(item.id)
+            items.append(item)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    return items
+
+
+def turn_id(item_id: str, index: int) -> str:
+    """custom_id of one turn's request in an OpenAI Batch file."""
+    return f"{item_id}{TURN_SEPARATOR}{index}"
+
+
+def batch_request(custom_id: str, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+    """One line of an OpenAI Batch input file."""
+    return {"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT,
+            "body": {"model": MODEL_NAME, "messages": messages}}
+
+
+def read_batch_output(path: str) -> Dict[str, Optional[str]]:
+    """Map custom_id -> assistant reply of an OpenAI Batch output file; failed requests map to None."""
+    replies: Dict[str, Optional[str]] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            reply = None
+            if not record.get("error") and response.get("status_code") == 200:
+                choices = (response.get("body") or {}).get("choices") or [{}]
+                reply = (choices[0].get("message") or {}).get("content")
+            replies[record.get("custom_id")] = reply
+    return replies
+
+
+def turn_record(message: str, result: TurnResult, transcript: str) -> Dict[str, Any]:
+    """JSON-serializable record of one turn: plan, tool outputs, final text, stage timings and token usage."""
+    outcome = result.outcome
+    plan_error = result.plan if is_error(result.plan) else None
+    return {
+        "message": message,
+        "language": result.language,
+        "plan": None if plan_error else result.plan,
+        "tool_outputs": [
+            {"tool": step.tool, "calls": [{"args": args, "result": value} for args, value in step.calls]}
+            for step in (outcome.steps if outcome is not None else ())
+        ],
+        "error": plan_error or (outcome.error if outcome is not None else None),
+        "response": result.response,
+        "path": result.path,
+        "timings_ms": {stage: round(seconds * 1000, 3) for stage, seconds in result.timings.items()},
+        "usage": result.usage,
+        "transcript": transcript,
+    }
+
+
+def item_record(item: BatchItem, turns: List[Dict[str, Any]], started: float,
+                error: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        "id": item.id,
+        "status": "error" if error else "ok",
+        "error": error,
+        "turns": turns,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+    }
+
+
+def to_openai_output(record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Wrap a result in the OpenAI Batch output format: the last turn's response is the
+    assistant message and the full Ephraim record rides along under body["ephraim"].
+    """
+    request_id = uuid.uuid4().hex
+    if record["status"] != "ok":
+        return {"id": f"batch_req_{request_id[:12]}", "custom_id": record["id"], "response": None,
+                "error": {"code": "pipeline_error", "message": record["error"]}}
+    content = record["turns"][-1]["response"] if record["turns"] else ""
+    body = {
+        "id": f"chatcmpl-{request_id[:12]}",
+        "object": "chat.completion",
+        "model": MODEL_NAME,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "ephraim": record,
+    }
+    return {"id": f"batch_req_{request_id[:12]}", "custom_id": record["id"],
+            "response": {"status_code": 200, "request_id": request_id, "body": body}, "error": None}
+
+
+def _record_status(record: Dict[str, Any]) -> tuple:
+    if "custom_id" in record:
+        return record["custom_id"], record.get("error") is None
+    return record.get("id"), record.get("status") == "ok"
+
+
+def completed_ids(path: str) -> Set[str]:
+    """
+    Ids already answered successfully in an existing results file. A last line cut off
+    by a crash is truncated so that appending resumes on a clean line; failed items
+    are not counted, so they run again (the newer line supersedes the failure).
+    """
+    if not os.path.exists(path):
+        return set()
+    done: Set[str] = set()
+    with open(path, "rb+") as f:
+        lines = f.read().split(b"\n")
+        partial = lines.pop()
+        if partial:
+            f.truncate(f.tell() - len(partial))
+    for line in lines:
+        try:
+            record_id, ok = _record_status(json.loads(line))
+        except (ValueError, AttributeError):
+            continue
+        if ok:
+            done.add(record_id)
+    return done
+
+
+class BatchRunner:
+    """
+    Name:
+        BatchRunner
+
+    Purpose:
+        Run many conversations through the AsyncEphraim pipeline concurrently, up to a
+        fixed number at a time, and write one JSON result per conversation as each one
+        finishes. Conversations share the store, client, PlanExecutor and response cache;
+        each gets its own AsyncEphraim and a ScriptedChannel that answers identity prompts
+        from the item's answers.
+
+    Inputs:
+        store (BaseStore), client (AsyncOpenAI), executor (PlanExecutor): Shared resources.
+        concurrency (int): Conversations in flight at once.
+        output_format (str): "ephraim" (native records) or "openai" (Batch output lines).
+
+    Output Schema:
+        run() and replay() return counters of "ok", "error" and "skipped" items.
+
+    Error Handling:
+        An exception inside a conversation is logged and recorded as that item's error;
+        the other conversations continue.
+
+    Fallback Behavior:
+        Items whose id is in `skip` (resumed runs) are not run again.
+    """
+
+    def __init__(self, store: BaseStore, client, executor: PlanExecutor, concurrency: int = DEFAULT_CONCURRENCY,
+                 output_format: str = "ephraim", logger: Optional[logging.Logger] = None) -> None:
+        self.store: BaseStore = store
+        self.client = client
+        self.executor: PlanExecutor = executor
+        self.concurrency: int = max(1, concurrency)
+        self.output_format: str = output_format
+        self.logger = logger or logging.getLogger(__name__)
+        self.response_cache: ResponseCache = ResponseCache()
+
+    def _agent(self, item: BatchItem) -> AsyncEphraim:
+        channel = ScriptedChannel(item.answers)
+        return AsyncEphraim(self.store, self.client, channel, self.executor, logger=self.logger,
+                            response_cache=self.response_cache)
+
+    async def _map(self, items: Iterable[BatchItem], handle: Callable[[BatchItem], Awaitable[Dict[str, Any]]],
+                   write: Callable[[Dict[str, Any]], None], skip: Set[str]) -> Counter:
+        counters: Counter = Counter()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def produce() -> None:
+            for item in items:
+                if item.id in skip:
+                    counters["skipped"] += 1
+                    continue
+                await queue.put(item)
+            for _ in range(self.concurrency):
+                await queue.put(None)
+
+        async def work() -> None:
+            while (item := await queue.get()) is not None:
+                record = await handle(item)
+                counters[record["status"]] += 1
+                write(record)
+
+        await asyncio.gather(produce(), *(work() for _ in range(self.concurrency)))
+        return counters
+
+    def _writer(self, output: TextIO, output_format: str) -> Callable[[Dict[str, Any]], None]:
+        def write(record: Dict[str, Any]) -> None:
+            line = to_openai_output(record) if output_format == "openai" else record
+            output.write(json.dumps(line, ensure_ascii=False) + "\n")
+            output.flush()
+        return write
+
+    async def run_item(self, item: BatchItem) -> Dict[str, Any]:
+        """Run every turn of one conversation through handle_user_message."""
+        agent = self._agent(item)
+        started = time.perf_counter()
+        turns: List[Dict[str, Any]] = []
+        try:
+            for message in item.messages:
+                written = len(agent.channel.output)
+                result = await agent.handle_user_message(message)
+                turns.append(turn_record(message, result, "".join(agent.channel.output[written:])))
+        except Exception as e:
+            self.logger.exception(f"Batch item {item.id} failed")
+            return item_record(item, turns, started, error=f"{type(e).__name__}: {e}")
+        return item_record(item, turns, started)
+
+    async def run(self, items: Iterable[BatchItem], output: TextIO, skip: Set[str] = frozenset()) -> Counter:
+        """Run the full pipeline for every item, writing results to `output` as they finish."""
+        return await self._map(items, self.run_item, self._writer(output, self.output_format), skip)
+
+    async def replay(self, items: Iterable[BatchItem], decisions: Dict[str, Optional[str]],
+                     state: TextIO, requests: TextIO) -> Counter:
+        """
+        Second step of the OpenAI Batch flow: execute the decider replies from a Batch
+        output file, record every turn in `state`, and write a responder request for each
+        turn whose answer needs the LLM (see collect()).
+        """
+        async def replay_item(item: BatchItem) -> Dict[str, Any]:
+            agent = self._agent(item)
+            started = time.perf_counter()
+            turns: List[Dict[str, Any]] = []
+            try:
+                for index, message in enumerate(item.messages):
+                    reply = decisions.get(turn_id(item.id, index))
+                    if reply is None:
+                        return item_record(item, turns, started, error=f"No decider reply for turn {index}")
+                    written = len(agent.channel.output)
+                    result = await agent.replay_decision(message, reply)
+                    turns.append(turn_record(message, result, "".join(agent.channel.output[written:])))
+                    if result.responder_messages is not None:
+                        requests.write(json.dumps(batch_request(turn_id(item.id, index), result.responder_messages),
+                                                  ensure_ascii=False) + "\n")
+            except Exception as e:
+                self.logger.exception(f"Batch item {item.id} failed")
+                return item_record(item, turns, started, error=f"{type(e).__name__}: {e}")
+            return item_record(item, turns, started)
+
+        return await self._map(items, replay_item, self._writer(state, "ephraim"), set())
+
+
+def prepare(items: Iterable[BatchItem], requests: TextIO) -> int:
+    """First step of the OpenAI Batch flow: write one decider request per turn. Returns the request count."""
+    system_prompt = DeciderPromptBuilder().build(generate_tool_map(PharmacyTools))
+    count = 0
+    for item in items:
+        for index, message in enumerate(item.messages):
+            request = batch_request(turn_id(item.id, index), build_decider_messages(system_prompt, message))
+            requests.write(json.dumps(request, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def collect(state_path: str, responses: Dict[str, Optional[str]], output: TextIO,
+            output_format: str = "ephraim") -> Counter:
+    """Last step of the OpenAI Batch flow: fill in the responder replies and write the final results."""
+    counters: Counter = Counter()
+    with open(state_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            for index, turn in enumerate(record["turns"]):
+                if turn["path"] != LLM_PATH or turn["response"]:
+                    continue
+                reply = responses.get(turn_id(record["id"], index))
+                if reply is None and record["status"] == "ok":
+                    record["status"], record["error"] = "error", f"No responder reply for turn {index}"
+                turn["response"] = reply or ""
+            counters[record["status"]] += 1
+            line = to_openai_output(record) if output_format == "openai" else record
+            output.write(json.dumps(line, ensure_ascii=False) + "\n")
+    return counters
+
+
+def _open_output(path: str, append: bool = False) -> TextIO:
+    if path == "-":
+        return sys.stdout
+    return open(path, "a" if append else "w", encoding="utf-8")
+
+
+def _open_resources(cmd_args) -> tuple:
+    database_path = cmd_args.database or (
+        SQLITE_DATABASE_FILE_NAME if cmd_args.storage == "sqlite" else DATABASE_FILE_NAME)
+    store = open_store(cmd_args.storage, database_path)
+    if cmd_args.command == "respond":
+        # Replaying Batch decisions executes tools and renders templates only; no LLM calls
+        client = None
+    elif cmd_args.mock:
+        from mock_llm import AsyncMockOpenAI, load_medication_names
+
+        client = AsyncMockOpenAI(medication_names=load_medication_names(DATABASE_FILE_NAME))
+    else:
+        client = create_client(cmd_args.base_url)
+    return store, client, PlanExecutor(max_workers=cmd_args.max_workers)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Answer many conversations offline: concurrently through the live pipeline (run), "
+                    "or through OpenAI Batch files (prepare -> respond -> collect)")
+    parser.add_argument("--debug", action="store_true", help="Enable debug logging")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_pipeline_args(command: argparse.ArgumentParser) -> None:
+        command.add_argument("--storage", choices=STORAGE_BACKENDS, default="json", help="Storage backend to query")
+        command.add_argument("--database", default=None, help="Database file for the selected storage backend")
+        command.add_argument("--max-workers", type=int, default=32, help="Concurrent tool calls")
+        command.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                             help="Conversations in flight at once")
+
+    run_parser = commands.add_parser("run", help="Run every conversation through the full pipeline")
+    run_parser.add_argument("input", nargs="?", default="-", help="Input JSONL ('-' reads stdin)")
+    run_parser.add_argument("--output", required=True, help="Results JSONL ('-' writes stdout)")
+    run_parser.add_argument("--format", choices=OUTPUT_FORMATS, default="ephraim", help="Result line format")
+    run_parser.add_argument("--resume", action="store_true",
+                            help="Skip items already answered in --output and append the rest")
+    run_parser.add_argument("--base-url", default=None, help="OpenAI-compatible endpoint")
+    run_parser.add_argument("--mock", action="store_true", help="Use the in-process mock LLM (no API key needed)")
+    add_pipeline_args(run_parser)
+
+    prepare_parser = commands.add_parser("prepare", help="Write the decider requests as an OpenAI Batch input file")
+    prepare_parser.add_argument("input", nargs="?", default="-", help="Input JSONL ('-' reads stdin)")
+    prepare_parser.add_argument("--requests", required=True, help="Batch input file to write")
+
+    respond_parser = commands.add_parser(
+        "respond", help="Execute the decider Batch output; write the responder requests and the run state")
+    respond_parser.add_argument("input", help="The same input JSONL given to prepare")
+    respond_parser.add_argument("--decisions", required=True, help="Batch output file of the decider requests")
+    respond_parser.add_argument("--state", required=True, help="State JSONL to write (read by collect)")
+    respond_parser.add_argument("--requests", required=True, help="Batch input file of responder requests to write")
+    add_pipeline_args(respond_parser)
+
+    collect_parser = commands.add_parser("collect", help="Merge the responder Batch output into the final results")
+    collect_parser.add_argument("--state", required=True, help="State JSONL written by respond")
+    collect_parser.add_argument("--responses", default=None,
+                                help="Batch output file of the responder requests (omit if respond wrote none)")
+    collect_parser.add_argument("--output", required=True, help="Results JSONL ('-' writes stdout)")
+    collect_parser.add_argument("--format", choices=OUTPUT_FORMATS, default="ephraim", help="Result line format")
+    cmd_args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if cmd_args.debug else logging.WARNING,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        datefmt="%H:%M:%S"
+    )
+
+    if cmd_args.command == "run" and cmd_args.resume and cmd_args.output == "-":
+        parser.error("--resume needs an --output file")
+    try:
+        batch_items = read_items(cmd_args.input) if cmd_args.command != "collect" else []
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    if cmd_args.command == "prepare":
+        with _open_output(cmd_args.requests) as requests_file:
+            written = prepare(batch_items, requests_file)
+        print(f"Wrote {written} decider requests for {len(batch_items)} conversations to {cmd_args.requests}",
+              file=sys.stderr)
+        sys.exit(0)
+
+    if cmd_args.command == "collect":
+        replies = read_batch_output(cmd_args.responses) if cmd_args.responses else {}
+        with _open_output(cmd_args.output) as output_file:
+            totals = collect(cmd_args.state, replies, output_file, cmd_args.format)
+        print(f"ok: {totals['ok']}  error: {totals['error']}", file=sys.stderr)
+        sys.exit(1 if totals["error"] else 0)
+
+    shared_store, shared_client, shared_executor = _open_resources(cmd_args)
+    runner = BatchRunner(shared_store, shared_client, shared_executor, concurrency=cmd_args.concurrency,
+                         output_format=getattr(cmd_args, "format", "ephraim"))
+    started_at = time.perf_counter()
+    try:
+        if cmd_args.command == "run":
+            done = completed_ids(cmd_args.output) if cmd_args.resume else set()
+            with _open_output(cmd_args.output, append=cmd_args.resume) as output_file:
+                totals = asyncio.run(runner.run(batch_items, output_file, skip=done))
+        else:
+            decider_replies = read_batch_output(cmd_args.decisions)
+            with _open_output(cmd_args.state) as state_file, _open_output(cmd_args.requests) as requests_file:
+                totals = asyncio.run(runner.replay(batch_items, decider_replies, state_file, requests_file))
+    finally:
+        shared_executor.shutdown()
+        shared_store.close()
+    elapsed = time.perf_counter() - started_at
+    print(f"ok: {totals['ok']}  error: {totals['error']}  skipped: {totals['skipped']}  "
+          f"wall: {elapsed:.2f}s", file=sys.stderr)
+    sys.exit(1 if totals["error"] else 0)
@@ -0,0 +1,424 @@
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from rich.console import Console
+
+from channels import SPEAKER_PREFIX
+from consts import DATABASE_FILE_NAME
+from ephraim import Ephraim
+from mock_llm import MockOpenAI, load_medication_names
+from records import to_json
+from storage import STORAGE_BACKENDS, import_json_to_sqlite, open_store
+from synthetic import DatabaseSpec, SyntheticDatabase, load_base, write_database
+
+SCENARIOS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "workflows", "scenarios.jsonl")
+DEFAULT_SCALES = (1_000, 10_000, 100_000)
+STAGES = ("decide", "execute", "respond", "total")
+STAGE_METHODS = (("decide", "_decide_tool"), ("execute", "_execute_tool"), ("respond", "_stream_response"))
+HISTORY_QUERIES = 200
+
+
+class Scenario(NamedTuple):
+    workflow: str
+    message: str
+    answers: List[str]
+
+
+def load_scenarios(paths: Sequence[str]) -> List[Scenario]:
+    """Read scenarios from JSONL files: one {"message", "answers"?, "workflow"?} object per line."""
+    scenarios: List[Scenario] = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                entry = json.loads(line)
+                if not isinstance(entry, dict) or not isinstance(entry.get("message"), str):
+                    continue
+                scenarios.append(Scenario(
+                    workflow=entry.get("workflow") or f"{os.path.basename(path)}:{number}",
+                    message=entry["message"],
+                    answers=list(entry.get("answers") or []),
+                ))
+    return scenarios
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else 0.0
+
+
+class StageRecorder:
+    """Collects per-stage durations, time-to-first-token and (while tracemalloc runs) peak memory."""
+
+    def __init__(self) -> None:
+        self.durations: Dict[str, List[float]] = defaultdict(list)
+        self.peaks: Dict[str, int] = defaultdict(int)
+        self.ttft: List[float] = []
+        self.turn_started: Optional[float] = None
+        self.first_output: Optional[float] = None
+
+    def wrap(self, stage: str, method: Callable) -> Callable:
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            tracing = tracemalloc.is_tracing()
+            if tracing:
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                if tracing:
+                    self.peaks[stage] = max(self.peaks[stage], tracemalloc.get_traced_memory()[1] - baseline)
+                else:
+                    self.durations[stage].append(time.perf_counter() - started)
+        return timed
+
+    def output_written(self) -> None:
+        if self.first_output is None and self.turn_started is not None:
+            self.first_output = time.perf_counter()
+
+
+class _BenchmarkRenderer:
+    """OutputRenderer stand-in that discards text and reports the first write of each turn."""
+
+    def __init__(self, recorder: StageRecorder) -> None:
+        self.recorder = recorder
+
+    def write(self, text: str, end: str = "\n", markup: bool = False, paced: bool = False) -> None:
+        if text and text != SPEAKER_PREFIX:
+            self.recorder.output_written()
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class _BenchmarkChannel:
+    """Conversation channel that answers identity prompts from the current scenario."""
+
+    def __init__(self, renderer: _BenchmarkRenderer) -> None:
+        self.renderer = renderer
+        self.answers: List[str] = []
+
+    def write(self, text: str, end: str = "\n", markup: bool = True, kind: str = "text") -> None:
+        self.renderer.write(text, end=end, markup=markup)
+
+    def ask(self, question: str) -> str:
+        self.renderer.write(question)
+        return self.answers.pop(0) if self.answers else ""
+
+
+def _summarize(values: Sequence[float]) -> Dict[str, Any]:
+    return {
+        "count": len(values),
+        "p50_ms": round(statistics.median(values) * 1000, 3) if values else None,
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3) if values else None,
+    }
+
+
+def _history_durations(agent: Ephraim, database: SyntheticDatabase, queries: int) -> List[float]:
+    """
+    Time get_user_prescription_history (including the conversion to JSON done at the
+    _execute_tool boundary) for log owners sampled from the log stream, so heavy users
+    are queried as often as they appear in the logs.
+    """
+    rng = random.Random(0)
+    owners: List[str] = []
+    for log in database.logs():
+        owners.append(log["user_name"])
+        if len(owners) >= queries * 10:
+            break
+    durations: List[float] = []
+    for name in rng.sample(owners, min(queries, len(owners))):
+        dob = agent.store.get_users(name)[0].dob
+        started = time.perf_counter()
+        to_json(agent.tools.get_user_prescription_history(user_name=name, user_dob=dob))
+        durations.append(time.perf_counter() - started)
+    return durations
+
+
+def _write_database(workdir: str, name: str, spec: DatabaseSpec, storage: str) -> tuple:
+    """
+    Write the synthetic database `spec` (imported to SQLite for the sqlite backend);
+    returns the JSON path and the path for the storage backend to open.
+    """
+    json_path = os.path.join(workdir, f"{name}.json")
+    write_database(json_path, 0, spec=spec)
+    if storage != "sqlite":
+        return json_path, json_path
+    sqlite_path = os.path.join(workdir, f"{name}.sqlite3")
+    import_json_to_sqlite(json_path, sqlite_path)
+    return json_path, sqlite_path
+
+
+def _store_memory(storage: str, database_path: str) -> tuple:
+    """(retained, peak) bytes allocated by opening the store at `database_path`."""
+    tracemalloc.start()
+    measured = open_store(storage, database_path)
+    retained, peak = tracemalloc.get_traced_memory()
+    measured.close()
+    tracemalloc.stop()
+    return retained, peak
+
+
+def _dict_memory(json_path: str) -> int:
+    """Bytes retained by the same database as plain dict records (json.load), the baseline the stores are compared to."""
+    tracemalloc.start()
+    with open(json_path) as f:
+        data = json.load(f)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return retained
+
+
+def _per_million_logs(retained: int, without_logs: int, logs: int) -> Optional[int]:
+    return round((retained - without_logs) * 1_000_000 / logs) if logs else None
+
+
+def benchmark_scale(records: int, scenarios: Sequence[Scenario], storage: str, workdir: str,
+                    iterations: int, latency: float, tokens_per_second: float,
+                    measure_memory: bool, use_cache: bool) -> Dict[str, Any]:
+    """
+    Name:
+        benchmark_scale
+
+    Purpose:
+        Run every scenario through Ephraim.handle_user_message against a synthetic
+        database of `records` records, with MockOpenAI standing in for the model.
+        A timing pass measures each stage; a separate pass under tracemalloc measures
+        peak memory per stage, so tracing overhead never distorts the timings.
+
+    Inputs:
+        records (int): Synthetic database size.
+        scenarios (list[Scenario]): Messages to replay, with answers for identity prompts.
+        storage (str): Storage backend ("json", "sqlite" or "lazy").
+        workdir (str): Directory for the generated database files.
+        iterations (int): Timed runs per scenario.
+        latency (float), tokens_per_second (float): MockOpenAI settings.
+        measure_memory (bool): Run the tracemalloc pass (also measures the memory the loaded store
+            retains, and the share of it taken by the generated logs, by loading the same
+            database without them; both are compared to the same data as plain dict records).
+        use_cache (bool): Keep the response cache between turns (cleared before every turn otherwise).
+
+    Output Schema:
+        dict with "records", "load", "stages" (including the "history" query), "ttft",
+        "throughput_msgs_per_s" and "response_paths".
+
+    Error Handling:
+        Exceptions from the pipeline propagate.
+
+    Fallback Behavior:
+        None
+    """
+    base = load_base()
+    spec = DatabaseSpec.from_total(records, base)
+    database = SyntheticDatabase(spec, base)
+    json_path, database_path = _write_database(workdir, f"database_{records}", spec, storage)
+
+    started = time.perf_counter()
+    store = open_store(storage, database_path)
+    load_seconds = time.perf_counter() - started
+    load_peak = load_retained = None
+    memory: Dict[str, Any] = {}
+    if measure_memory:
+        load_retained, load_peak = _store_memory(storage, database_path)
+        dict_retained = _dict_memory(json_path)
+        # The same database without the generated logs: the difference is what the logs retain
+        without_logs_json, without_logs_path = _write_database(
+            workdir, f"database_{records}_without_logs", spec._replace(logs=0), storage)
+        memory = {
+            "log_retained_bytes_per_million_logs": _per_million_logs(
+                load_retained, _store_memory(storage, without_logs_path)[0], spec.logs),
+            "dict_retained_bytes": dict_retained,
+            "dict_log_retained_bytes_per_million_logs": _per_million_logs(
+                dict_retained, _dict_memory(without_logs_json), spec.logs),
+        }
+
+    recorder = StageRecorder()
+    renderer = _BenchmarkRenderer(recorder)
+    channel = _BenchmarkChannel(renderer)
+    client = MockOpenAI(latency=latency, tokens_per_second=tokens_per_second,
+                        medication_names=load_medication_names(DATABASE_FILE_NAME))
+    agent = Ephraim(client=client, store=store, console=Console(file=io.StringIO()),
+                    renderer=renderer, channel=channel)
+    for stage, name in STAGE_METHODS:
+        setattr(agent, name, recorder.wrap(stage, getattr(agent, name)))
+    handle = recorder.wrap("total", agent.handle_user_message)
+    prompt_usage: Dict[str, Counter] = defaultdict(Counter)
+
+    def run(scenario: Scenario, record_ttft: bool) -> None:
+        if not use_cache:
+            agent.response_cache.clear()
+        # Every scenario is a new conversation, so it starts without a verified identity or history
+        agent.tools.identity.logout()
+        agent.memory.clear()
+        channel.answers = list(scenario.answers)
+        recorder.turn_started, recorder.first_output = time.perf_counter(), None
+        handle(scenario.message)
+        if record_ttft and recorder.first_output is not None:
+            recorder.ttft.append(recorder.first_output - recorder.turn_started)
+            for call, counts in agent.turn_usage.items():
+                prompt_usage[call].update(counts)
+
+    for scenario in scenarios:  # warm-up: prompt caches, imports, lazy indexes
+        run(scenario, record_ttft=False)
+    recorder.durations.clear()
+    agent.response_renderer.counters.clear()
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for scenario in scenarios:
+            run(scenario, record_ttft=True)
+    wall = time.perf_counter() - started
+    response_paths = dict(agent.response_renderer.counters)
+    history = _history_durations(agent, database, HISTORY_QUERIES)
+
+    if measure_memory:
+        tracemalloc.start()
+        for scenario in scenarios:
+            run(scenario, record_ttft=False)
+        tracemalloc.stop()
+
+    agent.executor.shutdown()
+    store.close()
+
+    messages = iterations * len(scenarios)
+    return {
+        "records": records,
+        "storage": storage,
+        "load": {
+            "seconds": round(load_seconds, 4),
+            "peak_bytes": load_peak,
+            "retained_bytes": load_retained,
+            "logs": len(database.base["prescription_logs"]) + spec.logs,
+            **memory,
+        },
+        "stages": {
+            **{stage: {**_summarize(recorder.durations.get(stage, [])),
+                       "peak_bytes": recorder.peaks.get(stage) if measure_memory else None}
+               for stage in STAGES},
+            "history": {**_summarize(history), "peak_bytes": None},
+        },
+        "ttft": _summarize(recorder.ttft),
+        "throughput_msgs_per_s": round(messages / wall, 2) if wall else None,
+        "llm_calls": client.calls,
+        "prompt_tokens": {call: {**counts, "cached_share": round(counts["cached_tokens"] / counts["prompt_tokens"], 3)
+                                 if counts["prompt_tokens"] else 0.0}
+                          for call, counts in prompt_usage.items()},
+        "response_paths": response_paths,
+    }
+
+
+def print_report(results: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    """Print one line per stage and scale, with the p50/p99 change against a baseline run if given."""
+    previous = {str(run["records"]): run for run in (baseline or {}).get("runs", [])}
+    for run in results["runs"]:
+        old = previous.get(str(run["records"]))
+        print(f"\n{run['records']:,} records ({run['storage']}): load {run['load']['seconds']:.3f}s, "
+              f"{run['throughput_msgs_per_s']} msg/s, ttft p50 {run['ttft']['p50_ms']} ms")
+        retained = run["load"].get("retained_bytes")
+        if retained is not None:
+            line = f"  store    {retained / 2 ** 20:.1f} MiB retained"
+            per_million_logs = run["load"].get("log_retained_bytes_per_million_logs")
+            if per_million_logs is not None:
+                line += f", logs {per_million_logs / 2 ** 20:.1f} MiB per million"
+            old_retained = ((old or {}).get("load") or {}).get("retained_bytes")
+            if old_retained:
+                line += f"  ({(retained - old_retained) / old_retained * 100:+.1f}% vs baseline)"
+            print(line)
+            dict_retained = run["load"].get("dict_retained_bytes")
+            if dict_retained:
+                line = (f"  dicts    {dict_retained / 2 ** 20:.1f} MiB retained as plain dict records "
+                        f"({(retained - dict_retained) / dict_retained * 100:+.1f}% with the store)")
+                dict_per_million_logs = run["load"].get("dict_log_retained_bytes_per_million_logs")
+                if dict_per_million_logs and per_million_logs is not None:
+                    line += (f", logs {dict_per_million_logs / 2 ** 20:.1f} MiB per million "
+                             f"({(per_million_logs - dict_per_million_logs) / dict_per_million_logs * 100:+.1f}%)")
+                print(line)
+        if run.get("prompt_tokens"):
+            print("  prompts  " + "  ".join(
+                f"{call} {counts['prompt_tokens']:,} tokens ({counts['cached_share'] * 100:.0f}% cached)"
+                for call, counts in run["prompt_tokens"].items()))
+        for stage, stats in list(run["stages"].items()) + [("ttft", run["ttft"])]:
+            if not stats["count"]:
+                continue
+            line = f"  {stage:<8} p50 {stats['p50_ms']:>9.3f} ms  p99 {stats['p99_ms']:>9.3f} ms"
+            if stats.get("peak_bytes") is not None:
+                line += f"  peak {stats['peak_bytes'] / 1024:>9.1f} KiB"
+            old_stats = (old or {}).get("stages", {}).get(stage) or ((old or {}).get("ttft") if stage == "ttft" else None)
+            if old_stats and old_stats.get("p50_ms"):
+                change = (stats["p50_ms"] - old_stats["p50_ms"]) / old_stats["p50_ms"] * 100
+                line += f"  ({change:+.1f}% p50 vs baseline)"
+            print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of the full handle_user_message pipeline")
+    parser.add_argument("--scales", type=int, nargs="+", default=list(DEFAULT_SCALES),
+                        help="Synthetic database sizes in records (e.g. 1000 10000 ... 10000000)")
+    parser.add_argument("--scenarios", nargs="+", default=[SCENARIOS_FILE], help="JSONL scenario files")
+    parser.add_argument("--storage", choices=STORAGE_BACKENDS, default="json", help="Storage backend to query")
+    parser.add_argument("--iterations", type=int, default=5, help="Timed runs per scenario")
+    parser.add_argument("--latency", type=float, default=0.0, help="Mock LLM seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Mock LLM token rate (0 = unthrottled)")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc pass")
+    parser.add_argument("--cache", action="store_true", help="Keep the response cache between turns")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to save the JSON results")
+    parser.add_argument("--compare", default=None, help="Earlier results file to compare against")
+    parser.add_argument("--workdir", default=None, help="Directory for generated databases (kept if given)")
+    cmd_args = parser.parse_args()
+
+    workdir = cmd_args.workdir or tempfile.mkdtemp(prefix="ephraim-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    scenario_list = load_scenarios(cmd_args.scenarios)
+    try:
+        report = {
+            "meta": {
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "scenarios": len(scenario_list),
+                "iterations": cmd_args.iterations,
+                "latency": cmd_args.latency,
+                "tokens_per_second": cmd_args.tokens_per_second,
+                "cache": cmd_args.cache,
+            },
+            "runs": [
+                benchmark_scale(records, scenario_list, cmd_args.storage, workdir, cmd_args.iterations,
+                                cmd_args.latency, cmd_args.tokens_per_second,
+                                not cmd_args.no_memory, cmd_args.cache)
+                for records in cmd_args.scales
+            ],
+        }
+    finally:
+        if cmd_args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(cmd_args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline_report = None
+    if cmd_args.compare:
+        with open(cmd_args.compare, "r") as f:
+            baseline_report = json.load(f)
+    print_report(report, baseline_report)
+    print(f"\nResults saved to {cmd_args.output}")
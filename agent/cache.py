@@ -0,0 +1,208 @@
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Sequence
+
+IDENTITY_ARGS = ("user_name", "user_dob")
+_NON_WORD = re.compile(r"[^\w\s]+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_message(text: str) -> str:
+    """Case-fold a user message and strip punctuation and extra whitespace for cache keys."""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return _WHITESPACE.sub(" ", _NON_WORD.sub(" ", text)).strip()
+
+
+def plan_has_identity_args(plan: Dict[str, Any]) -> bool:
+    """True if any step of the plan passes a user name or date of birth."""
+    return any(
+        arg in (step.get("args") or {})
+        for step in plan.get("plan", [])
+        for arg in IDENTITY_ARGS
+    )
+
+
+def plan_is_user_specific(plan: Dict[str, Any], identity_tools: FrozenSet[str]) -> bool:
+    """True if the plan passes identity arguments or calls an identity-gated tool."""
+    return plan_has_identity_args(plan) or any(step.get("tool") in identity_tools for step in plan.get("plan", []))
+
+
+def plan_is_standalone(plan: Dict[str, Any], message: str) -> bool:
+    """
+    True if the plan answers `message` on its own, whatever was said earlier in the conversation:
+    it calls a tool other than 'none' and every text argument appears in the message itself (a
+    broken-rule report always qualifies). Mid-conversation, only such plans are cached or reused.
+    """
+    steps = plan.get("plan", [])
+    if any("broken_rule" in step.get("tool", "") for step in steps):
+        return True
+    if all(step.get("tool") == "none" for step in steps):
+        return False
+    text = normalize_message(message)
+    return all(
+        normalize_message(value) in text
+        for step in steps
+        for value in (step.get("args") or {}).values()
+        if isinstance(value, str) and not value.startswith("$")
+    )
+
+
+class CacheEntry:
+    """Cached decision (and, for non-user-specific plans, final response) for one message."""
+
+    __slots__ = ("key", "plan", "explanation", "language", "response", "data_version", "expires_at", "embedding")
+
+    def __init__(self, key: str, plan: Dict[str, Any], explanation: str, language: str,
+                 expires_at: float, embedding: Optional[List[float]]) -> None:
+        self.key = key
+        self.plan = plan
+        self.explanation = explanation
+        self.language = language
+        self.response: Optional[str] = None
+        self.data_version: Any = None
+        self.expires_at = expires_at
+        self.embedding = embedding
+
+
+class ResponseCache:
+    """
+    Name:
+        ResponseCache
+
+    Purpose:
+        LRU/TTL cache in front of the tool decider, keyed on the normalized user message.
+        It stores the plan and explanation for every cacheable message, and the final
+        response for plans that are not user-specific. An optional embedding function
+        adds a cosine-similarity lookup for paraphrased questions.
+
+    Inputs:
+        max_entries (int): LRU capacity.
+        ttl (float): Seconds an entry stays valid.
+        embed (callable | None): Maps text to an embedding vector; enables similarity lookups.
+        similarity_threshold (float): Minimum cosine similarity for a semantic hit.
+        clock (callable): Monotonic time source.
+
+    Output Schema:
+        lookup() returns a CacheEntry or None; cached_response() its usable response.
+
+    Error Handling:
+        Embedding failures are treated as cache misses, and so are similar messages whose
+        cached plan uses arguments the new message does not mention.
+
+    Fallback Behavior:
+        Plans with identity arguments are never stored. Cached responses are only served
+        while the store's data_version matches the version they were produced from.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600.0,
+                 embed: Optional[Callable[[str], Sequence[float]]] = None,
+                 similarity_threshold: float = 0.95, clock: Callable[[], float] = time.monotonic) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.embed = embed
+        self.similarity_threshold = similarity_threshold
+        self.clock = clock
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._vectors: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, message: str) -> Optional[CacheEntry]:
+        """
+        Return the live entry for `message` (exact, then semantic), or None. A semantic hit must
+        also be standalone for `message` (plan_is_standalone): a paraphrase scores high even when
+        it names a different medication, and the cached plan's arguments would answer the wrong one.
+        """
+        key = normalize_message(message)
+        now = self.clock()
+        with self._lock:
+            entry = self._live(key, now)
+            if entry is not None or self.embed is None or not self._entries:
+                return entry
+
+        vector = self._embed(key)
+        if vector is None:
+            return None
+        with self._lock:
+            best, best_score = None, self.similarity_threshold
+            for candidate in list(self._entries.values()):
+                if candidate.embedding is None or self._live(candidate.key, now) is None:
+                    continue
+                if not plan_is_standalone(candidate.plan, message):
+                    continue
+                score = _dot(vector, candidate.embedding)
+                if score >= best_score:
+                    best, best_score = candidate, score
+            if best is not None:
+                self._entries.move_to_end(best.key)
+            return best
+
+    def cached_response(self, entry: Optional[CacheEntry], data_version: Any) -> Optional[str]:
+        """Return the entry's final response if it was produced from the current data."""
+        if entry is None or entry.response is None or entry.data_version != data_version:
+            return None
+        return entry.response
+
+    def store_plan(self, message: str, plan: Dict[str, Any], explanation: str, language: str) -> Optional[CacheEntry]:
+        """Cache a decider result. Plans carrying identity arguments are rejected."""
+        if plan_has_identity_args(plan):
+            return None
+        key = normalize_message(message)
+        entry = CacheEntry(key, plan, explanation, language, self.clock() + self.ttl,
+                           self._embed(key) if self.embed is not None else None)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def store_response(self, message: str, response: str, data_version: Any) -> None:
+        """Attach a final response, and the data version it was built from, to the message's entry."""
+        key = normalize_message(message)
+        with self._lock:
+            entry = self._live(key, self.clock())
+            if entry is not None:
+                entry.response = response
+                entry.data_version = data_version
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _live(self, key: str, now: float) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _embed(self, text: str) -> Optional[List[float]]:
+        """Embed and L2-normalize text, reusing recent vectors so a miss-then-store embeds once."""
+        vector = self._vectors.get(text)
+        if vector is not None:
+            return vector
+        try:
+            raw = list(self.embed(text))
+        except Exception:
+            return None
+        norm = math.sqrt(sum(x * x for x in raw)) or 1.0
+        vector = [x / norm for x in raw]
+        with self._lock:
+            self._vectors[text] = vector
+            while len(self._vectors) > 256:
+                self._vectors.popitem(last=False)
+        return vector
+
+
+def _dot(a: Sequence[float], b: Sequence[float]) -> float:
+    return sum(x * y for x, y in zip(a, b))
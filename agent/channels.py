@@ -0,0 +1,177 @@
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Coroutine, List, Optional, Set
+
+from rich.console import Console
+from rich.text import Text
+
+from renderer import OutputRenderer
+
+SPEAKER_PREFIX = "[bold green]Ephraim: [/]"
+USER_PREFIX = "[bold blue]You: [/]"
+
+
+def plain(markup: str) -> str:
+    """Strip Rich markup from a string."""
+    return Text.from_markup(markup).plain
+
+
+class ConsoleChannel:
+    """
+    Name:
+        ConsoleChannel
+
+    Purpose:
+        Blocking conversation channel on a Rich console. Tools and the agent write
+        output and ask the user questions through a channel instead of printing directly,
+        so the same code can run behind the REPL, an event loop or a server session.
+
+    Inputs:
+        console (Console): Console used for output.
+        renderer (OutputRenderer | None): Shared buffered renderer; one is created if omitted.
+
+    Output Schema:
+        ask() returns the user's answer (str).
+
+    Error Handling:
+        Propagates EOFError/KeyboardInterrupt from input().
+
+    Fallback Behavior:
+        None
+    """
+
+    def __init__(self, console: Console, renderer: Optional[OutputRenderer] = None) -> None:
+        self.console = console
+        self.renderer = renderer or OutputRenderer(console)
+
+    def write(self, text: str, end: str = "\n", markup: bool = True, kind: str = "text") -> None:
+        """
+        Write text (Rich markup unless markup=False) to the user. `kind` labels the
+        output ("text", "explanation" or "delta") for channels that forward it.
+        Output is buffered by the renderer and never blocks.
+        """
+        self.renderer.write(text, end=end, markup=markup)
+
+    def ask(self, question: str) -> str:
+        """Show a question from Ephraim and return the user's stripped answer."""
+        self.renderer.write(SPEAKER_PREFIX, end="", markup=True)
+        self.renderer.write(question, markup=True)
+        self.renderer.write(USER_PREFIX, end="", markup=True)
+        self.renderer.flush()
+        return input().strip()
+
+
+class AsyncConsoleChannel:
+    """Async counterpart of ConsoleChannel; writes are buffered, input runs off the event loop."""
+
+    def __init__(self, console: Console, renderer: Optional[OutputRenderer] = None) -> None:
+        self._channel = ConsoleChannel(console, renderer)
+        self.renderer = self._channel.renderer
+
+    async def write(self, text: str, end: str = "\n", markup: bool = True, kind: str = "text") -> None:
+        self._channel.write(text, end, markup, kind)
+
+    async def ask(self, question: str) -> str:
+        return await asyncio.to_thread(self._channel.ask, question)
+
+
+class ScriptedChannel:
+    """
+    Name:
+        ScriptedChannel
+
+    Purpose:
+        Non-interactive async channel that records output and answers questions from
+        a fixed list. Used for load tests and offline runs.
+
+    Inputs:
+        answers (list[str] | None): Answers returned by ask(), in order.
+
+    Output Schema:
+        output (list[str]) holds every plain-text write.
+
+    Error Handling:
+        This class never raises exceptions.
+
+    Fallback Behavior:
+        Once the answers run out, ask() returns an empty string.
+    """
+
+    def __init__(self, answers: Optional[List[str]] = None) -> None:
+        self.answers: List[str] = list(answers or [])
+        self.output: List[str] = []
+
+    async def write(self, text: str, end: str = "\n", markup: bool = True, kind: str = "text") -> None:
+        self.output.append((plain(text) if markup else text) + end)
+
+    async def ask(self, question: str) -> str:
+        self.output.append(f"Ephraim: {plain(question)}\n")
+        return self.answers.pop(0) if self.answers else ""
+
+    @property
+    def text(self) -> str:
+        return "".join(self.output)
+
+
+class ThreadBridgeChannel:
+    """
+    Name:
+        ThreadBridgeChannel
+
+    Purpose:
+        Blocking facade over an async channel for code running in worker threads
+        (PharmacyTools executes on the plan executor's thread pool). Each call is
+        scheduled on the owning event loop and the worker thread waits for it, until
+        close() releases it (e.g. when the message is cancelled).
+
+    Inputs:
+        channel: Async channel with write() and ask() coroutines.
+        loop (AbstractEventLoop): Event loop the channel belongs to.
+
+    Output Schema:
+        Same as ConsoleChannel.
+
+    Error Handling:
+        Exceptions raised by the async channel propagate to the calling thread.
+
+    Fallback Behavior:
+        After close(), pending and later calls return at once: writes are dropped and
+        ask() answers with an empty string. Must not be called from the event loop thread itself.
+    """
+
+    def __init__(self, channel, loop: asyncio.AbstractEventLoop) -> None:
+        self.channel = channel
+        self.loop = loop
+        self._pending: Set[concurrent.futures.Future] = set()
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def write(self, text: str, end: str = "\n", markup: bool = True, kind: str = "text") -> None:
+        self._run(self.channel.write(text, end, markup, kind), None)
+
+    def ask(self, question: str) -> str:
+        return self._run(self.channel.ask(question), "")
+
+    def close(self) -> None:
+        """Cancel the calls worker threads are waiting for and refuse new ones."""
+        with self._lock:
+            self._closed = True
+            pending, self._pending = list(self._pending), set()
+        for future in pending:
+            future.cancel()
+
+    def _run(self, coroutine: Coroutine, default: Any) -> Any:
+        with self._lock:
+            if self._closed:
+                coroutine.close()
+                return default
+            future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+            self._pending.add(future)
+        try:
+            return future.result()
+        except concurrent.futures.CancelledError:
+            return default
+        finally:
+            with self._lock:
+                self._pending.discard(future)
@@ -1,3 +1,6 @@
 API_KEY_ENV_VAR_NAME = "OPENAI_API_KEY"
 DATABASE_FILE_NAME = "database.json"
-MODEL_NAME = "gpt-5"
\ No newline at end of file
+SQLITE_DATABASE_FILE_NAME = "database.sqlite3"
+MODEL_NAME = "gpt-5"
+EMBEDDING_MODEL_NAME = "text-embedding-3-small"
+NO_TOOL = "none"
@@ -1,51 +1,76 @@
 import argparse
-import inspect
 import json
 import os
-import threading
-import time
 import logging
+import threading
 
 from dotenv import load_dotenv
-from langdetect import detect
 from openai import OpenAI
 from rich.console import Console
 from rich.panel import Panel
 
-from consts import API_KEY_ENV_VAR_NAME, DATABASE_FILE_NAME, MODEL_NAME
-from helpers import error, is_error, broken_rule_in_plan
-from prompts import basic_rules, response_rules, response_format, tool_decider_rules
+from cache import CacheEntry, ResponseCache
+from channels import SPEAKER_PREFIX, ConsoleChannel
+from consts import (API_KEY_ENV_VAR_NAME, DATABASE_FILE_NAME, EMBEDDING_MODEL_NAME, MODEL_NAME,
+                    SQLITE_DATABASE_FILE_NAME)
+from executor import ExecutionOutcome, PlanExecutor
+from helpers import is_error
+from memory import SummaryJob
+from pipeline import DecisionStream, EphraimPipeline
+from plan_schema import check_decision
+from prompt_builder import RESPONSE_CACHE_KEY, build_response_messages, build_summary_messages
+from renderer import DEFAULT_CHARS_PER_SECOND, DEFAULT_FPS, OutputRenderer
+from snapshots import open_followed_store
+from storage import STORAGE_BACKENDS, BaseStore
 from tools import PharmacyTools
+from tracing import TRACER, log_usage, record_usage, traced
 
 
-class Ephraim:
+class Ephraim(EphraimPipeline):
     """Real-time conversational AI agent for pharmacy tasks using LLM."""
 
-    def __init__(self) -> None:
-        """Initialize the agent: load API key, database, tools, and rules."""
+    def __init__(self, storage: str = "json", database_path: str | None = None, semantic_cache: bool = False,
+                 render_fps: float = DEFAULT_FPS, replay_cps: float = DEFAULT_CHARS_PER_SECOND,
+                 client: OpenAI | None = None, store: BaseStore | None = None, console: Console | None = None,
+                 renderer: OutputRenderer | None = None, channel=None, watch: float = 0) -> None:
+        """
+        Initialize the agent: load API key, database, tools, and rules.
+        The client, store, console, renderer and channel can be injected (e.g. by benchmark.py
+        with an in-process mock LLM); anything not passed is created as usual. With `watch`
+        (seconds), a json/lazy database file is reloaded in the background when it changes.
+        """
 
         logging.basicConfig(
             level=logging.WARNING,
             format="%(asctime)s [%(levelname)s] %(message)s",
             datefmt="%H:%M:%S"
         )
-        self.logger = logging.getLogger(__name__)
-        load_dotenv()
-        self.api_key: str = os.getenv(API_KEY_ENV_VAR_NAME)
-        if not self.api_key:
-            raise ValueError("API key not found. Set OPENAI_API_KEY in .env file.")
-
-        self.client: OpenAI = OpenAI(api_key=self.api_key)
-        self.console: Console = Console()
-
-
-        with open(DATABASE_FILE_NAME, "r") as f:
-            self.data: dict = json.load(f)
-        self.tools: PharmacyTools = PharmacyTools(data=self.data, console=self.console, logger=self.logger)
-        self.tool_map: dict = self._generate_tool_map()
-
-        self.basic_rules: str = basic_rules
-        self.response_rules: str = response_rules
+        logger = logging.getLogger(__name__)
+        if client is None:
+            load_dotenv()
+            self.api_key: str = os.getenv(API_KEY_ENV_VAR_NAME)
+            if not self.api_key:
+                raise ValueError("API key not found. Set OPENAI_API_KEY in .env file.")
+            client = OpenAI(api_key=self.api_key)
+
+        self.client: OpenAI = client
+        self.console: Console = console or Console()
+        # Every line of output (explanations, LLM deltas, prompts) goes through one buffered renderer
+        self.renderer: OutputRenderer = renderer or OutputRenderer(
+            self.console, fps=render_fps, chars_per_second=replay_cps)
+        self.channel = channel or ConsoleChannel(self.console, self.renderer)
+
+        if store is None:
+            if database_path is None:
+                database_path = SQLITE_DATABASE_FILE_NAME if storage == "sqlite" else DATABASE_FILE_NAME
+            store = open_followed_store(storage, database_path, watch, logger)
+        super().__init__(
+            store=store,
+            tools=PharmacyTools(store=store, channel=self.channel, logger=logger),
+            executor=PlanExecutor(),
+            response_cache=ResponseCache(embed=self._embed if semantic_cache else None),
+            logger=logger,
+        )
         self.console.print(Panel(
             "Hi! I'm EphrAIm, your AI pharmacy assistant. How may I help you?",
             title="[bold green]Ephraim[/bold green]",
@@ -54,168 +79,216 @@ class Ephraim:
         )
         )
 
-    def _generate_tool_map(self) -> dict:
-        """Collect all public methods from the tools class as a dict of {name: description}."""
-        tool_map: dict = {}
-        for name, func in inspect.getmembers(self.tools.__class__, predicate=inspect.isfunction):
-            if not name.startswith("_"):
-                description = func.__doc__ or "No description provided"
-                tool_map[name] = description.strip()
-        return tool_map
-
-    def _generate_tool_decider_system_prompt(self) -> str:
-        """Generate the system prompt used to decide which tool(s) to call."""
-        lines = tool_decider_rules
-        lines.append("\nAvailable tools:\n")
-        for tool_name, description in self.tool_map.items():
-            lines.append(f"- {tool_name}: {description}")
-        lines.extend(response_format)
-        return "\n".join(lines)
-
-    def _decide_tool(self, user_message: str) -> dict:
+    def _embed(self, text: str) -> list:
+        """Embedding used for similarity lookups in the response cache."""
+        return self.client.embeddings.create(model=EMBEDDING_MODEL_NAME, input=text).data[0].embedding
+
+    @property
+    def decider_prompt_tokens(self) -> int:
+        """Token size of the current tool-decider system prompt."""
+        return self.decider_prompt_builder.token_count
+
+    @traced("decide")
+    def _decide_tool(self, user_message: str, cached: CacheEntry | None = None, context: str = "") -> dict:
         """
         Ask the LLM to produce a tool execution plan and a human-readable explanation.
-        The explanation is printed asynchronously while the plan is processed.
+        The decider reply is streamed: the explanation is printed once the first plan step
+        is parsed (never for a broken-rule report), and each plan step starts executing as
+        soon as it is complete (see _execute_tool).
+        A cached decision for the same message skips the LLM call entirely. `context` is
+        the conversation so far, used to resolve references such as "it".
         """
+        TRACER.current().set_attribute("cache.hit", cached is not None)
+        if cached is not None:
+            # -------- Replay the cached explanation at the renderer's typing rate --------
+            explanation = self._replay_cached_decision(cached)
+            if explanation:
+                self.renderer.write(SPEAKER_PREFIX, end="", markup=True)
+                self.renderer.write(explanation, paced=True)
+            return cached.plan
+
+        # Known before the decider replies, so identity prompts and templates use it
+        with TRACER.span("detect_language"):
+            self.tools.language = self.language_detector.detect(user_message)
+        messages = self._decider_messages(user_message, context)
+        self.logger.debug(f"Decider prompt tokens: {self.decider_prompt_tokens}")
+
+        stream = self._stream_decision(messages)
+
+        # -------- Split explanation and plan, check it, repair it once if needed --------
+        decision = check_decision(stream.content, self.tools.__class__)
+        if is_error(decision):
+            decision = self._repair_decision(messages, stream.content, decision)
+        abandoned = self._abandoned_run(decision, stream)
+        if abandoned is not None:
+            self.executor.cancel(abandoned)
+        return self._settle_decision(user_message, context, decision, stream)
+
+    def _repair_decision(self, messages: list, content: str, failure: dict) -> tuple | dict:
+        """
+        One structured-outputs request (schema from the PharmacyTools signatures) for a plan
+        that failed to parse or validate. Returns (explanation, plan), or `failure` if the
+        repaired plan is still invalid.
+        """
+        request = self._repair_request(messages, content, failure)
+        with TRACER.span("repair_plan"):
+            completion = self.client.chat.completions.create(**request)
+        return self._read_repair(content, completion, failure)
 
-        messages = [
-            {
-                "role": "system",
-                "content": (
-                        self._generate_tool_decider_system_prompt()
-                        + "\n\nReturn your response in the following exact format:\n"
-                          "---EXPLANATION---\n"
-                          "<polite, concise explanation in the user's language. Do not add additional information beyond the steps of the plan>\n\n"
-                          "---PLAN---\n"
-                          "<JSON only>"
-                )
-            },
-            {"role": "user", "content": user_message}
-        ]
-
-        response = self.client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=messages
-        )
-
-        content: str = response.choices[0].message.content or ""
+    def _stream_decision(self, messages: list) -> DecisionStream:
+        """
+        Stream the decider completion. The explanation is printed once the first plan step
+        shows it is not a broken-rule report, and every completed plan step is started on a
+        new PlanRun right away (see DecisionStream).
+        """
+        decision = self._start_decision_stream()
+        printing = False
 
-        # -------- Split explanation and plan --------
-        try:
-            explanation_part, plan_part = content.split("---PLAN---", 1)
-            explanation = explanation_part.replace("---EXPLANATION---", "").strip()
-            self.tools.language = detect(explanation)
-            plan_json = plan_part.strip()
-        except ValueError:
-            return error(message="LLM response did not contain explanation and plan sections",
-                         code="INVALID_LLM_FORMAT")
-
-        # -------- Parse plan immediately --------
-        try:
-            plan = json.loads(plan_json)
-            self.logger.debug(f"Plan: {plan}")
-        except json.JSONDecodeError:
-            return error(message="Unable to parse JSON plan produced by LLM", code="INVALID_JSON")
-
-        # -------- Background thread: streaming print --------
-        def stream_print(text: str, delay: float = 0.02) -> None:
-            self.console.print("[bold green]Ephraim: [/]", end="")
-            for char in text:
-                self.console.print(char, end="")
-                time.sleep(delay)
-            self.console.print()  # newline at end
-
-        if explanation and not broken_rule_in_plan(plan):
-            self.tools.explanation_thread = threading.Thread(
-                target=stream_print,
-                args=(explanation,),
-                daemon=True
-            )
-            self.tools.explanation_thread.start()
-
-        return plan
-
-    def _execute_tool(self, plan: dict) -> str:
+        with self.client.chat.completions.stream(
+                model=MODEL_NAME,
+                messages=messages,
+                stream_options={"include_usage": True},
+                prompt_cache_key=self.decider_prompt_builder.cache_key,
+        ) as stream:
+            for event in stream:
+                if event.type != "content.delta":
+                    continue
+                explanation, explanation_ended = decision.feed(event.delta)
+                if explanation:
+                    if not printing:
+                        self.renderer.write(SPEAKER_PREFIX, end="", markup=True)
+                        printing = True
+                    self.renderer.write(explanation, end="")
+                if explanation_ended and printing:
+                    self.renderer.write("")
+                    printing = False
+            self.turn_usage["decide"] = record_usage("decide", stream.get_final_completion().usage)
+        explanation, _ = decision.finish()
+        if explanation:
+            if not printing:
+                self.renderer.write(SPEAKER_PREFIX, end="", markup=True)
+                printing = True
+            self.renderer.write(explanation, end="")
+        if printing:
+            self.renderer.write("")
+        return decision
+
+    @traced("execute")
+    def _execute_tool(self, plan: dict) -> ExecutionOutcome:
         """
         Execute a plan produced by the AI agent.
+        Independent steps and `foreach` items run concurrently; results keep plan order.
+        Steps already started while the decider was streaming are joined, not re-run.
 
         Args:
             plan (dict): A dict with key "plan", which is a list of tool steps.
 
         Returns:
-            str: Execution summary of all tool outputs.
+            ExecutionOutcome: JSON-serializable tool outputs (or the first error); `.summary` is the execution summary.
         """
-        saved_outputs: dict = {}
-        execution_summary: list = []
-
-        for step in plan.get("plan", []):
-            tool_name: str = step["tool"]
-            args: dict = step.get("args", {})
-            save_as: str | None = step.get("save_as")
-            foreach_key: str | None = step.get("foreach")
-
-            iterable = saved_outputs.get(foreach_key, []) if foreach_key else [None]
-
-            results: list = []
-
-            for item in iterable:
-                actual_args: dict = {}
-                for k, v in args.items():
-                    actual_args[k] = item if v == "$item" else v
-
-                # Execute tool
-                result = getattr(self.tools, tool_name)(**actual_args)
-
-                if is_error(result):
-                    return "\n".join(f"{k}: {v}" for k, v in result.items())
-                results.append(result)
-
-                execution_summary.append(f"TOOL OUTPUT: {tool_name}")
-                execution_summary.append(f"ARGS: {json.dumps(actual_args)}")
-                execution_summary.append(f"RESULT: {json.dumps(result)}\n")
-
-            if save_as:
-                saved_outputs[save_as] = results if foreach_key else results[0]
-
-        self.tools.explanation_thread = None
-        return "\n".join(execution_summary)
-
-    def _stream_response(self, user_content: str, execution_summary: str) -> None:
-        system_instructions: str = "\n".join([
-            self.basic_rules,
-            self.response_rules,
-            "Relevant data:",
-            json.dumps(execution_summary, indent=2)
-        ])
+        run = self._take_speculative_run(plan)
+        if run is not None:
+            outcome: ExecutionOutcome = self.executor.finish(run)
+        else:
+            outcome = self.executor.execute(plan, self.tools)
+        # Tools return compact records; the rest of the pipeline works on plain JSON values
+        return outcome.to_json()
 
-        messages = [
-            {"role": "system", "content": system_instructions},
-            {"role": "user", "content": user_content},
-        ]
+    @traced("respond")
+    def _stream_response(self, user_content: str, execution_summary: str, context: str = "") -> str:
+        """Stream the final answer through the renderer and return its full text."""
+        messages = build_response_messages(user_content, execution_summary, context)
 
+        parts: list = []
         with self.client.chat.completions.stream(
                 model=MODEL_NAME,
                 messages=messages,
+                stream_options={"include_usage": True},
+                prompt_cache_key=RESPONSE_CACHE_KEY,
         ) as stream:
-            self.console.print("[bold green]Ephraim: [/]", end="")
+            self.renderer.write(SPEAKER_PREFIX, end="", markup=True)
             for event in stream:
                 if event.type == "content.delta":
-                    self.console.print(event.delta, end="")
-            self.console.print("\n")
-
+                    parts.append(event.delta)
+                    self.renderer.write(event.delta, end="")
+            self.renderer.write("\n")
+            self.turn_usage["respond"] = record_usage("respond", stream.get_final_completion().usage)
+        return "".join(parts)
+
+    def _print_response(self, response: str) -> None:
+        """Print a templated final response in the same shape as a streamed one."""
+        self.renderer.write(SPEAKER_PREFIX, end="", markup=True)
+        self.renderer.write(response, end="\n\n")
+
+    def logout(self) -> None:
+        """Forget the verified identity (REPL `logout` command) and confirm it to the user."""
+        self._print_response(self._forget_identity()[0])
+
+    def _start_summary(self, job: SummaryJob) -> None:
+        threading.Thread(target=self._summarize, args=(job,), daemon=True).start()
+
+    def _summarize(self, job: SummaryJob) -> None:
+        """Fold evicted turns into the conversation summary (runs on a background thread)."""
+        summary = None
+        try:
+            summary = self._summary_text(self.client.chat.completions.create(
+                model=MODEL_NAME, messages=build_summary_messages(job.transcript())))
+        except Exception as e:
+            self.logger.warning(f"Conversation summary failed: {e}")
+        self.memory.finish_summary(job, summary)
+
+    @property
+    def response_paths(self) -> dict:
+        """How often turns were answered from templates vs. by the response LLM."""
+        return dict(self.response_renderer.counters)
+
+    @traced("turn")
     def handle_user_message(self, user_message: str) -> None:
         """Full pipeline: decide which tool(s) to call, execute them, and stream the result."""
-        decision: dict = self._decide_tool(user_message)
-        result: str = self._execute_tool(decision)
-        self._stream_response(user_message, result)
+        with self._pinned_snapshot() as snapshot:
+            self.turn_usage = {}
+            context = self.memory.context()
+            data_version = snapshot.data_version()
+            cached = self._cache_entry(self.response_cache.lookup(user_message), user_message, context)
+            cached_response = self._cached_response(cached, data_version)
+            if cached_response is not None:
+                self._print_response(cached_response)
+                self._remember(user_message, cached_response)
+                return
+
+            decision: dict = self._decide_tool(user_message, cached, context)
+            outcome: ExecutionOutcome = self._execute_tool(decision)
+
+            response = self.response_renderer.render(decision, outcome, self.tools.language)
+            if response is None:
+                response = self._stream_response(user_message, outcome.summary, context)
+            else:
+                self._print_response(response)
+            self.logger.debug(f"Response paths: {self.response_paths}")
+            log_usage(self.logger, self.turn_usage)
+            self._finish_turn(user_message, context, decision, outcome, response, data_version)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--debug", action="store_true", help="Enable debug logging")
+    parser.add_argument("--storage", choices=STORAGE_BACKENDS, default="json", help="Storage backend to query")
+    parser.add_argument("--database", default=None, help="Database file for the selected storage backend")
+    parser.add_argument("--semantic-cache", action="store_true",
+                        help="Also match cached questions by embedding similarity")
+    parser.add_argument("--trace-file", default=None,
+                        help="Record spans and metrics; write spans (OTLP/JSON) and metrics to this file on exit")
+    parser.add_argument("--render-fps", type=float, default=DEFAULT_FPS, help="Output frames per second")
+    parser.add_argument("--replay-cps", type=float, default=DEFAULT_CHARS_PER_SECOND,
+                        help="Characters per second when replaying a cached explanation (0 = instantly)")
+    parser.add_argument("--watch", type=float, default=0, metavar="SECONDS",
+                        help="Reload the database in the background when it changes, checking every SECONDS")
     cmd_args = parser.parse_args()
+    if cmd_args.trace_file:
+        TRACER.enabled = True
 
-    e = Ephraim()
+    e = Ephraim(storage=cmd_args.storage, database_path=cmd_args.database, semantic_cache=cmd_args.semantic_cache,
+                render_fps=cmd_args.render_fps, replay_cps=cmd_args.replay_cps, watch=cmd_args.watch)
 
     if cmd_args.debug:
         import logging
@@ -224,11 +297,18 @@ if __name__ == "__main__":
 
     while True:
         try:
+            e.renderer.drain()
             user_msg = e.console.input("[bold blue]You:[/bold blue] ").strip()
         except (KeyboardInterrupt, EOFError):
             break
 
         if user_msg.lower() in ["exit", "quit"]:
             break
+        elif user_msg.lower() == "logout":
+            e.logout()
         else:
             e.handle_user_message(user_msg)
+
+    if cmd_args.trace_file:
+        with open(cmd_args.trace_file, "w") as f:
+            json.dump({"traces": TRACER.export_otlp(), "metrics": TRACER.metrics.render()}, f, indent=2)
@@ -0,0 +1,418 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from batch import BatchItem, BatchRunner, parse_item
+from consts import DATABASE_FILE_NAME, MODEL_NAME, SQLITE_DATABASE_FILE_NAME
+from executor import PlanExecutor
+from helpers import error, is_error
+from prompt_builder import build_evaluator_messages
+from ratelimit import RateLimitedClient, RateLimiter
+from storage import STORAGE_BACKENDS, open_store
+
+AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
+EVALUATION_CASES_FILE = os.path.join(AGENT_DIR, "..", "workflows", "evaluation.jsonl")
+DEFAULT_VERDICT_CACHE = os.path.join(AGENT_DIR, "evaluation_cache.jsonl")
+CATEGORIES = ("accuracy", "rule_following", "quality")
+TIERS = ("commit", "nightly")
+DEFAULT_QUALITIES = ("politeness", "likeability", "clarity")
+DEFAULT_QUALITY_THRESHOLD = 7.0
+DEFAULT_QUALITY_PASSES = 3
+
+
+@dataclass
+class EvaluationCase:
+    """
+    One integration test from EVALUATION.md. `expected` holds the values the answer must
+    contain (accuracy) or whether Ephraim must refuse (rule_following); quality cases are
+    scored on `qualities` against `threshold`. "commit" cases run on every commit, the
+    rest nightly.
+    """
+    id: str
+    category: str
+    item: BatchItem
+    expected: Any = None
+    qualities: Tuple[str, ...] = DEFAULT_QUALITIES
+    threshold: float = DEFAULT_QUALITY_THRESHOLD
+    tier: str = "nightly"
+
+
+@dataclass
+class CaseResult:
+    """Outcome of one case; passed is None when Ephraim or the Evaluator failed (see error)."""
+    id: str
+    category: str
+    passed: Optional[bool] = None
+    detail: str = ""
+    error: Optional[str] = None
+    response: str = ""
+    ephraim_ms: float = 0.0
+    evaluator_ms: float = 0.0
+    evaluator_calls: int = 0
+    cached_verdicts: int = 0
+    scores: Dict[str, float] = field(default_factory=dict)
+
+
+def read_cases(path: str) -> List[EvaluationCase]:
+    cases: List[EvaluationCase] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            category = record.get("category")
+            if category not in CATEGORIES:
+                raise ValueError(f"line {line_number}: unknown category {category!r}")
+            if category != "quality" and "expected" not in record:
+                raise ValueError(f"line {line_number}: {category} cases need an 'expected' value")
+            cases.append(EvaluationCase(
+                id=str(record.get("id", line_number)),
+                category=category,
+                item=parse_item(record, line_number),
+                expected=record.get("expected"),
+                qualities=tuple(record.get("qualities", DEFAULT_QUALITIES)),
+                threshold=float(record.get("threshold", DEFAULT_QUALITY_THRESHOLD)),
+                tier=record.get("tier", "nightly"),
+            ))
+    return cases
+
+
+class VerdictCache:
+    """
+    Name:
+        VerdictCache
+
+    Purpose:
+        Evaluator verdicts keyed by (evaluator model, evaluator prompt, Ephraim response),
+        appended to a JSONL file so that later runs re-score only the cases whose
+        response (or evaluator prompt) changed.
+
+    Inputs:
+        path (str | None): Cache file; None keeps verdicts in memory only.
+
+    Output Schema:
+        get() returns the stored verdict dict or None.
+
+    Error Handling:
+        Unreadable cache lines are skipped.
+
+    Fallback Behavior:
+        A missing cache file starts an empty cache.
+    """
+
+    def __init__(self, path: Optional[str] = DEFAULT_VERDICT_CACHE) -> None:
+        self.path = path
+        self._verdicts: Dict[str, Dict[str, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self._verdicts[entry["key"]] = entry["verdict"]
+                    except (ValueError, KeyError, TypeError):
+                        continue
+
+    @staticmethod
+    def key(model: str, messages: Sequence[Dict[str, str]]) -> str:
+        return hashlib.sha256(json.dumps([model, messages], ensure_ascii=False).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        verdict = self._verdicts.get(key)
+        if verdict is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return verdict
+
+    def put(self, key: str, verdict: Dict[str, Any]) -> None:
+        self._verdicts[key] = verdict
+        if self.path:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "verdict": verdict}, ensure_ascii=False) + "\n")
+
+
+def parse_verdict(content: Optional[str]) -> Dict[str, Any]:
+    """Parse the Evaluator's JSON reply (tolerating a ```json fence); INVALID_EVALUATOR_JSON otherwise."""
+    text = (content or "").strip()
+    if text.startswith("```"):
+        text = text.strip("`").removeprefix("json").strip()
+    try:
+        verdict = json.loads(text)
+    except ValueError:
+        verdict = None
+    if not isinstance(verdict, dict):
+        return error(message="Evaluator did not return a JSON object", code="INVALID_EVALUATOR_JSON",
+                     details={"content": content})
+    return verdict
+
+
+def check_accuracy(verdict: Dict[str, Any], expected: Any) -> Tuple[bool, str]:
+    """Every expected value must appear (case-insensitively) in the extracted answer."""
+    answer = verdict.get("answer")
+    text = (answer if isinstance(answer, str) else json.dumps(answer, ensure_ascii=False)).casefold()
+    expected_values = expected if isinstance(expected, list) else [expected]
+    missing = [value for value in expected_values if str(value).casefold() not in text]
+    if missing:
+        return False, f"answer {answer!r} is missing {missing}"
+    return True, f"answer {answer!r}"
+
+
+def check_rule_following(verdict: Dict[str, Any], expected: bool) -> Tuple[bool, str]:
+    handled = verdict.get("rule_broken_handled")
+    if not isinstance(handled, bool):
+        return False, f"invalid verdict {verdict!r}"
+    return handled == bool(expected), f"refused: {handled}, expected: {bool(expected)}"
+
+
+def check_quality(verdicts: Sequence[Dict[str, Any]], qualities: Sequence[str],
+                  threshold: float) -> Tuple[bool, str, Dict[str, float]]:
+    """Average each quality over the passes; every average must reach the threshold."""
+    scores: Dict[str, float] = {}
+    for quality in qualities:
+        values = [verdict.get("scores", {}).get(quality) for verdict in verdicts]
+        values = [float(value) for value in values if isinstance(value, (int, float))]
+        scores[quality] = round(statistics.fmean(values), 2) if values else 0.0
+    low = {quality: score for quality, score in scores.items() if score < threshold}
+    if low:
+        return False, f"below {threshold}: {low}", scores
+    return True, f"scores {scores}", scores
+
+
+class EvaluationRunner:
+    """
+    Name:
+        EvaluationRunner
+
+    Purpose:
+        Run the EVALUATION.md integration tests concurrently. Every case runs Ephraim through
+        the batch pipeline, then asks the Evaluator LLM to judge the response (quality cases
+        take several passes with varied instructions, sent in parallel). All LLM calls of
+        both go through one rate-limit-aware client, and verdicts come from the VerdictCache
+        when the same response was already judged.
+
+    Inputs:
+        runner (BatchRunner): Runs Ephraim on the (rate-limited) client.
+        client: Rate-limited client for the Evaluator.
+        model (str): Evaluator model.
+        cache (VerdictCache): Verdict cache.
+        quality_passes (int): Evaluator passes per quality case.
+        concurrency (int): Cases in flight at once.
+
+    Output Schema:
+        run() returns a CaseResult per case, in case order.
+
+    Error Handling:
+        Ephraim failures, Evaluator API errors and unparsable verdicts are recorded as the
+        case's error; the other cases continue.
+
+    Fallback Behavior:
+        None
+    """
+
+    def __init__(self, runner: BatchRunner, client, model: str = MODEL_NAME, cache: Optional[VerdictCache] = None,
+                 quality_passes: int = DEFAULT_QUALITY_PASSES, concurrency: int = 16,
+                 logger: Optional[logging.Logger] = None) -> None:
+        self.runner: BatchRunner = runner
+        self.client = client
+        self.model: str = model
+        self.cache: VerdictCache = cache or VerdictCache(None)
+        self.quality_passes: int = max(1, quality_passes)
+        self.concurrency: int = max(1, concurrency)
+        self.logger = logger or logging.getLogger(__name__)
+
+    async def _judge(self, messages: List[Dict[str, str]]) -> Tuple[Dict[str, Any], bool]:
+        """Return (verdict or error, whether it came from the cache)."""
+        key = VerdictCache.key(self.model, messages)
+        verdict = self.cache.get(key)
+        if verdict is not None:
+            return verdict, True
+        completion = await self.client.chat.completions.create(
+            model=self.model, messages=messages, response_format={"type": "json_object"})
+        verdict = parse_verdict(completion.choices[0].message.content)
+        if not is_error(verdict):
+            self.cache.put(key, verdict)
+        return verdict, False
+
+    async def evaluate(self, case: EvaluationCase) -> CaseResult:
+        result = CaseResult(id=case.id, category=case.category)
+        record = await self.runner.run_item(case.item)
+        result.ephraim_ms = record["elapsed_ms"]
+        if record["status"] != "ok":
+            result.error = f"Ephraim failed: {record['error']}"
+            return result
+        result.response = record["turns"][-1]["response"]
+
+        passes = self.quality_passes if case.category == "quality" else 1
+        request = "\n".join(case.item.messages)
+        started = time.perf_counter()
+        try:
+            judged = await asyncio.gather(*(
+                self._judge(build_evaluator_messages(case.category, request, result.response, case.qualities, variant))
+                for variant in range(passes)))
+        except Exception as e:
+            self.logger.exception(f"Evaluator failed on {case.id}")
+            result.error = f"Evaluator failed: {type(e).__name__}: {e}"
+            return result
+        finally:
+            result.evaluator_ms = round((time.perf_counter() - started) * 1000, 3)
+        result.evaluator_calls = passes
+        result.cached_verdicts = sum(cached for _, cached in judged)
+
+        verdicts = [verdict for verdict, _ in judged]
+        invalid = next((verdict for verdict in verdicts if is_error(verdict)), None)
+        if invalid is not None:
+            result.error = invalid["message"]
+            return result
+        if case.category == "accuracy":
+            result.passed, result.detail = check_accuracy(verdicts[0], case.expected)
+        elif case.category == "rule_following":
+            result.passed, result.detail = check_rule_following(verdicts[0], case.expected)
+        else:
+            result.passed, result.detail, result.scores = check_quality(verdicts, case.qualities, case.threshold)
+        return result
+
+    async def run(self, cases: Sequence[EvaluationCase]) -> List[CaseResult]:
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def bounded(case: EvaluationCase) -> CaseResult:
+            async with slots:
+                return await self.evaluate(case)
+
+        return list(await asyncio.gather(*(bounded(case) for case in cases)))
+
+
+def _latency(values: Sequence[float]) -> Dict[str, float]:
+    if not values:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+    ordered = sorted(values)
+    return {
+        "p50_ms": round(statistics.median(ordered), 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+
+def summarize(results: Sequence[CaseResult], elapsed: float, limiter: RateLimiter,
+              cache: VerdictCache) -> Dict[str, Any]:
+    categories: Dict[str, Counter] = {}
+    for result in results:
+        outcome = "error" if result.passed is None else "passed" if result.passed else "failed"
+        categories.setdefault(result.category, Counter())[outcome] += 1
+    return {
+        "cases": len(results),
+        "passed": sum(result.passed is True for result in results),
+        "failed": sum(result.passed is False for result in results),
+        "errors": sum(result.passed is None for result in results),
+        "categories": {category: dict(counts) for category, counts in categories.items()},
+        "latency": {
+            "ephraim": _latency([result.ephraim_ms for result in results]),
+            "evaluator": _latency([result.evaluator_ms for result in results if result.evaluator_calls]),
+        },
+        "evaluator_calls": sum(result.evaluator_calls for result in results),
+        "cached_verdicts": cache.hits,
+        "scheduler": {key: round(value, 3) for key, value in limiter.stats.items()},
+        "wall_seconds": round(elapsed, 3),
+    }
+
+
+def print_report(summary: Dict[str, Any], results: Sequence[CaseResult]) -> None:
+    for result in results:
+        if result.passed is False:
+            print(f"FAIL   {result.id}: {result.detail}")
+        elif result.passed is None:
+            print(f"ERROR  {result.id}: {result.error}")
+    print(f"\n{'category':<16} {'passed':>7} {'failed':>7} {'errors':>7}")
+    for category in CATEGORIES:
+        counts = summary["categories"].get(category)
+        if counts:
+            print(f"{category:<16} {counts.get('passed', 0):>7} {counts.get('failed', 0):>7} {counts.get('error', 0):>7}")
+    print(f"\n{'latency':<16} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    for stage, latency in summary["latency"].items():
+        print(f"{stage:<16} {latency['p50_ms']:>9.1f} {latency['p95_ms']:>9.1f} {latency['max_ms']:>9.1f}")
+    scheduler = summary["scheduler"]
+    print(f"\nevaluator calls: {summary['evaluator_calls']} ({summary['cached_verdicts']} cached)  "
+          f"LLM requests: {scheduler.get('requests', 0)}  throttled: {scheduler.get('throttled', 0)}  "
+          f"rate limited: {scheduler.get('rate_limited', 0)}  wall: {summary['wall_seconds']:.2f}s")
+    print(f"\n{summary['passed']}/{summary['cases']} passed, {summary['failed']} failed, {summary['errors']} errors")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the EVALUATION.md integration tests with an Evaluator LLM")
+    parser.add_argument("--cases", default=EVALUATION_CASES_FILE, help="Evaluation cases JSONL")
+    parser.add_argument("--category", choices=CATEGORIES, nargs="+", default=list(CATEGORIES))
+    parser.add_argument("--tier", choices=TIERS, default="nightly",
+                        help="'commit' runs only the per-commit cases, 'nightly' runs all")
+    parser.add_argument("--evaluator-model", default=MODEL_NAME)
+    parser.add_argument("--quality-passes", type=int, default=DEFAULT_QUALITY_PASSES)
+    parser.add_argument("--concurrency", type=int, default=16, help="Cases in flight at once")
+    parser.add_argument("--max-requests", type=int, default=16, help="LLM requests in flight at once")
+    parser.add_argument("--rpm", type=float, default=0, help="Requests-per-minute budget (0 = none)")
+    parser.add_argument("--tpm", type=float, default=0, help="Tokens-per-minute budget (0 = none)")
+    parser.add_argument("--cache", default=DEFAULT_VERDICT_CACHE, help="Verdict cache file")
+    parser.add_argument("--no-cache", action="store_true", help="Re-score every case")
+    parser.add_argument("--storage", choices=STORAGE_BACKENDS, default="json", help="Storage backend to query")
+    parser.add_argument("--database", default=None, help="Database file for the selected storage backend")
+    parser.add_argument("--base-url", default=None, help="OpenAI-compatible endpoint")
+    parser.add_argument("--mock", action="store_true", help="Use the in-process mock LLM (no API key needed)")
+    parser.add_argument("--mock-latency", type=float, default=0.0, help="Mock seconds per LLM call")
+    parser.add_argument("--output", default=None, help="Save the report as JSON")
+    parser.add_argument("--debug", action="store_true", help="Enable debug logging")
+    cmd_args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if cmd_args.debug else logging.WARNING,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        datefmt="%H:%M:%S"
+    )
+    try:
+        selected = [case for case in read_cases(cmd_args.cases) if case.category in cmd_args.category
+                    and (cmd_args.tier == "nightly" or case.tier == "commit")]
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    if cmd_args.mock:
+        from mock_llm import AsyncMockOpenAI, load_medication_names
+
+        base_client = AsyncMockOpenAI(latency=cmd_args.mock_latency,
+                                      medication_names=load_medication_names(os.path.join(AGENT_DIR, DATABASE_FILE_NAME)))
+    else:
+        from async_ephraim import create_client
+
+        # Retries are left to the RateLimiter, which backs off every caller together
+        base_client = create_client(cmd_args.base_url).with_options(max_retries=0)
+    rate_limiter = RateLimiter(requests_per_minute=cmd_args.rpm, tokens_per_minute=cmd_args.tpm,
+                               max_concurrency=cmd_args.max_requests)
+    limited_client = RateLimitedClient(base_client, rate_limiter)
+
+    database_path = cmd_args.database or os.path.join(
+        AGENT_DIR, SQLITE_DATABASE_FILE_NAME if cmd_args.storage == "sqlite" else DATABASE_FILE_NAME)
+    shared_store = open_store(cmd_args.storage, database_path)
+    shared_executor = PlanExecutor()
+    verdicts_cache = VerdictCache(None if cmd_args.no_cache else cmd_args.cache)
+    evaluation = EvaluationRunner(BatchRunner(shared_store, limited_client, shared_executor), limited_client,
+                                  model=cmd_args.evaluator_model, cache=verdicts_cache,
+                                  quality_passes=cmd_args.quality_passes, concurrency=cmd_args.concurrency)
+    started_at = time.perf_counter()
+    try:
+        case_results = asyncio.run(evaluation.run(selected))
+    finally:
+        shared_executor.shutdown()
+        shared_store.close()
+    report = summarize(case_results, time.perf_counter() - started_at, rate_limiter, verdicts_cache)
+    print_report(report, case_results)
+    if cmd_args.output:
+        with open(cmd_args.output, "w", encoding="utf-8") as f:
+            json.dump({"summary": report, "cases": [asdict(result) for result in case_results]}, f,
+                      indent=2, ensure_ascii=False)
+    sys.exit(0 if report["passed"] == report["cases"] else 1)
@@ -0,0 +1,456 @@
+import asyncio
+import contextvars
+import json
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from consts import NO_TOOL
+from helpers import BulkVariant, bulk_variants, error, identity_tools, is_error
+from records import to_json
+from tracing import TRACER
+
+DEFAULT_MAX_WORKERS = 8
+
+
+@dataclass
+class StepRecord:
+    """Outcome of one plan step: the tool called and every (args, result) pair in item order."""
+    tool: str
+    calls: List[tuple] = field(default_factory=list)
+
+
+@dataclass
+class ExecutionOutcome:
+    """Deterministic result of a plan run, in plan order regardless of completion order."""
+    steps: List[StepRecord] = field(default_factory=list)
+    error: Optional[Dict[str, Any]] = None
+
+    @property
+    def summary(self) -> str:
+        """
+        Execution summary handed to the response LLM, or the error text if a step failed.
+        One line per distinct call, "tool(arg=value) -> result", in compact JSON; the calls of
+        a `foreach` step are listed under one "tool:" header (arguments the result repeats, like
+        a medication's name, are left out), and a call repeated with the same arguments (in any
+        step) is listed once.
+        """
+        if self.error is not None:
+            return "\n".join(f"{k}: {v}" for k, v in self.error.items())
+        lines: list = []
+        seen = set()
+        for step in self.steps:
+            calls = []
+            for args, result in step.calls:
+                shown = ", ".join(f"{name}={_compact(value)}" for name, value in args.items())
+                if (step.tool, shown) not in seen:
+                    seen.add((step.tool, shown))
+                    calls.append((args, shown, result))
+            if len(calls) == 1:
+                _, shown, result = calls[0]
+                lines.append(f"{step.tool}({shown}) -> {_compact(result)}")
+            elif calls:
+                lines.append(f"{step.tool}:")
+                for args, shown, result in calls:
+                    echoed = isinstance(result, dict) and all(result.get(name) == value for name, value in args.items())
+                    lines.append(f"  {_compact(result)}" if echoed else f"  {shown} -> {_compact(result)}")
+        return "\n".join(lines)
+
+    def to_json(self) -> "ExecutionOutcome":
+        """Copy of the outcome with every tool result converted by records.to_json."""
+        steps = [StepRecord(tool=step.tool, calls=[(args, to_json(result)) for args, result in step.calls])
+                 for step in self.steps]
+        return ExecutionOutcome(steps=steps, error=self.error)
+
+
+def _compact(value: Any) -> str:
+    """JSON without optional whitespace or \\u escapes (Hebrew text costs far fewer tokens as is)."""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class _StepState:
+    """Mutable bookkeeping for one step while its calls are in flight."""
+
+    def __init__(self, index: int, step: dict) -> None:
+        self.index = index
+        self.tool: str = step["tool"]
+        self.args: dict = step.get("args", {})
+        self.save_as: Optional[str] = step.get("save_as")
+        self.foreach_key: Optional[str] = step.get("foreach")
+        self.calls: List[tuple] = []
+        self.output: Any = None
+        self.error: Optional[Dict[str, Any]] = None
+        self.exception: Optional[BaseException] = None
+        self.done = threading.Event()
+        self.dependents: List[Callable[["_StepState"], None]] = []
+        self.lock = threading.Lock()
+
+
+class PlanRun:
+    """
+    Name:
+        PlanRun
+
+    Purpose:
+        A single execution of a plan. Steps may be added one at a time; each step starts
+        as soon as the step it depends on (through `foreach`) has finished, and every
+        `foreach` item runs as its own call on the shared thread pool - unless the tool
+        has a bulk variant (helpers.bulk_variant), in which case all items are looked up
+        in one call. Either way the step records one (args, result) call per item.
+        Identity-gated tools (helpers.identity_tools) are the exception: those steps, and
+        their items, run one at a time in plan order, so at most one of them asks the
+        user for a name and date of birth. A run can be given its own prompt pool for
+        them, so a session waiting for the user's answer does not hold a shared thread.
+
+    Inputs:
+        tools (PharmacyTools): Toolbox whose public methods are invoked.
+        pool (ThreadPoolExecutor): Bounded pool shared by all runs.
+        prompt_pool (ThreadPoolExecutor | None): Pool for identity-gated steps (default: pool).
+
+    Output Schema:
+        result() returns an ExecutionOutcome.
+
+    Error Handling:
+        The first standardized error in plan order (and item order within a step) wins,
+        exactly as in sequential execution. Steps after a failed step are skipped if they
+        have not started yet. Exceptions raised by tools are re-raised from result().
+
+    Fallback Behavior:
+        A `foreach` that references no earlier `save_as` iterates over nothing, and one
+        over a value that is not iterable fails the step with INVALID_FOREACH_SOURCE. A
+        step with the "none" tool makes no calls.
+    """
+
+    def __init__(self, tools, pool: ThreadPoolExecutor, prompt_pool: Optional[ThreadPoolExecutor] = None) -> None:
+        self.tools = tools
+        self._pool = pool
+        self._prompt_pool = prompt_pool or pool
+        self._bulk: Dict[str, BulkVariant] = bulk_variants(type(tools))
+        self._identity_tools: frozenset = identity_tools(type(tools))
+        self._last_identity_step: Optional[_StepState] = None
+        self._steps: List[_StepState] = []
+        self._producers: Dict[str, _StepState] = {}
+        self._lock = threading.Lock()
+        self._failed_index: Optional[int] = None
+        self._pending = 0
+        self._closed = False
+        self._cancelled = False
+        self._on_settled: List[Callable[[], None]] = []
+        # Tool calls run on pool threads; they inherit the context (e.g. the active span) of the run's creator
+        self._context = contextvars.copy_context()
+
+    def add_step(self, step: dict) -> None:
+        """
+        Schedule a step; it runs once its `foreach` source (if any) is available and, for an
+        identity-gated tool, once the previous identity-gated step has finished.
+        """
+        state = _StepState(len(self._steps), step)
+        self._steps.append(state)
+        with self._lock:
+            self._pending += 1
+
+        producer = self._producers.get(state.foreach_key) if state.foreach_key else None
+        if state.save_as:
+            self._producers[state.save_as] = state
+        # Identity-gated steps run one at a time in plan order: only the first one can prompt for
+        # the name and DOB, and if that fails the later ones are skipped instead of prompting again
+        gate = None
+        if state.tool in self._identity_tools:
+            gate, self._last_identity_step = self._last_identity_step, state
+
+        prerequisites = [prerequisite for prerequisite in (producer, gate) if prerequisite is not None]
+        remaining = [len(prerequisites)]
+        counter_lock = threading.Lock()
+
+        def on_prerequisite_done(_prerequisite: _StepState) -> None:
+            with counter_lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                self._start(state, producer)
+
+        if not prerequisites:
+            self._start(state, producer)
+        for prerequisite in prerequisites:
+            with prerequisite.lock:
+                if not prerequisite.done.is_set():
+                    prerequisite.dependents.append(on_prerequisite_done)
+                    continue
+            on_prerequisite_done(prerequisite)
+
+    def _start(self, state: _StepState, producer: Optional[_StepState]) -> None:
+        if producer is None:
+            self._fan_out(state, [] if state.foreach_key else [None])
+        else:
+            self._on_producer_done(state, producer)
+
+    def close(self, on_settled: Optional[Callable[[], None]] = None) -> None:
+        """
+        Mark the plan as complete. `on_settled` is called (from whichever thread finishes
+        last) once every added step is done, so callers can wait without blocking a thread.
+        """
+        with self._lock:
+            self._closed = True
+            settled = self._pending == 0
+            if on_settled is not None and not settled:
+                self._on_settled.append(on_settled)
+        if on_settled is not None and settled:
+            on_settled()
+
+    def cancel(self, on_settled: Optional[Callable[[], None]] = None) -> None:
+        """
+        Abandon the run (e.g. a speculative run whose plan was repaired differently): calls
+        that have not started are skipped, calls in flight finish. Then close() it.
+        """
+        with self._lock:
+            self._cancelled = True
+        self.close(on_settled)
+
+    def result(self) -> ExecutionOutcome:
+        """Wait for every added step and assemble the outcome in plan order."""
+        outcome = ExecutionOutcome()
+        for state in self._steps:
+            state.done.wait()
+            if state.exception is not None:
+                raise state.exception
+            if state.error is not None:
+                outcome.error = state.error
+                return outcome
+            outcome.steps.append(StepRecord(tool=state.tool, calls=state.calls))
+        return outcome
+
+    def _should_skip(self, state: _StepState) -> bool:
+        with self._lock:
+            return self._cancelled or (self._failed_index is not None and self._failed_index < state.index)
+
+    def _record_failure(self, state: _StepState) -> None:
+        with self._lock:
+            if self._failed_index is None or state.index < self._failed_index:
+                self._failed_index = state.index
+
+    def _on_producer_done(self, state: _StepState, producer: _StepState) -> None:
+        if producer.error is not None or producer.exception is not None:
+            self._finish(state, [])
+            return
+        self._fan_out(state, producer.output)
+
+    def _fan_out(self, state: _StepState, iterable) -> None:
+        try:
+            items = list(iterable) if iterable is not None else []
+        except TypeError:
+            state.error = error(
+                message=f"foreach '{state.foreach_key}' is not a list",
+                code="INVALID_FOREACH_SOURCE",
+                details={"foreach": state.foreach_key, "type": type(iterable).__name__},
+            )
+            self._finish(state, [])
+            return
+        # The "none" tool (nothing applies) is a step without calls
+        if not items or state.tool == NO_TOOL or self._should_skip(state):
+            self._finish(state, [])
+            return
+
+        bulk = self._bulk.get(state.tool)
+        if bulk is not None and state.foreach_key and len(items) > 1 and state.args == {bulk.item_arg: "$item"}:
+            future = self._pool.submit(self._context.copy().run, self._call_bulk, state, bulk, items)
+            future.add_done_callback(lambda done: self._finish(state, [done]))
+            return
+
+        if state.tool in self._identity_tools and len(items) > 1:
+            future = self._prompt_pool.submit(self._context.copy().run, self._call_each, state, items)
+            future.add_done_callback(lambda done: self._finish(state, [done]))
+            return
+
+        futures: List[Future] = []
+        remaining = [len(items)]
+        counter_lock = threading.Lock()
+
+        def on_call_done(_future: Future) -> None:
+            with counter_lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                self._finish(state, futures)
+
+        pool = self._prompt_pool if state.tool in self._identity_tools else self._pool
+        for item in items:
+            actual_args = {k: item if v == "$item" else v for k, v in state.args.items()}
+            futures.append(pool.submit(self._context.copy().run, self._call, state, actual_args))
+        for future in futures:
+            future.add_done_callback(on_call_done)
+
+    def _call(self, state: _StepState, actual_args: dict) -> List[tuple]:
+        """One item: [(args, result, skipped)]."""
+        if self._should_skip(state):
+            return [(actual_args, None, True)]
+        return [(actual_args, getattr(self.tools, state.tool)(**actual_args), False)]
+
+    def _call_each(self, state: _StepState, items: list) -> List[tuple]:
+        """The items of an identity-gated step one after another, stopping at the first error (see add_step)."""
+        calls: List[tuple] = []
+        for item in items:
+            actual_args = {k: item if v == "$item" else v for k, v in state.args.items()}
+            call = self._call(state, actual_args)
+            calls.extend(call)
+            _, result, skipped = call[0]
+            if skipped or is_error(result):
+                break
+        return calls
+
+    def _call_bulk(self, state: _StepState, bulk: BulkVariant, items: list) -> List[tuple]:
+        """Every item in one call of the bulk tool, reported as the single-item calls it replaces."""
+        items_args = [{bulk.item_arg: item} for item in items]
+        if self._should_skip(state):
+            return [(items_args[0], None, True)]
+        results = getattr(self.tools, bulk.tool)(**{bulk.list_arg: items})
+        if is_error(results):
+            # The whole batch was rejected; report it as the first item's error
+            return [(items_args[0], results, False)]
+        return [(args, result, False) for args, result in zip(items_args, results)]
+
+    @staticmethod
+    def _collect(state: _StepState, calls: List[tuple], results: list) -> bool:
+        """Record a future's calls in item order; False once a call was skipped or failed."""
+        for actual_args, result, skipped in calls:
+            if skipped:
+                return False
+            if is_error(result):
+                state.error = result
+                return False
+            results.append(result)
+            state.calls.append((actual_args, result))
+        return True
+
+    def _finish(self, state: _StepState, futures: List[Future]) -> None:
+        results: list = []
+        for future in futures:
+            exception = future.exception()
+            if exception is not None:
+                state.exception = exception
+                break
+            if not self._collect(state, future.result(), results):
+                break
+
+        if state.error is not None or state.exception is not None:
+            self._record_failure(state)
+        elif state.save_as:
+            state.output = results if state.foreach_key else (results[0] if results else None)
+
+        with state.lock:
+            state.done.set()
+            dependents = list(state.dependents)
+        for notify in dependents:
+            notify(state)
+
+        with self._lock:
+            self._pending -= 1
+            settled = self._closed and self._pending == 0
+            callbacks, self._on_settled = (self._on_settled, []) if settled else ([], self._on_settled)
+        for callback in callbacks:
+            callback()
+
+
+class PlanExecutor:
+    """
+    Name:
+        PlanExecutor
+
+    Purpose:
+        Run execution plans on a bounded thread pool, overlapping independent steps
+        and `foreach` items while keeping results in plan order.
+
+    Inputs:
+        max_workers (int): Upper bound on concurrent tool calls across all runs.
+
+    Output Schema:
+        execute() returns an ExecutionOutcome.
+
+    Error Handling:
+        See PlanRun.
+
+    Fallback Behavior:
+        Plans without a "plan" key execute no steps.
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS) -> None:
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ephraim-tool")
+
+    def start(self, tools, prompt_pool: Optional[ThreadPoolExecutor] = None) -> PlanRun:
+        """
+        Begin a run against `tools` whose steps are added incrementally with PlanRun.add_step.
+        Identity-gated steps, which may wait for the user, run on `prompt_pool` if given.
+        """
+        return PlanRun(tools, self._pool, prompt_pool)
+
+    def execute(self, plan: dict, tools) -> ExecutionOutcome:
+        """Run every step of `plan` against `tools` and return the outcome."""
+        run = self.start(tools)
+        for step in plan.get("plan", []):
+            run.add_step(step)
+        return self.finish(run)
+
+    async def execute_async(self, plan: dict, tools, prompt_pool: Optional[ThreadPoolExecutor] = None) -> ExecutionOutcome:
+        """Like execute(), but awaits completion without holding an event-loop thread (see start() for prompt_pool)."""
+        run = self.start(tools, prompt_pool)
+        for step in plan.get("plan", []):
+            run.add_step(step)
+        return await self.finish_async(run)
+
+    def finish(self, run: PlanRun) -> ExecutionOutcome:
+        """Close a run started with start() and wait for its outcome."""
+        run.close()
+        outcome = run.result()
+        self._record(run, outcome)
+        return outcome
+
+    async def finish_async(self, run: PlanRun) -> ExecutionOutcome:
+        """Close a run started with start() and await its outcome."""
+        await self._settled(run.close)
+        outcome = run.result()
+        self._record(run, outcome)
+        return outcome
+
+    @staticmethod
+    def cancel(run: PlanRun) -> None:
+        """Cancel a run (see PlanRun.cancel) and wait for the calls already in flight."""
+        settled = threading.Event()
+        run.cancel(settled.set)
+        settled.wait()
+
+    async def cancel_async(self, run: PlanRun) -> None:
+        """Like cancel(), but awaits the calls in flight."""
+        await self._settled(run.cancel)
+
+    @staticmethod
+    async def _settled(close: Callable[[Callable[[], None]], None]) -> None:
+        """Close a run with `close` (PlanRun.close or cancel) and await its last step."""
+        loop = asyncio.get_running_loop()
+        settled = loop.create_future()
+
+        def on_settled() -> None:
+            loop.call_soon_threadsafe(lambda: settled.done() or settled.set_result(None))
+
+        close(on_settled)
+        await settled
+
+    @staticmethod
+    def _record(run: PlanRun, outcome: ExecutionOutcome) -> None:
+        """Attach plan size, foreach fan-out and the error code to the active span."""
+        if not TRACER.enabled:
+            return
+        span = TRACER.current()
+        steps = run._steps
+        TRACER.observe("ephraim_plan_steps", len(steps))
+        span.set_attribute("plan.steps", len(steps))
+        fanout = 0
+        for state in steps:
+            if state.foreach_key:
+                TRACER.observe("ephraim_foreach_fanout", len(state.calls), tool=state.tool)
+                fanout += len(state.calls)
+        span.set_attribute("plan.foreach_calls", fanout)
+        if outcome.error is not None:
+            span.set_error(outcome.error.get("code"))
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
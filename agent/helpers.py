@@ -1,17 +1,40 @@
 import functools
-from typing import Any, Dict, Optional
+import inspect
+import json
+from typing import Any, Dict, NamedTuple, Optional, Tuple, Union
+
+try:
+    import tiktoken
+except ImportError:  # Token counts fall back to an estimate without tiktoken
+    tiktoken = None
+
+from consts import MODEL_NAME
+from tracing import TRACER
 
 
 def log_method_call(func):
     """
     Decorator for class methods to log their execution using self.logger.debug.
+    While tracing is enabled, each call is also recorded as a "tool.<name>" span and
+    counted by status, with the error code of standardized errors.
     """
     @functools.wraps(func)
     def wrapper(self, *args, **kwargs):
         # Log the method name
         if hasattr(self, "logger"):
             self.logger.debug(f"Running {func.__name__}")
-        return func(self, *args, **kwargs)
+        if not TRACER.enabled:
+            return func(self, *args, **kwargs)
+
+        with TRACER.span(f"tool.{func.__name__}") as span:
+            result = func(self, *args, **kwargs)
+            status = "ok"
+            if is_error(result):
+                status = "error"
+                span.set_error(result.get("code"))
+                TRACER.inc("ephraim_errors_total", code=result.get("code"), source="tool")
+            TRACER.inc("ephraim_tool_calls_total", tool=func.__name__, status=status)
+            return result
     return wrapper
 
 
@@ -79,3 +102,130 @@ def is_error(result: Any) -> bool:
 
 def broken_rule_in_plan(plan):
     return "broken_rule" in plan["plan"][0]["tool"]
+
+
+def generate_tool_map(tools_class: type) -> Dict[str, str]:
+    """Collect all public methods of a toolbox class as a dict of {name: description}."""
+    tool_map: dict = {}
+    for name, func in inspect.getmembers(tools_class, predicate=inspect.isfunction):
+        if not name.startswith("_"):
+            description = func.__doc__ or "No description provided"
+            tool_map[name] = description.strip()
+    return tool_map
+
+
+def session_tool(func):
+    """Mark a tool that acts on the conversation's verified identity (treated like an identity tool)."""
+    func.session_tool = True
+    return func
+
+
+class BulkVariant(NamedTuple):
+    """A tool taking a list (`list_arg`) that does the work of one call per item of a single-item tool's `item_arg`."""
+    tool: str
+    list_arg: str
+    item_arg: str
+
+
+def bulk_variant(tool: str, list_arg: str, item_arg: str):
+    """
+    Mark a single-item tool as having a bulk counterpart: `tool(list_arg=[a, b])` must return
+    the single tool's results for item_arg=a and item_arg=b, in order. The executor uses it to
+    turn a `foreach` fan-out into one call.
+    """
+    def mark(func):
+        func.bulk_variant = BulkVariant(tool, list_arg, item_arg)
+        return func
+    return mark
+
+
+@functools.lru_cache(maxsize=None)
+def bulk_variants(tools_class: type) -> Dict[str, BulkVariant]:
+    """{single-item tool: BulkVariant} for the public tools of a toolbox class marked with bulk_variant."""
+    return {
+        name: func.bulk_variant for name, func in inspect.getmembers(tools_class, predicate=inspect.isfunction)
+        if not name.startswith("_") and getattr(func, "bulk_variant", None) is not None
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def identity_tools(tools_class: type) -> frozenset:
+    """Names of the public tools that take a user_name or user_dob argument or are marked with session_tool."""
+    return frozenset(
+        name for name, func in inspect.getmembers(tools_class, predicate=inspect.isfunction)
+        if not name.startswith("_")
+        and ({"user_name", "user_dob"} & set(inspect.signature(func).parameters) or getattr(func, "session_tool", False))
+    )
+
+
+def parse_decider_response(content: str) -> Union[Tuple[str, Dict[str, Any]], Dict[str, Any]]:
+    """
+    Name:
+        parse_decider_response
+
+    Purpose:
+        Split a tool-decider completion into its explanation and parsed JSON plan.
+
+    Inputs:
+        content (str): Raw completion in the ---EXPLANATION--- / ---PLAN--- format.
+
+    Output Schema:
+        On success:
+            (explanation (str), plan (dict))
+
+        On failure:
+            standardized error dict
+
+    Error Handling:
+        - INVALID_LLM_FORMAT
+        - INVALID_JSON
+
+    Fallback Behavior:
+        Returns an error without raising exceptions.
+    """
+    try:
+        explanation_part, plan_part = content.split("---PLAN---", 1)
+    except ValueError:
+        return error(message="LLM response did not contain explanation and plan sections",
+                     code="INVALID_LLM_FORMAT")
+    explanation = explanation_part.replace("---EXPLANATION---", "").strip()
+
+    try:
+        plan = json.loads(plan_part.strip())
+    except json.JSONDecodeError:
+        return error(message="Unable to parse JSON plan produced by LLM", code="INVALID_JSON")
+
+    return explanation, plan
+
+
+@functools.lru_cache(maxsize=1)
+def _token_encoding():
+    try:
+        return tiktoken.encoding_for_model(MODEL_NAME)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Name:
+        count_tokens
+
+    Purpose:
+        Count the tokens the model will see for a piece of text.
+
+    Inputs:
+        text (str): Text to measure.
+
+    Output Schema:
+        int
+
+    Error Handling:
+        This method never raises exceptions.
+
+    Fallback Behavior:
+        Without tiktoken installed, estimates one token per four characters.
+    """
+    if tiktoken is None:
+        return (len(text) + 3) // 4
+    return len(_token_encoding().encode(text))
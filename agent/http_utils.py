@@ -0,0 +1,104 @@
+import asyncio
+import json
+from http import HTTPStatus
+from typing import Any, Dict, NamedTuple, Optional
+
+
+class RequestTooLarge(ValueError):
+    """A request whose Content-Length exceeds the server's limit (answer 413 and close the connection)."""
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    headers: Dict[str, str]
+    body: bytes
+
+    def json(self) -> Any:
+        return json.loads(self.body or b"{}")
+
+    @property
+    def keep_alive(self) -> bool:
+        return self.headers.get("connection", "").lower() != "close"
+
+
+async def read_request(reader: asyncio.StreamReader, max_body: Optional[int] = None) -> Optional[Request]:
+    """
+    Name:
+        read_request
+
+    Purpose:
+        Read one HTTP/1.1 request (request line, headers, Content-Length body) from a stream.
+
+    Inputs:
+        reader (StreamReader): Connection to read from.
+        max_body (int | None): Largest Content-Length accepted (no limit if None).
+
+    Output Schema:
+        Request, or None when the peer closed the connection.
+
+    Error Handling:
+        Raises ValueError for malformed request lines, RequestTooLarge (before reading the body)
+        for a Content-Length above max_body and IncompleteReadError for truncated bodies.
+
+    Fallback Behavior:
+        Requests without Content-Length have an empty body.
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    headers: Dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        key, _, value = line.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if max_body is not None and length > max_body:
+        raise RequestTooLarge(f"Body of {length} bytes exceeds the {max_body}-byte limit")
+    body = await reader.readexactly(length)
+    return Request(method, path, headers, body)
+
+
+async def send_json(writer: asyncio.StreamWriter, status: int, payload: Any = None) -> None:
+    """Write a complete JSON response (or an empty one when payload is None)."""
+    body = b"" if payload is None else json.dumps(payload).encode()
+    writer.write(
+        f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+        + body
+    )
+    await writer.drain()
+
+
+async def send_text(writer: asyncio.StreamWriter, status: int, text: str, content_type: str = "text/plain") -> None:
+    """Write a complete plain-text response."""
+    body = text.encode()
+    writer.write(
+        f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+        f"Content-Type: {content_type}; charset=utf-8\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+        + body
+    )
+    await writer.drain()
+
+
+def start_event_stream(writer: asyncio.StreamWriter) -> None:
+    """Write the headers of a chunked text/event-stream response."""
+    writer.write(
+        b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+        b"Transfer-Encoding: chunked\r\n\r\n"
+    )
+
+
+async def write_chunk(writer: asyncio.StreamWriter, data: bytes) -> None:
+    """Write one chunk of a chunked response and wait for the socket to drain."""
+    writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+    await writer.drain()
+
+
+async def end_chunked(writer: asyncio.StreamWriter) -> None:
+    """Terminate a chunked response."""
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
@@ -0,0 +1,158 @@
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from records import User
+from storage import _key
+
+DEFAULT_IDENTITY_TTL = 900.0
+DEFAULT_MAX_FAILURES = 5
+DEFAULT_FAILURE_WINDOW = 300.0
+DEFAULT_LOCKOUT = 300.0
+
+
+class FailureLimiter:
+    """
+    Name:
+        FailureLimiter
+
+    Purpose:
+        Failed DOB checks counted per name. After max_failures failures within
+        failure_window seconds, validation of that name is refused for lockout seconds
+        without touching the store. One limiter can be shared by every conversation
+        (the server injects its own into each session), so a guesser cannot reset the
+        count by opening a new session.
+
+    Inputs:
+        max_failures (int): Failed DOB checks allowed per name within failure_window.
+        failure_window (float): Seconds over which failures are counted.
+        lockout (float): Seconds validation is refused once the limit is reached.
+        clock (callable): Monotonic time source.
+
+    Output Schema:
+        retry_after() returns seconds until the name may be validated again (0.0 if not locked).
+
+    Error Handling:
+        This class never raises exceptions.
+
+    Fallback Behavior:
+        None
+    """
+
+    def __init__(self, max_failures: int = DEFAULT_MAX_FAILURES, failure_window: float = DEFAULT_FAILURE_WINDOW,
+                 lockout: float = DEFAULT_LOCKOUT, clock: Callable[[], float] = time.monotonic) -> None:
+        self.max_failures = max_failures
+        self.failure_window = failure_window
+        self.lockout = lockout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures: Dict[str, List[float]] = {}
+        self._locked_until: Dict[str, float] = {}
+
+    def record_failure(self, user_name: str) -> None:
+        """Count a failed DOB check for `user_name`, locking the name once the limit is reached."""
+        key = _key(user_name)
+        with self._lock:
+            now = self._clock()
+            recent = [at for at in self._failures.get(key, ()) if now - at < self.failure_window]
+            recent.append(now)
+            if len(recent) >= self.max_failures:
+                self._locked_until[key] = now + self.lockout
+                self._failures.pop(key, None)
+            else:
+                self._failures[key] = recent
+
+    def retry_after(self, user_name: str) -> float:
+        """Seconds until `user_name` may be validated again (0.0 if it is not locked)."""
+        key = _key(user_name)
+        with self._lock:
+            until = self._locked_until.get(key)
+            if until is None:
+                return 0.0
+            remaining = until - self._clock()
+            if remaining <= 0:
+                del self._locked_until[key]
+                return 0.0
+            return remaining
+
+    def reset(self, user_name: str) -> None:
+        """Clear the failure count of a name that just passed validation."""
+        key = _key(user_name)
+        with self._lock:
+            self._failures.pop(key, None)
+            self._locked_until.pop(key, None)
+
+
+class IdentityCache:
+    """
+    Name:
+        IdentityCache
+
+    Purpose:
+        Verified identity of one conversation. Once a user passes name + DOB validation,
+        later identity-gated tool calls in the same session reuse the verified record
+        until it expires or the user logs out, skipping both the store lookup and the
+        interactive prompts. Failed DOB checks are counted by `failures`, which may be
+        shared with other conversations.
+
+    Inputs:
+        ttl (float): Seconds a verified identity stays valid after its last use.
+        failures (FailureLimiter | None): Failed DOB checks per name (a new one by default).
+        clock (callable): Monotonic time source.
+
+    Output Schema:
+        match() returns the verified User or None.
+
+    Error Handling:
+        This class never raises exceptions.
+
+    Fallback Behavior:
+        An expired identity is dropped and the user is validated again.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_IDENTITY_TTL, failures: Optional[FailureLimiter] = None,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.ttl = ttl
+        self.failures: FailureLimiter = failures or FailureLimiter(clock=clock)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._user: Optional[User] = None
+        self._expires_at = 0.0
+
+    @property
+    def user(self) -> Optional[User]:
+        """The verified user, or None if nobody is verified (or the identity expired)."""
+        return self.match()
+
+    def match(self, user_name: Optional[str] = None, user_dob: Optional[str] = None) -> Optional[User]:
+        """
+        Return the verified user if it is still valid and agrees with every identity
+        field given (name case-insensitively, DOB exactly); each use extends the TTL.
+        """
+        with self._lock:
+            user = self._user
+            if user is None:
+                return None
+            now = self._clock()
+            if now >= self._expires_at:
+                self._user = None
+                return None
+            if user_name and _key(user_name) != _key(user.name):
+                return None
+            if user_dob and user_dob != user.dob:
+                return None
+            self._expires_at = now + self.ttl
+            return user
+
+    def verify(self, user: User) -> None:
+        """Remember a user who just passed validation and clear their failure count."""
+        with self._lock:
+            self._user = user
+            self._expires_at = self._clock() + self.ttl
+        self.failures.reset(user.name)
+
+    def logout(self) -> Optional[User]:
+        """Forget the verified identity; returns the user who was logged out, if any."""
+        with self._lock:
+            user, self._user = self._user, None
+            return user
@@ -0,0 +1,142 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+SUPPORTED_LANGUAGES = ("en", "he")
+DEFAULT_LANGUAGE = "en"
+# Hebrew wins from half of the letters (Hebrew messages often name medications in Latin
+# letters). Latin script alone does not make a message English: a Latin-script majority is
+# English only if it uses common English words; longer Latin text without them goes to the
+# fallback, and shorter text (a medication name, "ok") keeps the session language.
+HEBREW_SHARE = 0.5
+LATIN_SHARE = 0.7
+MIN_FALLBACK_WORDS = 3
+# A fallback guess outside SUPPORTED_LANGUAGES below this probability keeps the session language
+# (langdetect reads short English commands such as "log me out" as French or Norwegian)
+MIN_FALLBACK_CONFIDENCE = 0.9
+# Frequent English words and commands, avoiding words common in French, Spanish, German or
+# Italian except "me", which short English commands ("log me out", "show me...") need
+ENGLISH_WORDS = frozenset((
+    "the", "is", "are", "what", "which", "how", "who", "when", "where", "why", "do", "does", "did",
+    "have", "has", "my", "you", "your", "it", "its", "of", "and", "for", "to", "with", "can",
+    "this", "that", "there", "please", "about", "any", "much", "many", "stock", "price", "need",
+    "want", "show", "tell", "get", "thanks", "thank", "yes", "hello", "hi", "me", "out", "log",
+    "logout", "sign", "refill", "list", "check", "find", "give", "help", "history", "prescription",
+    "prescriptions", "side", "effects", "order", "cancel",
+))
+
+_HEBREW_LETTERS = re.compile("[\u0590-\u05ff\ufb1d-\ufb4f]")
+_LATIN_LETTERS = re.compile("[A-Za-z\u00c0-\u00d6\u00d8-\u00f6\u00f8-\u024f]")
+_LETTERS = re.compile(r"[^\W\d_]")
+_WORDS = re.compile(r"[^\W\d_]+")
+
+
+def script_language(text: str) -> Optional[str]:
+    """
+    Decide the language without a statistical model: "he" if Hebrew letters dominate, "en"
+    if Latin letters do and the text uses common English words, "" if there is too little to
+    tell (no letters, or a few Latin words that are not English), and None if it needs the
+    fallback (mixed scripts without a clear majority, another script, or a Latin-script
+    sentence that may be French, Spanish, German...).
+    """
+    letters = len(_LETTERS.findall(text))
+    if not letters:
+        return ""
+    if len(_HEBREW_LETTERS.findall(text)) >= HEBREW_SHARE * letters:
+        return "he"
+    if len(_LATIN_LETTERS.findall(text)) >= LATIN_SHARE * letters:
+        words = [word.casefold() for word in _WORDS.findall(text)]
+        if any(word in ENGLISH_WORDS for word in words):
+            return "en"
+        if len(words) < MIN_FALLBACK_WORDS:
+            return ""
+    return None
+
+
+def statistical_language(text: str) -> str:
+    """
+    langdetect with a fixed seed (it is nondeterministic otherwise); its Hebrew code "iw" maps
+    to "he". Returns "" (keep the session language) for a guess outside SUPPORTED_LANGUAGES
+    with less than MIN_FALLBACK_CONFIDENCE probability.
+    """
+    from langdetect import DetectorFactory, LangDetectException, detect_langs
+
+    DetectorFactory.seed = 0
+    try:
+        best = detect_langs(text)[0]
+    except LangDetectException:
+        return DEFAULT_LANGUAGE
+    language = "he" if best.lang == "iw" else best.lang
+    if language not in SUPPORTED_LANGUAGES and best.prob < MIN_FALLBACK_CONFIDENCE:
+        return ""
+    return language
+
+
+class LanguageDetector:
+    """
+    Name:
+        LanguageDetector
+
+    Purpose:
+        Per-session language detection for user messages. The script and English-word
+        check (script_language) decides almost every message in microseconds; only
+        ambiguous text goes to the statistical fallback, whose answers are cached per text.
+        Messages without letters (e.g. a date of birth), too short to tell, or given an
+        unsure fallback guess outside SUPPORTED_LANGUAGES keep the session's current language.
+
+    Inputs:
+        fallback (callable): Statistical detector for ambiguous text (langdetect by default).
+        default (str): Session language before the first message with letters.
+        cache_size (int): Fallback results kept per session.
+
+    Output Schema:
+        detect() returns a language code; quick() the code or None if the fallback is needed.
+
+    Error Handling:
+        This class never raises exceptions; fallback failures yield the default language
+        and an empty fallback result keeps the session language.
+
+    Fallback Behavior:
+        See Purpose.
+    """
+
+    def __init__(self, fallback: Callable[[str], str] = statistical_language, default: str = DEFAULT_LANGUAGE,
+                 cache_size: int = 256) -> None:
+        self.language = default
+        self._fallback = fallback
+        self._default = default
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def quick(self, text: str) -> Optional[str]:
+        """Detect without the statistical fallback; None if the text needs it (see detect())."""
+        language = script_language(text)
+        if language is None:
+            with self._lock:
+                language = self._cache.get(text.strip())
+            if language is None:
+                return None
+        if language == "":
+            return self.language
+        self.language = language
+        return language
+
+    def detect(self, text: str) -> str:
+        """Return the language of `text` and make it the session language."""
+        language = self.quick(text)
+        if language is not None:
+            return language
+        key = text.strip()
+        try:
+            language = self._fallback(key)
+        except Exception:
+            language = self._default
+        with self._lock:
+            self._cache[key] = language
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        if language:
+            self.language = language
+        return self.language
@@ -0,0 +1,212 @@
+import re
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple
+
+from helpers import count_tokens, is_error
+
+DEFAULT_RECENT_TOKENS = 600
+DEFAULT_SUMMARY_TOKENS = 200
+# Replies are kept in memory cut to this many characters; the tool references carry the facts
+REPLY_CHARS = 300
+REFERENCE_ITEMS = 5
+# Arguments never repeated to the LLM in later turns
+PRIVATE_ARGS = frozenset({"user_dob"})
+REDACTED_DOB = "[date of birth]"
+# Dates as users type them (1995-04-12, 12/04/1995, 12.4.95); in a user's message, most likely their DOB
+_DATES = re.compile(r"\b(?:\d{4}-\d{1,2}-\d{1,2}|\d{1,2}[./-]\d{1,2}[./-]\d{2,4})\b")
+
+
+def redact_dobs(user_message: str, reply: str, outcome: Any = None) -> Tuple[str, str]:
+    """
+    The user message and reply without dates of birth: every date typed in the message and
+    every user_dob the turn's tool calls were given (the DOB half of the name/DOB pair used
+    for verification) is replaced, in the message and wherever the reply repeats it.
+    Other dates in the reply (e.g. fill dates) are kept.
+    """
+    dobs = set(_DATES.findall(user_message))
+    for step in getattr(outcome, "steps", ()):
+        for args, _ in step.calls:
+            dobs.update(str(args[name]) for name in PRIVATE_ARGS if args.get(name))
+    for dob in sorted(dobs, key=len, reverse=True):
+        user_message = user_message.replace(dob, REDACTED_DOB)
+        reply = reply.replace(dob, REDACTED_DOB)
+    return user_message, reply
+
+
+def _result_reference(result: Any) -> str:
+    if is_error(result):
+        return f"error {result.get('code')}"
+    if isinstance(result, dict):
+        return str(result.get("name") or result.get("medication") or ", ".join(list(result)[:REFERENCE_ITEMS]))
+    if isinstance(result, list):
+        items = [_result_reference(item) if isinstance(item, dict) else str(item) for item in result]
+        more = f", … ({len(items)} total)" if len(items) > REFERENCE_ITEMS else ""
+        return "[" + ", ".join(items[:REFERENCE_ITEMS]) + more + "]"
+    return str(result)[:REPLY_CHARS]
+
+
+def tool_references(outcome: Any) -> Tuple[str, ...]:
+    """
+    One compact line per tool call of an ExecutionOutcome, e.g.
+    "get_user_prescription_names(user_name='Alice') -> [PainAway, AllerFree]":
+    enough to resolve follow-up references without resending full tool outputs.
+    """
+    if outcome is None:
+        return ()
+    references: List[str] = []
+    for step in outcome.steps:
+        for args, result in step.calls:
+            shown = ", ".join(f"{name}={value!r}" for name, value in args.items() if name not in PRIVATE_ARGS)
+            references.append(f"{step.tool}({shown}) -> {_result_reference(result)}")
+    if outcome.error is not None:
+        references.append(f"error {outcome.error.get('code')}: {outcome.error.get('message')}")
+    return tuple(references)
+
+
+@dataclass(frozen=True)
+class Turn:
+    """One remembered exchange: the user's message, the (shortened) reply and compact tool references."""
+    user: str
+    reply: str
+    tools: Tuple[str, ...]
+    tokens: int
+
+    def render(self) -> str:
+        lines = [f"User: {self.user}"]
+        lines.extend(f"Tool: {reference}" for reference in self.tools)
+        lines.append(f"Ephraim: {self.reply}")
+        return "\n".join(lines)
+
+
+class SummaryJob(NamedTuple):
+    """Turns evicted from the recent window, to be folded into `previous` (the current summary)."""
+    previous: str
+    turns: Tuple[Turn, ...]
+
+    def transcript(self) -> str:
+        parts = [f"Summary so far: {self.previous}"] if self.previous else []
+        parts.extend(turn.render() for turn in self.turns)
+        return "\n\n".join(parts)
+
+
+class ConversationMemory:
+    """
+    Name:
+        ConversationMemory
+
+    Purpose:
+        Per-session conversation history for the decider and responder prompts. Recent turns
+        are kept verbatim (reply shortened, tool outputs as compact references, dates of
+        birth redacted, see redact_dobs) up to a token budget; older turns are evicted and folded into a running summary by a background
+        LLM call, so the context stays bounded by recent_tokens + summary_tokens however
+        long the session runs.
+
+    Inputs:
+        recent_tokens (int): Token budget for verbatim recent turns.
+        summary_tokens (int): Token budget for the summary of older turns.
+        count (callable): Token counter.
+
+    Output Schema:
+        context() returns the text to add to the prompts ("" for a new conversation).
+
+    Error Handling:
+        This class never raises exceptions.
+
+    Fallback Behavior:
+        A failed (or missing) summarizer leaves a summary made of the evicted turns' tool
+        references, trimmed to the summary budget; evicted turns not yet summarized are
+        shown as long as they fit.
+    """
+
+    def __init__(self, recent_tokens: int = DEFAULT_RECENT_TOKENS, summary_tokens: int = DEFAULT_SUMMARY_TOKENS,
+                 count: Callable[[str], int] = count_tokens) -> None:
+        self.recent_tokens = recent_tokens
+        self.summary_tokens = summary_tokens
+        self._count = count
+        self._lock = threading.Lock()
+        self._turns: List[Turn] = []
+        self._recent: int = 0
+        self._evicted: List[Turn] = []
+        self._summarizing: Tuple[Turn, ...] = ()
+        self._summary: str = ""
+
+    def __len__(self) -> int:
+        return len(self._turns)
+
+    @property
+    def summary(self) -> str:
+        return self._summary
+
+    def add_turn(self, user_message: str, reply: str, outcome: Any = None) -> None:
+        """Remember a finished turn, evicting the oldest turns beyond the recent-token budget."""
+        # Redacted before anything is kept, so no DOB reaches later prompts or the summarizer
+        user_message, reply = redact_dobs(user_message, reply, outcome)
+        if len(reply) > REPLY_CHARS:
+            reply = reply[:REPLY_CHARS].rstrip() + "…"
+        tools = tool_references(outcome)
+        turn = Turn(user=user_message, reply=reply, tools=tools, tokens=0)
+        turn = Turn(user=user_message, reply=reply, tools=tools, tokens=self._count(turn.render()))
+        with self._lock:
+            self._turns.append(turn)
+            self._recent += turn.tokens
+            # The newest turn always stays, even on its own over budget
+            while self._recent > self.recent_tokens and len(self._turns) > 1:
+                oldest = self._turns.pop(0)
+                self._recent -= oldest.tokens
+                self._evicted.append(oldest)
+
+    def clear(self) -> None:
+        """Forget the whole conversation (e.g. on logout)."""
+        with self._lock:
+            self._turns.clear()
+            self._evicted.clear()
+            self._summarizing = ()
+            self._recent = 0
+            self._summary = ""
+
+    def context(self) -> str:
+        """Summary of older turns, evicted turns not yet summarized (as budget allows) and recent turns."""
+        with self._lock:
+            if not self._turns:
+                return ""
+            parts: List[str] = []
+            if self._summary:
+                parts.append(f"Summary of earlier conversation: {self._summary}")
+            spare = self.summary_tokens - (self._count(self._summary) if self._summary else 0)
+            pending: List[str] = []
+            for turn in reversed(self._summarizing + tuple(self._evicted)):
+                if turn.tokens > spare:
+                    break
+                pending.append(turn.render())
+                spare -= turn.tokens
+            parts.extend(reversed(pending))
+            parts.extend(turn.render() for turn in self._turns)
+            return "\n\n".join(parts)
+
+    def take_summary_job(self) -> Optional[SummaryJob]:
+        """Hand out the evicted turns for summarizing, unless there are none or a job is already running."""
+        with self._lock:
+            if not self._evicted or self._summarizing:
+                return None
+            self._summarizing, self._evicted = tuple(self._evicted), []
+            return SummaryJob(previous=self._summary, turns=self._summarizing)
+
+    def finish_summary(self, job: SummaryJob, summary: Optional[str]) -> None:
+        """Install the summary produced for `job`; None (a failed summarizer) uses the fallback summary."""
+        if not summary:
+            summary = "; ".join([job.previous] * bool(job.previous) +
+                                [reference for turn in job.turns for reference in turn.tools])
+        summary = self._trim(summary.strip())
+        with self._lock:
+            if self._summarizing is not job.turns:
+                return  # cleared (logout) while the summarizer was running
+            self._summary = summary
+            self._summarizing = ()
+
+    def _trim(self, summary: str) -> str:
+        """Cut a summary to the token budget, keeping its most recent (final) part."""
+        while summary and self._count(summary) > self.summary_tokens:
+            summary = summary[len(summary) // 4:].split(" ", 1)[-1]
+        return summary
+
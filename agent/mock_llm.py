@@ -0,0 +1,639 @@
+import argparse
+import asyncio
+import functools
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from consts import DATABASE_FILE_NAME, MODEL_NAME
+from prompts import evaluator_marker, repair_marker, summarizer_marker
+from http_utils import end_chunked, read_request, send_json, start_event_stream, write_chunk
+
+HEBREW_CHARS = re.compile(r"[֐-׿]")
+DOB_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+NAME_PATTERN = re.compile(r"(?:i am|i'm|my name is|this is|name:)\s+([^\s,.!?]+)|(?:אני|שמי)\s+([^\s,.!?]+)", re.IGNORECASE)
+TOKEN_PATTERN = re.compile(r"\S+\s*|\s+")
+EMBEDDING_DIMENSIONS = 64
+# Like the OpenAI API: prompts of at least 1024 tokens are cached, in 128-token increments
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_BLOCK_TOKENS = 128
+
+RULE_BREAKING_WORDS = ("diagnos", "what do i have", "should i take", "should i buy", "אבחנה", "מה יש לי")
+HISTORY_WORDS = ("history", "filled", "היסטוריה")
+PRESCRIPTION_WORDS = ("prescription", "my medications", "מרשמ", "התרופות שלי")
+DETAIL_WORDS = ("side effect", "detail", "manufactur", "how do i take", "dosage", "price", "תופעות", "פרטים", "יצרן")
+INVENTORY_WORDS = ("stock", "inventory", "available", "מלאי", "זמין")
+LOGOUT_WORDS = ("log out", "log me out", "logout", "sign out", "התנתק")
+SIDE_EFFECT_WORDS = ("side effect", "תופעות")
+MANUFACTURER_WORDS = ("manufactur", "made by", "יצרן")
+PRICE_WORDS = ("price", "cost", "מחיר", "עולה")
+FAILURE_WORDS = ("not found", "incorrect", "couldn't", "sorry", "לא נמצא", "שגוי", "מצטער")
+# Amounts only: not parts of dates, nor dosages such as "500mg"
+NUMBER_PATTERN = re.compile(r"(?<![\d.-])\d+(?:\.\d+)?(?![\d-]|\s*(?:mg|ml|mcg|%))", re.IGNORECASE)
+REFUSAL_WORDS = ("can't help", "cannot help", "against my service rules", "healthcare professional",
+                 "אינני יכול לעזור", "מפרה את כללי", "איש מקצוע")
+
+
+def load_medication_names(database_path: str = DATABASE_FILE_NAME) -> List[str]:
+    """Read medication names from a database.json file for the scripted decider."""
+    try:
+        with open(database_path, "r") as f:
+            return [med["name"] for med in json.load(f).get("pharmacy_inventory", [])]
+    except (OSError, ValueError):
+        return []
+
+
+@functools.lru_cache(maxsize=None)
+def _database_facts(database_path: str = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                      DATABASE_FILE_NAME)) -> Dict[str, tuple]:
+    """Medication names, manufacturers and side effects of a database.json file, for the scripted evaluator."""
+    try:
+        with open(database_path, "r") as f:
+            inventory = json.load(f).get("pharmacy_inventory", [])
+    except (OSError, ValueError):
+        inventory = []
+    return {
+        "medications": tuple(med["name"] for med in inventory),
+        "manufacturers": tuple({med.get("manufacturer") for med in inventory} - {None}),
+        "side_effects": tuple({effect for med in inventory for effect in med.get("side_effects", ())}),
+    }
+
+
+def _step(tool: str, args: Dict[str, Any], **extra: Any) -> Dict[str, Any]:
+    return {"tool": tool, "args": args, **extra}
+
+
+def _referenced_medications(context: str, medication_names: Sequence[str]) -> List[str]:
+    """Medications named on the latest line of the conversation context that names any."""
+    for line in reversed(context.splitlines()):
+        names = [name for name in medication_names if name.casefold() in line.casefold()]
+        if names:
+            return names
+    return []
+
+
+def _decider_plan(user_message: str, medication_names: Sequence[str], context: str = "") -> List[Dict[str, Any]]:
+    text = user_message.casefold()
+
+    identity: Dict[str, Any] = {}
+    name_match = NAME_PATTERN.search(user_message)
+    if name_match:
+        identity["user_name"] = name_match.group(1) or name_match.group(2)
+    dob_match = DOB_PATTERN.search(user_message)
+    if dob_match:
+        identity["user_dob"] = dob_match.group(0)
+
+    mentioned = [name for name in medication_names if name.casefold() in text]
+    if not mentioned and context and any(word in text for word in DETAIL_WORDS):
+        # A follow-up such as "and its side effects?" refers to the medications discussed last
+        mentioned = _referenced_medications(context, medication_names)
+
+    if any(word in text for word in RULE_BREAKING_WORDS):
+        plan = [_step("report_broken_rule", {"rule": "Do not give diagnoses or medical advice"})]
+    elif any(word in text for word in LOGOUT_WORDS):
+        plan = [_step("logout", {})]
+    elif any(word in text for word in HISTORY_WORDS):
+        plan = [_step("get_user_prescription_history", identity)]
+    elif any(word in text for word in PRESCRIPTION_WORDS):
+        plan = [_step("get_user_prescription_names", identity, save_as="prescriptions")]
+        if any(word in text for word in DETAIL_WORDS):
+            plan.append(_step("get_medication_details_by_name", {"name": "$item"}, foreach="prescriptions"))
+    elif mentioned:
+        plan = [_step("get_medication_details_by_name", {"name": name}) for name in mentioned]
+    elif any(word in text for word in INVENTORY_WORDS):
+        plan = [_step("check_inventory_status", {})]
+    else:
+        plan = [_step("none", {})]
+    return plan
+
+
+def _decider_reply(user_message: str, medication_names: Sequence[str], context: str = "") -> str:
+    hebrew = bool(HEBREW_CHARS.search(user_message))
+    plan = _decider_plan(user_message, medication_names, context)
+    tools = ", ".join(step["tool"] for step in plan)
+    explanation = f"אבדוק את הבקשה שלך באמצעות {tools}." if hebrew else f"I will look into your request using {tools}."
+    return f"---EXPLANATION---\n{explanation}\n\n---PLAN---\n{json.dumps({'plan': plan})}"
+
+
+def _repair_reply(user_message: str, medication_names: Sequence[str], context: str = "") -> str:
+    """The scripted plan as strict structured outputs would return it: every key present, unused ones null."""
+    plan = [{"tool": step["tool"], "args": step["args"], "save_as": step.get("save_as"), "foreach": step.get("foreach")}
+            for step in _decider_plan(user_message, medication_names, context)]
+    return json.dumps({"plan": plan})
+
+
+def _responder_reply(user_message: str, system_prompt: str) -> str:
+    hebrew = bool(HEBREW_CHARS.search(user_message))
+    data = system_prompt.split("Relevant data:", 1)[-1].strip()
+
+    if "error: True" in data:
+        message = re.search(r"message: (.*)", data)
+        reason = message.group(1) if message else "an error occurred"
+        return f"מצטער, לא הצלחתי להשלים את הבקשה: {reason}" if hebrew else f"I'm sorry, I couldn't complete your request: {reason}"
+    # Summary lines are "tool(args) -> result", or one result per line under a foreach "tool:" header
+    results = [line.split(" -> ", 1)[-1].strip() for line in data.splitlines() if " -> " in line or line.startswith("  ")]
+    body = "; ".join(results) if results else "no additional data"
+    return f"הנה מה שמצאתי: {body}" if hebrew else f"Here is what I found: {body}"
+
+
+def _accuracy_answer(request: str, response: str) -> Any:
+    """
+    The facts of the kind the request asks about (manufacturers, side effects, prices,
+    medication names, fill dates) that the response states, in the order it states them;
+    the response's first sentence if it reports a failure instead, else None.
+    """
+    asked = request.casefold()
+    facts = _database_facts()
+    found: Dict[int, str] = {}
+
+    def collect(values: Iterable[str]) -> None:
+        for value in values:
+            position = response.casefold().find(value.casefold())
+            if position >= 0:
+                found.setdefault(position, value)
+
+    if any(word in asked for word in MANUFACTURER_WORDS):
+        collect(facts["manufacturers"])
+    if any(word in asked for word in SIDE_EFFECT_WORDS):
+        collect(facts["side_effects"])
+    if any(word in asked for word in PRICE_WORDS):
+        found.update((match.start(), match.group(0)) for match in NUMBER_PATTERN.finditer(response))
+    if any(word in asked for word in HISTORY_WORDS):
+        found.update((match.start(), match.group(0)) for match in DOB_PATTERN.finditer(response))
+    if any(word in asked for word in HISTORY_WORDS + PRESCRIPTION_WORDS + INVENTORY_WORDS):
+        collect(facts["medications"])
+    if found:
+        return [found[position] for position in sorted(found)]
+    if any(word in response.casefold() for word in FAILURE_WORDS):
+        return re.split(r"(?<=[.!?])\s", response, 1)[0]
+    return None
+
+
+def _evaluator_reply(user_message: str, system_prompt: str) -> str:
+    response = user_message.split("RESPONSE:\n", 1)[-1].strip()
+    if "TASK: accuracy" in system_prompt:
+        request = user_message.split("REQUEST:\n", 1)[-1].split("\n\nRESPONSE:\n", 1)[0]
+        return json.dumps({"answer": _accuracy_answer(request, response)}, ensure_ascii=False)
+    if "TASK: rule_following" in system_prompt:
+        refused = any(word in response.casefold() for word in REFUSAL_WORDS)
+        return json.dumps({"rule_broken_handled": refused})
+    qualities = re.search(r"qualities: (.*)\.", system_prompt)
+    names = [name.strip() for name in qualities.group(1).split(",")] if qualities else []
+    score = 8 if response else 0
+    return json.dumps({"scores": {name: score for name in names}})
+
+
+def _summarizer_reply(transcript: str) -> str:
+    previous = re.search(r"^Summary so far: (.*)$", transcript, re.MULTILINE)
+    asked = re.findall(r"^User: (.*)$", transcript, re.MULTILINE)
+    parts = [previous.group(1)] if previous else []
+    parts.extend(f"The user asked: {message}" for message in asked)
+    return " ".join(parts)
+
+
+def scripted_reply(messages: Sequence[Dict[str, Any]], medication_names: Sequence[str] = ()) -> str:
+    """
+    Name:
+        scripted_reply
+
+    Purpose:
+        Deterministic stand-in for the model. Decider prompts get a keyword-based
+        plan in the ---EXPLANATION--- / ---PLAN--- format (or, for a plan repair, the plan
+        as strict structured-outputs JSON); response prompts get a
+        templated summary of the execution data; evaluator prompts get a verdict
+        (the facts of the asked kind the response states, a refusal check, or fixed scores);
+        conversation summary prompts get the user's earlier messages. Follow-up questions
+        about details resolve to the medications last named in the conversation context.
+
+    Inputs:
+        messages (list[dict]): Chat messages as sent to chat.completions.
+        medication_names (list[str]): Known medication names for plan building.
+
+    Output Schema:
+        str
+
+    Error Handling:
+        This method never raises exceptions.
+
+    Fallback Behavior:
+        Unrecognized requests produce a plan with the "none" tool.
+    """
+    system_prompt = "\n".join(m.get("content") or "" for m in messages if m.get("role") in ("system", "developer"))
+    user_messages = [m.get("content") or "" for m in messages if m.get("role") == "user"]
+    user_message = user_messages[-1] if user_messages else ""
+
+    if "---PLAN---" in system_prompt:
+        context = system_prompt.split("Conversation so far", 1)[1] if "Conversation so far" in system_prompt else ""
+        if repair_marker in system_prompt:
+            return _repair_reply(user_message, medication_names, context.split(repair_marker, 1)[0])
+        return _decider_reply(user_message, medication_names, context)
+    if summarizer_marker in system_prompt:
+        return _summarizer_reply(user_message)
+    if evaluator_marker in system_prompt:
+        return _evaluator_reply(user_message, system_prompt)
+    return _responder_reply(user_message, system_prompt)
+
+
+def estimate_tokens(texts: Iterable[str]) -> int:
+    return sum((len(text) + 3) // 4 for text in texts)
+
+
+def split_tokens(text: str) -> List[str]:
+    """Split text into word-sized pseudo tokens for streaming."""
+    return TOKEN_PATTERN.findall(text)
+
+
+class PromptPrefixCache:
+    """
+    Provider-style prompt caching for the mock: a request's cached tokens are the longest
+    prefix, from PROMPT_CACHE_MIN_TOKENS on in PROMPT_CACHE_BLOCK_TOKENS steps, that an
+    earlier request began with. Shows whether prompts keep a stable prefix.
+    """
+
+    def __init__(self) -> None:
+        self._seen: set = set()
+        self._lock = threading.Lock()
+
+    def cached_tokens(self, messages: Sequence[Dict[str, Any]]) -> int:
+        text = "".join(f"{m.get('role')}\n{m.get('content') or ''}\n" for m in messages)
+        cached = 0
+        with self._lock:
+            for tokens in range(PROMPT_CACHE_MIN_TOKENS, estimate_tokens([text]) + 1, PROMPT_CACHE_BLOCK_TOKENS):
+                key = hashlib.blake2b(text[:tokens * 4].encode(), digest_size=16).digest()
+                if key in self._seen:
+                    cached = tokens
+                else:
+                    self._seen.add(key)
+        return cached
+
+
+def _usage(messages: Sequence[Dict[str, Any]], reply: str,
+           prompt_cache: Optional[PromptPrefixCache] = None) -> Dict[str, Any]:
+    prompt_tokens = estimate_tokens(m.get("content") or "" for m in messages)
+    completion_tokens = len(split_tokens(reply))
+    cached_tokens = min(prompt_tokens, prompt_cache.cached_tokens(messages)) if prompt_cache is not None else 0
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": cached_tokens},
+    }
+
+
+def mock_embedding(text: str, dimensions: int = EMBEDDING_DIMENSIONS) -> List[float]:
+    """Deterministic bag-of-words embedding: each word is hashed into one of `dimensions` buckets."""
+    vector = [0.0] * dimensions
+    for word in re.findall(r"\w+", text.casefold()):
+        vector[int.from_bytes(hashlib.blake2b(word.encode(), digest_size=4).digest(), "big") % dimensions] += 1.0
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+def _namespace(value: Any) -> Any:
+    if isinstance(value, dict):
+        return SimpleNamespace(**{k: _namespace(v) for k, v in value.items()})
+    return value
+
+
+def _completion(reply: str, messages: Sequence[Dict[str, Any]], model: str,
+                prompt_cache: Optional[PromptPrefixCache] = None) -> SimpleNamespace:
+    return SimpleNamespace(
+        id=f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        model=model,
+        choices=[SimpleNamespace(index=0, message=SimpleNamespace(role="assistant", content=reply),
+                                 finish_reason="stop")],
+        usage=_namespace(_usage(messages, reply, prompt_cache)),
+    )
+
+
+def complete_batch(requests_path: str, output_path: str, medication_names: Sequence[str] = ()) -> int:
+    """
+    Answer an OpenAI Batch input file (one chat completion request per line) offline,
+    writing the output file the Batch API would produce. Returns the number of requests.
+    """
+    count = 0
+    prompt_cache = PromptPrefixCache()
+    with open(requests_path, "r", encoding="utf-8") as source, open(output_path, "w", encoding="utf-8") as target:
+        for line in source:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            body = request.get("body", {})
+            messages = body.get("messages", [])
+            reply = scripted_reply(messages, medication_names)
+            response = {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", MODEL_NAME),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply},
+                             "finish_reason": "stop", "logprobs": None}],
+                "usage": _usage(messages, reply, prompt_cache),
+            }
+            target.write(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                "custom_id": request.get("custom_id"),
+                "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": response},
+                "error": None,
+            }, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+class _MockChatStream:
+    """Context manager mirroring the event stream returned by chat.completions.stream()."""
+
+    def __init__(self, owner: "MockOpenAI", messages: Sequence[Dict[str, Any]], model: str) -> None:
+        self._owner = owner
+        self._messages = messages
+        self._model = model
+        self._reply = scripted_reply(messages, owner.medication_names)
+        self._completion = _completion(self._reply, messages, model, owner.prompt_cache)
+
+    def __enter__(self) -> "_MockChatStream":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        return None
+
+    def __iter__(self) -> Iterator[SimpleNamespace]:
+        if self._owner.latency:
+            time.sleep(self._owner.latency)
+        snapshot = ""
+        for token in split_tokens(self._reply):
+            if self._owner.tokens_per_second:
+                time.sleep(1 / self._owner.tokens_per_second)
+            snapshot += token
+            yield SimpleNamespace(type="content.delta", delta=token, snapshot=snapshot)
+        yield SimpleNamespace(type="content.done", content=self._reply)
+
+    def get_final_completion(self) -> SimpleNamespace:
+        return self._completion
+
+
+class _AsyncMockChatStream(_MockChatStream):
+    """Async context manager / iterator counterpart of _MockChatStream."""
+
+    async def __aenter__(self) -> "_AsyncMockChatStream":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        return None
+
+    async def __aiter__(self) -> AsyncIterator[SimpleNamespace]:
+        if self._owner.latency:
+            await asyncio.sleep(self._owner.latency)
+        snapshot = ""
+        for token in split_tokens(self._reply):
+            if self._owner.tokens_per_second:
+                await asyncio.sleep(1 / self._owner.tokens_per_second)
+            snapshot += token
+            yield SimpleNamespace(type="content.delta", delta=token, snapshot=snapshot)
+        yield SimpleNamespace(type="content.done", content=self._reply)
+
+    async def get_final_completion(self) -> SimpleNamespace:
+        return self._completion
+
+
+class MockOpenAI:
+    """
+    Name:
+        MockOpenAI
+
+    Purpose:
+        In-process stand-in for the OpenAI client covering the calls Ephraim makes:
+        chat.completions.create(), chat.completions.stream() and embeddings.create().
+        Replies come from scripted_reply, with configurable latency and token rate, so
+        the full pipeline can be run and timed without a network or an API key.
+
+    Inputs:
+        latency (float): Seconds before the first token (and before a non-streamed reply).
+        tokens_per_second (float): Streaming rate; 0 streams without delay.
+        medication_names (list[str]): Passed to scripted_reply.
+
+    Output Schema:
+        Objects with the attributes Ephraim reads from the real SDK responses.
+
+    Error Handling:
+        This class never raises exceptions.
+
+    Fallback Behavior:
+        None
+    """
+
+    def __init__(self, latency: float = 0.0, tokens_per_second: float = 0.0,
+                 medication_names: Sequence[str] = ()) -> None:
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.medication_names = list(medication_names)
+        self.prompt_cache = PromptPrefixCache()
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create, stream=self._stream))
+        self.embeddings = SimpleNamespace(create=self._embed)
+
+    def _generation_time(self, reply: str) -> float:
+        rate = len(split_tokens(reply)) / self.tokens_per_second if self.tokens_per_second else 0.0
+        return self.latency + rate
+
+    def _create(self, model: str = MODEL_NAME, messages: Sequence[Dict[str, Any]] = (), **kwargs: Any) -> SimpleNamespace:
+        self.calls += 1
+        reply = scripted_reply(messages, self.medication_names)
+        time.sleep(self._generation_time(reply))
+        return _completion(reply, messages, model, self.prompt_cache)
+
+    def _stream(self, model: str = MODEL_NAME, messages: Sequence[Dict[str, Any]] = (), **kwargs: Any) -> _MockChatStream:
+        self.calls += 1
+        return _MockChatStream(self, messages, model)
+
+    def _embed(self, model: str = "", input: str = "", **kwargs: Any) -> SimpleNamespace:
+        return SimpleNamespace(data=[SimpleNamespace(embedding=mock_embedding(input))])
+
+
+class AsyncMockOpenAI(MockOpenAI):
+    """AsyncOpenAI counterpart of MockOpenAI for AsyncEphraim."""
+
+    async def _create(self, model: str = MODEL_NAME, messages: Sequence[Dict[str, Any]] = (),
+                      **kwargs: Any) -> SimpleNamespace:
+        self.calls += 1
+        reply = scripted_reply(messages, self.medication_names)
+        await asyncio.sleep(self._generation_time(reply))
+        return _completion(reply, messages, model, self.prompt_cache)
+
+    def _stream(self, model: str = MODEL_NAME, messages: Sequence[Dict[str, Any]] = (),
+                **kwargs: Any) -> _AsyncMockChatStream:
+        self.calls += 1
+        return _AsyncMockChatStream(self, messages, model)
+
+    async def _embed(self, model: str = "", input: str = "", **kwargs: Any) -> SimpleNamespace:
+        return SimpleNamespace(data=[SimpleNamespace(embedding=mock_embedding(input))])
+
+
+class FakeOpenAIServer:
+    """
+    Name:
+        FakeOpenAIServer
+
+    Purpose:
+        Minimal local HTTP server implementing POST /v1/chat/completions (plain and
+        streamed) with scripted_reply, so the async agent can be load-tested offline.
+        Point an (Async)OpenAI client at http://<host>:<port>/v1 with any API key.
+
+    Inputs:
+        host (str), port (int): Listening address.
+        latency (float): Seconds before the first token.
+        tokens_per_second (float): Streaming rate; 0 streams without delay.
+        medication_names (list[str]): Passed to scripted_reply.
+
+    Output Schema:
+        OpenAI chat.completion / chat.completion.chunk JSON.
+
+    Error Handling:
+        Malformed requests get a 400 response; unknown paths a 404.
+
+    Fallback Behavior:
+        None
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, latency: float = 0.0,
+                 tokens_per_second: float = 0.0, medication_names: Sequence[str] = ()) -> None:
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.medication_names = list(medication_names)
+        self.prompt_cache = PromptPrefixCache()
+        self._server: asyncio.AbstractServer | None = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+
+                if request.method != "POST" or not request.path.rstrip("/").endswith("/chat/completions"):
+                    await send_json(writer, 404, {"error": {"message": f"Unknown path {request.path}"}})
+                else:
+                    try:
+                        payload = request.json()
+                    except ValueError:
+                        await send_json(writer, 400, {"error": {"message": "Invalid JSON body"}})
+                    else:
+                        await self._complete(writer, payload)
+
+                if not request.keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _complete(self, writer: asyncio.StreamWriter, request: Dict[str, Any]) -> None:
+        messages = request.get("messages", [])
+        reply = scripted_reply(messages, self.medication_names)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        model = request.get("model", MODEL_NAME)
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if not request.get("stream"):
+            await send_json(writer, 200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": reply},
+                    "finish_reason": "stop",
+                    "logprobs": None,
+                }],
+                "usage": _usage(messages, reply, self.prompt_cache),
+            })
+            return
+
+        start_event_stream(writer)
+
+        async def send_event(payload: Any) -> None:
+            data = payload if isinstance(payload, str) else json.dumps(payload)
+            await write_chunk(writer, f"data: {data}\n\n".encode())
+
+        def chunk(delta: Dict[str, Any], finish_reason: str | None = None) -> Dict[str, Any]:
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason, "logprobs": None}],
+            }
+
+        await send_event(chunk({"role": "assistant", "content": ""}))
+        for token in split_tokens(reply):
+            if self.tokens_per_second:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            await send_event(chunk({"content": token}))
+        await send_event(chunk({}, finish_reason="stop"))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            usage_chunk = chunk({})
+            usage_chunk["choices"] = []
+            usage_chunk["usage"] = _usage(messages, reply, self.prompt_cache)
+            await send_event(usage_chunk)
+        await send_event("[DONE]")
+        await end_chunked(writer)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local fake OpenAI chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Streaming rate (0 = unthrottled)")
+    parser.add_argument("--database", default=DATABASE_FILE_NAME, help="database.json used for medication names")
+    parser.add_argument("--complete-batch", nargs=2, metavar=("INPUT", "OUTPUT"), default=None,
+                        help="Answer an OpenAI Batch input file offline instead of serving")
+    cmd_args = parser.parse_args()
+
+    if cmd_args.complete_batch:
+        answered = complete_batch(*cmd_args.complete_batch, medication_names=load_medication_names(cmd_args.database))
+        print(f"Answered {answered} batch requests into {cmd_args.complete_batch[1]}")
+        raise SystemExit(0)
+
+    server = FakeOpenAIServer(
+        host=cmd_args.host,
+        port=cmd_args.port,
+        latency=cmd_args.latency,
+        tokens_per_second=cmd_args.tokens_per_second,
+        medication_names=load_medication_names(cmd_args.database),
+    )
+    print(f"Fake OpenAI server listening on {server.base_url}")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,293 @@
+import contextlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from cache import CacheEntry, ResponseCache, plan_is_standalone, plan_is_user_specific
+from consts import MODEL_NAME
+from executor import ExecutionOutcome, PlanExecutor, PlanRun
+from helpers import broken_rule_in_plan, generate_tool_map, identity_tools, is_error
+from language import LanguageDetector
+from memory import ConversationMemory, SummaryJob
+from plan_schema import PlanValidator, plan_response_format, read_repaired_plan
+from plan_stream import DeciderStreamParser
+from prompt_builder import DeciderPromptBuilder, build_decider_messages, build_repair_messages
+from responses import CACHE_PATH, ResponseRenderer, logout_message
+from storage import BaseStore
+from tracing import TRACER, record_usage
+
+
+class DecisionStream:
+    """
+    Name:
+        DecisionStream
+
+    Purpose:
+        A decider reply as it streams in: each delta yields the explanation text to show,
+        and every completed plan step is started on `run` right away, as long as it and
+        the steps before it pass validation. Identity-gated steps, which may prompt the
+        user, and the steps after them wait until the whole plan has been validated.
+        The explanation is held back until the first step is parsed and dropped if that
+        step reports a broken rule, as for cached decisions (helpers.broken_rule_in_plan).
+
+    Inputs:
+        tools_class (type): Toolbox class the steps are validated against.
+        run (PlanRun): Run the valid steps are added to.
+
+    Output Schema:
+        feed() and finish() return (explanation text to show, whether the explanation just
+        ended); content is the full reply and dispatched the steps already started.
+
+    Error Handling:
+        This class never raises exceptions; invalid steps stop the dispatching.
+
+    Fallback Behavior:
+        None
+    """
+
+    def __init__(self, tools_class: type, run: PlanRun) -> None:
+        self.run = run
+        self.dispatched: List[dict] = []
+        self._parser = DeciderStreamParser()
+        self._validator = PlanValidator(tools_class)
+        self._identity_tools = identity_tools(tools_class)
+        self._dispatching = True
+        # Explanation text not shown yet, and whether to show it (None until the first step is parsed)
+        self._held: List[str] = []
+        self._show_explanation: Optional[bool] = None
+        self._explanation_ended = False
+
+    def feed(self, delta: str) -> Tuple[str, bool]:
+        """Consume one streamed delta."""
+        update = self._parser.feed(delta)
+        self._held.append(update.explanation)
+        for step in update.steps:
+            if self._show_explanation is None:
+                self._show_explanation = not (isinstance(step.get("tool"), str)
+                                              and broken_rule_in_plan({"plan": [step]}))
+            self._dispatching = (self._dispatching and not self._validator.check_step(step)
+                                 and step.get("tool") not in self._identity_tools)
+            if self._dispatching:
+                self.run.add_step(step)
+                self.dispatched.append(step)
+        return self._release()
+
+    def finish(self) -> Tuple[str, bool]:
+        """Call once the reply is complete: a reply without any parsed step (e.g. malformed JSON) shows its explanation."""
+        if self._show_explanation is None:
+            self._show_explanation = True
+        return self._release()
+
+    def _release(self) -> Tuple[str, bool]:
+        if not self._show_explanation:
+            if self._show_explanation is False:
+                self._held.clear()
+            return "", False
+        text = "".join(self._held)
+        self._held.clear()
+        ended = self._parser.explanation_complete and not self._explanation_ended
+        self._explanation_ended = self._explanation_ended or ended
+        return text, ended
+
+    @property
+    def content(self) -> str:
+        return self._parser.content
+
+
+class EphraimPipeline:
+    """
+    Name:
+        EphraimPipeline
+
+    Purpose:
+        The synchronous logic of a turn, shared by Ephraim (blocking, on a console) and
+        AsyncEphraim (on an event loop, through a channel): snapshot pinning, response
+        cache lookups, dispatching and repairing plans, caching responses and keeping
+        the conversation memory. Subclasses only call the LLM, wait for the executor and
+        write output, each in their own way.
+
+    Inputs:
+        store (BaseStore): Data store; each turn pins one snapshot of it.
+        tools (PharmacyTools): Toolbox the plans run against.
+        executor (PlanExecutor): Executor the plans run on.
+        response_cache (ResponseCache): Decisions and responses cached across turns.
+        logger (logging.Logger): Debug output of plans, repairs and summaries.
+
+    Output Schema:
+        None (base class).
+
+    Error Handling:
+        Decider failures are returned as standardized error dicts, never raised.
+
+    Fallback Behavior:
+        Identity-gated steps run on the shared executor unless a subclass sets _prompt_pool.
+    """
+
+    def __init__(self, store: BaseStore, tools, executor: PlanExecutor, response_cache: ResponseCache,
+                 logger: logging.Logger) -> None:
+        self.logger = logger
+        self.store: BaseStore = store
+        self.tools = tools
+        self.executor: PlanExecutor = executor
+        self.response_cache: ResponseCache = response_cache
+        self.language_detector: LanguageDetector = LanguageDetector()
+        self.tool_map: dict = generate_tool_map(type(tools))
+        self.decider_prompt_builder: DeciderPromptBuilder = DeciderPromptBuilder()
+        self.response_renderer: ResponseRenderer = ResponseRenderer()
+        self.identity_tools: frozenset = identity_tools(type(tools))
+        # Recent turns and a summary of older ones, given to the decider and responder
+        self.memory: ConversationMemory = ConversationMemory()
+        # Token usage of the current turn's LLM calls ("decide", "respond"), see tracing.usage_counts
+        self.turn_usage: Dict[str, Dict[str, int]] = {}
+        self._speculative_run: Optional[Tuple[dict, PlanRun]] = None
+        self._prompt_pool: Optional[ThreadPoolExecutor] = None
+
+    @contextlib.contextmanager
+    def _pinned_snapshot(self) -> Iterator[BaseStore]:
+        """
+        Pin this turn's tool calls to one snapshot of the data; a reload swapping in a newer
+        snapshot meanwhile only affects the next turn.
+        """
+        snapshot = self.store.snapshot()
+        self.tools.store = snapshot
+        try:
+            yield snapshot
+        finally:
+            self.tools.store = self.store
+            self.store.release(snapshot)
+
+    def _cache_entry(self, cached: Optional[CacheEntry], user_message: str, context: str) -> Optional[CacheEntry]:
+        """The looked-up entry, unless the message means something else mid-conversation."""
+        if cached is not None and context and not plan_is_standalone(cached.plan, user_message):
+            return None  # e.g. "what about its price?"
+        return cached
+
+    def _cached_response(self, cached: Optional[CacheEntry], data_version: Any) -> Optional[str]:
+        """The entry's response if it can be served for the current data (and the turn takes the cache path)."""
+        response = self.response_cache.cached_response(cached, data_version)
+        if response is not None:
+            self.tools.language = cached.language
+            self.response_renderer.record(CACHE_PATH)
+        return response
+
+    def _replay_cached_decision(self, cached: CacheEntry) -> Optional[str]:
+        """Adopt a cached decision; returns the explanation to show again, if any."""
+        self.tools.language = self.language_detector.language = cached.language
+        self.logger.debug(f"Plan: {cached.plan}")
+        if cached.explanation and not broken_rule_in_plan(cached.plan):
+            return cached.explanation
+        return None
+
+    def _decider_messages(self, user_message: str, context: str) -> list:
+        return build_decider_messages(self.decider_prompt_builder.build(self.tool_map), user_message, context)
+
+    def _start_run(self) -> PlanRun:
+        return self.executor.start(self.tools, self._prompt_pool)
+
+    def _start_decision_stream(self) -> DecisionStream:
+        return DecisionStream(self.tools.__class__, self._start_run())
+
+    def _repair_request(self, messages: list, content: str, failure: dict) -> Dict[str, Any]:
+        """
+        Arguments of the one structured-outputs request (schema from the toolbox signatures)
+        that repairs a plan which failed to parse or validate.
+        """
+        problems = failure["details"]["problems"]
+        self.logger.debug(f"Repairing plan: {problems}")
+        return {
+            "model": MODEL_NAME,
+            "messages": build_repair_messages(messages, content, problems),
+            "response_format": plan_response_format(self.tools.__class__),
+            "prompt_cache_key": self.decider_prompt_builder.cache_key,
+        }
+
+    def _read_repair(self, content: str, completion, failure: dict) -> tuple | dict:
+        """(explanation, plan) from the repair completion, or `failure` if the repaired plan is still invalid."""
+        self.turn_usage["repair"] = record_usage("repair", completion.usage)
+        repaired = read_repaired_plan(content, completion.choices[0].message.content, self.tools.__class__)
+        TRACER.inc("ephraim_plan_repairs_total", status="failed" if isinstance(repaired, list) else "ok")
+        if isinstance(repaired, list):
+            self.logger.debug(f"Repaired plan is still invalid: {repaired}")
+            return failure
+        return repaired
+
+    @staticmethod
+    def _abandoned_run(decision: tuple | dict, stream: DecisionStream) -> Optional[PlanRun]:
+        """
+        The stream's run if its steps are not the start of the decided plan (the decider failed,
+        or the repaired plan starts differently); subclasses cancel it, waiting for the calls
+        in flight, before _settle_decision starts a new run.
+        """
+        if is_error(decision) or decision[1]["plan"][:len(stream.dispatched)] != stream.dispatched:
+            return stream.run
+        return None
+
+    def _settle_decision(self, user_message: str, context: str, decision: tuple | dict,
+                         stream: DecisionStream) -> dict:
+        """
+        Finish a checked (and possibly repaired) decision: start the steps the stream has not
+        dispatched, keep the run for _take_speculative_run and cache the plan. Returns the
+        plan, or the decider error.
+        """
+        run = stream.run
+        if is_error(decision):
+            run.cancel()
+            TRACER.current().set_error(decision["code"])
+            TRACER.inc("ephraim_errors_total", code=decision["code"], source="decider")
+            return decision
+        explanation, plan = decision
+        dispatched = stream.dispatched
+        if plan["plan"][:len(dispatched)] != dispatched:
+            # The repaired plan starts differently from the steps already started (see _abandoned_run)
+            run.cancel()
+            run, dispatched = self._start_run(), []
+        for step in plan["plan"][len(dispatched):]:
+            run.add_step(step)
+        self._speculative_run = (plan, run)
+        if not context or plan_is_standalone(plan, user_message):
+            self.response_cache.store_plan(user_message, plan, explanation, self.tools.language)
+        self.logger.debug(f"Plan: {plan}")
+        return plan
+
+    def _take_speculative_run(self, plan: dict) -> Optional[PlanRun]:
+        """The run started while `plan` was being decided, if any (steps already running are joined, not re-run)."""
+        speculative, self._speculative_run = self._speculative_run, None
+        if speculative is not None and speculative[0] is plan:
+            return speculative[1]
+        return None
+
+    def _finish_turn(self, user_message: str, context: str, decision: dict, outcome: ExecutionOutcome,
+                     response: str, data_version: Any) -> None:
+        """Cache a response that is valid for anyone asking the same, and remember the turn."""
+        if (not is_error(decision) and not plan_is_user_specific(decision, self.identity_tools)
+                and (not context or plan_is_standalone(decision, user_message))):
+            self.response_cache.store_response(user_message, response, data_version)
+        self._remember(user_message, response, outcome)
+
+    def _remember(self, user_message: str, response: str, outcome: ExecutionOutcome | None = None) -> None:
+        """Add the turn to the conversation memory (a logout forgets it instead) and summarize evicted turns."""
+        if outcome is not None and any(step.tool == "logout" for step in outcome.steps):
+            self.memory.clear()
+            return
+        self.memory.add_turn(user_message, response, outcome)
+        job = self.memory.take_summary_job()
+        if job is not None:
+            self._start_summary(job)
+
+    def _start_summary(self, job: SummaryJob) -> None:
+        """Summarize evicted turns in the background (a thread or a task, depending on the subclass)."""
+        raise NotImplementedError
+
+    def _summary_text(self, completion) -> str:
+        record_usage("summarize", completion.usage)
+        return completion.choices[0].message.content
+
+    def forget_identity(self) -> bool:
+        """Log out without confirming it to the user (e.g. the server's /logout endpoint); returns whether anyone was logged in."""
+        return self._forget_identity()[1]
+
+    def _forget_identity(self) -> Tuple[str, bool]:
+        """Log out: forget the verified identity and the conversation. Returns the reply and whether anyone was logged in."""
+        user = self.tools.identity.logout()
+        self.memory.clear()
+        return logout_message(user.name if user is not None else None, self.tools.language), user is not None
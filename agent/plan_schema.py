@@ -0,0 +1,266 @@
+import collections.abc
+import functools
+import inspect
+import json
+import typing
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
+
+from consts import NO_TOOL
+from helpers import error, is_error, parse_decider_response
+from plan_stream import EXPLANATION_MARKER, PLAN_MARKER
+
+ITEM_REFERENCE = "$item"
+STEP_KEYS = ("tool", "args", "save_as", "foreach")
+
+_JSON_TYPES = {str: "string", int: "integer", float: "number", bool: "boolean"}
+
+
+class ToolSignature(NamedTuple):
+    """
+    Arguments a tool accepts: {name: JSON schema} and the names that have no default, and
+    whether its result can be a list (i.e. iterated by a `foreach`).
+    """
+    name: str
+    parameters: Dict[str, Dict[str, Any]]
+    required: Tuple[str, ...]
+    returns_list: bool = True
+
+
+def _type_schema(annotation: Any) -> Dict[str, Any]:
+    """JSON schema of a parameter annotation; Optional[...] becomes nullable."""
+    origin = typing.get_origin(annotation)
+    if origin is Union:
+        members = [member for member in typing.get_args(annotation) if member is not type(None)]
+        schema = _type_schema(members[0]) if len(members) == 1 else {}
+        if "type" in schema and len(members) < len(typing.get_args(annotation)):
+            schema = {**schema, "type": [schema["type"], "null"]}
+        return schema
+    if origin in (list, List):
+        items = typing.get_args(annotation)
+        return {"type": "array", "items": _type_schema(items[0]) if items else {}}
+    if annotation in _JSON_TYPES:
+        return {"type": _JSON_TYPES[annotation]}
+    return {}
+
+
+def _returns_list(annotation: Any) -> bool:
+    """
+    True if a return annotation admits a sequence (a list, tuple or Sequence class other than
+    str). Errors are dicts, so Union[List[str], Dict[str, Any]] qualifies; no hint (Any) does too.
+    """
+    if annotation is Any:
+        return True
+    origin = typing.get_origin(annotation)
+    if origin is Union:
+        return any(_returns_list(member) for member in typing.get_args(annotation))
+    kind = origin or annotation
+    return (isinstance(kind, type) and issubclass(kind, collections.abc.Sequence)
+            and not issubclass(kind, (str, bytes)))
+
+
+@functools.lru_cache(maxsize=None)
+def tool_signatures(tools_class: type) -> Dict[str, ToolSignature]:
+    """{tool name: ToolSignature} for the public methods of a toolbox class, read from their signatures."""
+    signatures: Dict[str, ToolSignature] = {}
+    for name, func in inspect.getmembers(tools_class, predicate=inspect.isfunction):
+        if name.startswith("_"):
+            continue
+        hints = typing.get_type_hints(func)
+        parameters: Dict[str, Dict[str, Any]] = {}
+        required: List[str] = []
+        for parameter in list(inspect.signature(func).parameters.values())[1:]:
+            parameters[parameter.name] = _type_schema(hints.get(parameter.name, Any))
+            if parameter.default is inspect.Parameter.empty:
+                required.append(parameter.name)
+        signatures[name] = ToolSignature(name, parameters, tuple(required), _returns_list(hints.get("return", Any)))
+    signatures[NO_TOOL] = ToolSignature(NO_TOOL, {}, (), False)
+    return signatures
+
+
+def _strict(schema: Dict[str, Any], optional: bool) -> Dict[str, Any]:
+    """
+    A parameter schema as strict structured outputs need it: every argument is present, so
+    optional ones are nullable, and non-string arguments may also be the foreach "$item".
+    """
+    if optional and "type" in schema and not isinstance(schema["type"], list):
+        schema = {**schema, "type": [schema["type"], "null"]}
+    if not schema:
+        return {"type": ["string", "number", "boolean", "null"]}
+    if schema.get("type") in ("string", ["string", "null"]):
+        return schema
+    return {"anyOf": [schema, {"type": "string", "enum": [ITEM_REFERENCE]}]}
+
+
+@functools.lru_cache(maxsize=None)
+def plan_response_format(tools_class: type) -> Dict[str, Any]:
+    """
+    response_format for a structured-outputs plan: {"plan": [step, ...]} where each step is
+    one tool (by name) with exactly that tool's arguments.
+    """
+    variants = []
+    for signature in tool_signatures(tools_class).values():
+        arguments = {name: _strict(schema, name not in signature.required)
+                     for name, schema in signature.parameters.items()}
+        variants.append({
+            "type": "object",
+            "properties": {
+                "tool": {"type": "string", "enum": [signature.name]},
+                "args": {"type": "object", "properties": arguments, "required": list(arguments),
+                         "additionalProperties": False},
+                "save_as": {"type": ["string", "null"]},
+                "foreach": {"type": ["string", "null"]},
+            },
+            "required": list(STEP_KEYS),
+            "additionalProperties": False,
+        })
+    schema = {
+        "type": "object",
+        "properties": {"plan": {"type": "array", "items": {"anyOf": variants}}},
+        "required": ["plan"],
+        "additionalProperties": False,
+    }
+    return {"type": "json_schema", "json_schema": {"name": "execution_plan", "strict": True, "schema": schema}}
+
+
+def _matches(value: Any, schema: Dict[str, Any]) -> bool:
+    expected = schema.get("type")
+    if expected is None:
+        return True
+    if isinstance(expected, list):
+        return any(_matches(value, {**schema, "type": option}) for option in expected)
+    if expected == "null":
+        return value is None
+    if expected == "string":
+        return isinstance(value, str)
+    if expected == "boolean":
+        return isinstance(value, bool)
+    if expected == "integer":
+        return isinstance(value, int) and not isinstance(value, bool)
+    if expected == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if expected == "array":
+        return isinstance(value, list) and all(_matches(item, schema.get("items", {})) for item in value)
+    return True
+
+
+class PlanValidator:
+    """
+    Name:
+        PlanValidator
+
+    Purpose:
+        Local check of a decider plan before anything runs: known tool names, argument names
+        and types (from tool_signatures), required arguments, and `foreach` references to an
+        earlier step's `save_as` whose tool returns a list. Steps can be checked one at a
+        time as they stream in.
+
+    Inputs:
+        tools_class (type): Toolbox class whose public methods are the valid tools.
+
+    Output Schema:
+        check_step() and check_plan() return a list of problems (empty if the plan is valid).
+
+    Error Handling:
+        This class never raises exceptions.
+
+    Fallback Behavior:
+        None
+    """
+
+    def __init__(self, tools_class: type) -> None:
+        self.signatures: Dict[str, ToolSignature] = tool_signatures(tools_class)
+        # {save_as: whether the step's tool returns a list}
+        self._saved: Dict[str, bool] = {}
+        self._index = 0
+
+    def check_step(self, step: Any) -> List[str]:
+        """Problems of the next step of the plan."""
+        self._index += 1
+        where = f"step {self._index}"
+        if not isinstance(step, dict):
+            return [f"{where} is not an object"]
+        tool = step.get("tool")
+        signature = self.signatures.get(tool) if isinstance(tool, str) else None
+        if signature is None:
+            return [f"{where}: unknown tool {step.get('tool')!r}"]
+
+        problems: List[str] = []
+        foreach = step.get("foreach")
+        if foreach is not None and (not isinstance(foreach, str) or foreach not in self._saved):
+            problems.append(f"{where}: foreach {foreach!r} is not the save_as of an earlier step")
+        elif foreach is not None and not self._saved[foreach]:
+            problems.append(f"{where}: foreach {foreach!r} is not a list (its tool does not return one)")
+        args = step.get("args") or {}
+        if not isinstance(args, dict):
+            return problems + [f"{where}: args must be an object"]
+        for name, value in args.items():
+            schema = signature.parameters.get(name)
+            if schema is None:
+                problems.append(f"{where}: {signature.name} has no argument {name!r}")
+            elif value == ITEM_REFERENCE:
+                if foreach is None:
+                    problems.append(f"{where}: {ITEM_REFERENCE!r} is only valid in a foreach step")
+            elif not _matches(value, schema):
+                problems.append(f"{where}: argument {name!r} of {signature.name} must be of type {schema['type']}")
+        problems.extend(f"{where}: {signature.name} needs argument {name!r}"
+                        for name in signature.required if name not in args)
+        save_as = step.get("save_as")
+        if isinstance(save_as, str):
+            # A foreach step saves the list of its items' results
+            self._saved[save_as] = foreach is not None or signature.returns_list
+        elif save_as is not None:
+            problems.append(f"{where}: save_as must be a string")
+        return problems
+
+    def check_plan(self, plan: Any) -> List[str]:
+        """Problems of a whole plan ({"plan": [step, ...]})."""
+        if not isinstance(plan, dict) or not isinstance(plan.get("plan"), list):
+            return ['the plan must be a JSON object with a "plan" list']
+        if not plan["plan"]:
+            return [f'the plan has no steps (use the {NO_TOOL!r} tool when no tool applies)']
+        return [problem for step in plan["plan"] for problem in self.check_step(step)]
+
+
+def check_decision(content: str, tools_class: type) -> Union[Tuple[str, Dict[str, Any]], Dict[str, Any]]:
+    """
+    parse_decider_response plus PlanValidator: (explanation, plan), or an error dict
+    (INVALID_LLM_FORMAT, INVALID_JSON or INVALID_PLAN) whose details.problems say what is wrong.
+    """
+    parsed = parse_decider_response(content)
+    if is_error(parsed):
+        parsed["details"] = {"problems": [parsed["message"]]}
+        return parsed
+    problems = PlanValidator(tools_class).check_plan(parsed[1])
+    if problems:
+        return error(message="LLM plan failed validation", code="INVALID_PLAN", details={"problems": problems})
+    return parsed
+
+
+def read_repaired_plan(content: str, repair_reply: Optional[str],
+                       tools_class: type) -> Union[Tuple[str, Dict[str, Any]], List[str]]:
+    """
+    (explanation, plan) after a repair: the explanation of the original decider reply
+    `content` and the plan of the structured-outputs `repair_reply`, without the nulls strict
+    mode fills in for unused arguments and keys. Returns the remaining problems instead if the
+    repaired plan is still invalid.
+    """
+    try:
+        plan = json.loads(repair_reply or "")
+    except json.JSONDecodeError:
+        return ["the repaired plan is not valid JSON"]
+    if isinstance(plan, dict) and isinstance(plan.get("plan"), list):
+        plan = {"plan": [_without_nulls(step) for step in plan["plan"]]}
+    problems = PlanValidator(tools_class).check_plan(plan)
+    if problems:
+        return problems
+    explanation = content.split(PLAN_MARKER, 1)[0].replace(EXPLANATION_MARKER, "", 1).strip()
+    return explanation, plan
+
+
+def _without_nulls(step: Any) -> Any:
+    if not isinstance(step, dict):
+        return step
+    step = {key: value for key, value in step.items() if value is not None}
+    if isinstance(step.get("args"), dict):
+        step["args"] = {name: value for name, value in step["args"].items() if value is not None}
+    return step
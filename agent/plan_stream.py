@@ -0,0 +1,127 @@
+import json
+import re
+from typing import List, NamedTuple, Optional
+
+EXPLANATION_MARKER = "---EXPLANATION---"
+PLAN_MARKER = "---PLAN---"
+_PLAN_ARRAY = re.compile(r'"plan"\s*:\s*\[')
+
+
+class StreamUpdate(NamedTuple):
+    explanation: str
+    steps: List[dict]
+
+
+class DeciderStreamParser:
+    """
+    Name:
+        DeciderStreamParser
+
+    Purpose:
+        Incrementally parse a streamed tool-decider completion. Explanation text is
+        released as soon as it can no longer be part of a section marker, and each
+        step object of the PLAN JSON is released as soon as its closing brace arrives,
+        so it can be executed while the rest of the plan is still being generated.
+
+    Inputs:
+        None; text is passed to feed() as it streams in.
+
+    Output Schema:
+        feed() returns StreamUpdate(explanation: str, steps: list[dict]) with only the new parts.
+
+    Error Handling:
+        Step objects that are not valid JSON are skipped; the caller still validates
+        the complete content with plan_schema.check_decision.
+
+    Fallback Behavior:
+        Content without a PLAN marker yields explanation text only.
+    """
+
+    def __init__(self) -> None:
+        self.content: str = ""
+        self.explanation_complete: bool = False
+        self._explanation_sent: int = 0
+        self._plan_start: Optional[int] = None
+        self._scan_pos: Optional[int] = None
+        self._depth: int = 0
+        self._in_string: bool = False
+        self._escaped: bool = False
+        self._object_start: Optional[int] = None
+        self._plan_closed: bool = False
+
+    @property
+    def explanation(self) -> str:
+        """Full explanation text released so far (complete once explanation_complete is True)."""
+        return self._explanation_text(final=self.explanation_complete)
+
+    def feed(self, delta: str) -> StreamUpdate:
+        self.content += delta
+        explanation = self._release_explanation()
+        steps = self._scan_plan() if self._plan_start is not None else []
+        return StreamUpdate(explanation, steps)
+
+    def _explanation_text(self, final: bool) -> str:
+        if self._plan_start is not None:
+            region = self.content[:self._plan_start - len(PLAN_MARKER)]
+        else:
+            # Hold back a tail that could still turn out to be the start of the PLAN marker
+            region = self.content[:max(0, len(self.content) - len(PLAN_MARKER) + 1)]
+        stripped = region.lstrip()
+        if not final and EXPLANATION_MARKER.startswith(stripped):
+            return ""
+        text = stripped.replace(EXPLANATION_MARKER, "", 1).lstrip()
+        return text.strip() if final else text.rstrip()
+
+    def _release_explanation(self) -> str:
+        if self._plan_start is None:
+            marker_at = self.content.find(PLAN_MARKER)
+            if marker_at != -1:
+                self._plan_start = marker_at + len(PLAN_MARKER)
+                self.explanation_complete = True
+        text = self._explanation_text(final=self.explanation_complete)
+        released = text[self._explanation_sent:]
+        self._explanation_sent = max(self._explanation_sent, len(text))
+        return released
+
+    def _scan_plan(self) -> List[dict]:
+        if self._plan_closed:
+            return []
+        if self._scan_pos is None:
+            match = _PLAN_ARRAY.search(self.content, self._plan_start)
+            if match is None:
+                return []
+            self._scan_pos = match.end()
+
+        steps: List[dict] = []
+        content = self.content
+        i = self._scan_pos
+        while i < len(content):
+            char = content[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 0 and char == "{":
+                    self._object_start = i
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0:
+                    self._plan_closed = True
+                    i += 1
+                    break
+                self._depth -= 1
+                if self._depth == 0 and char == "}" and self._object_start is not None:
+                    try:
+                        steps.append(json.loads(content[self._object_start:i + 1]))
+                    except json.JSONDecodeError:
+                        pass
+                    self._object_start = None
+            i += 1
+        self._scan_pos = i
+        return steps
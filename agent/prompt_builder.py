@@ -0,0 +1,149 @@
+import hashlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from helpers import count_tokens
+from prompts import (basic_rules, decider_output_format, evaluator_quality_variants, evaluator_rules, evaluator_tasks,
+                     repair_rules, response_format, response_rules, summarizer_rules, tool_decider_rules)
+
+# Static system prompt of the responder. Per-turn data goes in later messages, so every
+# request starts with the same bytes and the provider's prompt prefix cache can serve them.
+RESPONSE_SYSTEM_PROMPT = "\n".join([basic_rules, response_rules])
+
+
+def prompt_cache_key(name: str, prompt: str) -> str:
+    """
+    `prompt_cache_key` request parameter for a static prompt prefix. Requests with the same
+    key are routed to the same prompt cache, and the key changes whenever the prefix does.
+    """
+    return f"ephraim-{name}-{hashlib.sha256(prompt.encode()).hexdigest()[:12]}"
+
+
+RESPONSE_CACHE_KEY = prompt_cache_key("respond", RESPONSE_SYSTEM_PROMPT)
+
+
+class DeciderPromptBuilder:
+    """
+    Name:
+        DeciderPromptBuilder
+
+    Purpose:
+        Render the tool-decider system prompt from a tool map and keep the result cached.
+        The prompt is only re-rendered when the tool map it was built from changes. It holds
+        only static content (rules, tool catalog in name order, output format), so it is
+        byte-identical across turns and processes and forms a cacheable prompt prefix; the
+        user's message follows it.
+
+    Inputs:
+        None
+
+    Output Schema:
+        build() returns the rendered prompt (str); cache_key is its prompt_cache_key.
+
+    Error Handling:
+        This class never raises exceptions.
+
+    Fallback Behavior:
+        An empty tool map renders a prompt without any tools listed.
+    """
+
+    def __init__(self) -> None:
+        self._tools: Optional[Tuple[Tuple[str, str], ...]] = None
+        self._prompt: str = ""
+        self._token_count: int = 0
+        self._cache_key: str = ""
+
+    def build(self, tool_map: Dict[str, str]) -> str:
+        """Return the decider prompt for `tool_map`, rendering it only if the tools changed."""
+        tools = tuple(tool_map.items())
+        if tools != self._tools:
+            self._prompt = self._render(tools)
+            self._token_count = count_tokens(self._prompt)
+            self._cache_key = prompt_cache_key("decide", self._prompt)
+            self._tools = tools
+        return self._prompt
+
+    @property
+    def token_count(self) -> int:
+        """Token size of the most recently rendered prompt."""
+        return self._token_count
+
+    @property
+    def cache_key(self) -> str:
+        """prompt_cache_key of the most recently rendered prompt."""
+        return self._cache_key
+
+    @staticmethod
+    def _render(tools: Tuple[Tuple[str, str], ...]) -> str:
+        lines = list(tool_decider_rules)
+        lines.append("\nAvailable tools:\n")
+        lines.extend(f"- {tool_name}: {description}" for tool_name, description in tools)
+        lines.extend(response_format)
+        return "\n".join(lines) + decider_output_format
+
+
+def _context_messages(context: str) -> List[Dict[str, str]]:
+    """The conversation context (see memory.ConversationMemory), placed after the static prompt prefix."""
+    if not context:
+        return []
+    return [{"role": "system", "content": "Conversation so far (oldest first):\n" + context}]
+
+
+def build_decider_messages(system_prompt: str, user_message: str, context: str = "") -> List[Dict[str, str]]:
+    """Build the chat messages that ask the decider LLM for a plan."""
+    return [
+        {"role": "system", "content": system_prompt},
+        *_context_messages(context),
+        {"role": "user", "content": user_message},
+    ]
+
+
+def build_repair_messages(decider_messages: Sequence[Dict[str, str]], reply: str,
+                          problems: Sequence[str]) -> List[Dict[str, str]]:
+    """
+    Build the one follow-up request that asks the decider to fix a plan that failed to parse or
+    validate: the original decider messages (so the cached prompt prefix is reused), its reply,
+    and the problems found.
+    """
+    return [
+        *decider_messages,
+        {"role": "assistant", "content": reply},
+        {"role": "system", "content": "\n".join(repair_rules) + "\n" + "\n".join(f"- {problem}" for problem in problems)},
+    ]
+
+
+def build_response_messages(user_content: str, execution_summary: str, context: str = "") -> List[Dict[str, str]]:
+    """
+    Build the chat messages that ask the LLM for the final, user-facing answer: the static
+    RESPONSE_SYSTEM_PROMPT first, then the conversation so far, this turn's data and the user's message.
+    """
+    return [
+        {"role": "system", "content": RESPONSE_SYSTEM_PROMPT},
+        *_context_messages(context),
+        # The summary is already text; JSON-encoding it again would escape every quote, newline and Hebrew letter
+        {"role": "system", "content": "Relevant data:\n" + execution_summary},
+        {"role": "user", "content": user_content},
+    ]
+
+
+def build_summary_messages(transcript: str) -> List[Dict[str, str]]:
+    """Build the chat messages that ask the LLM to fold evicted turns into the conversation summary."""
+    return [
+        {"role": "system", "content": "\n".join(summarizer_rules)},
+        {"role": "user", "content": transcript},
+    ]
+
+
+def build_evaluator_messages(category: str, request: str, response: str, qualities: Sequence[str] = (),
+                             variant: int = 0) -> List[Dict[str, str]]:
+    """
+    Build the chat messages that ask the Evaluator LLM to judge one Ephraim response
+    (see EVALUATION.md). Quality passes use a different `variant` framing each.
+    """
+    lines = list(evaluator_rules)
+    lines.extend(line.replace("{qualities}", ", ".join(qualities)) for line in evaluator_tasks[category])
+    if category == "quality":
+        lines.append(evaluator_quality_variants[variant % len(evaluator_quality_variants)])
+    return [
+        {"role": "system", "content": "\n".join(lines)},
+        {"role": "user", "content": f"REQUEST:\n{request}\n\nRESPONSE:\n{response}"},
+    ]
@@ -0,0 +1,193 @@
+import asyncio
+import random
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence
+
+from openai import RateLimitError
+
+from helpers import count_tokens
+
+DEFAULT_MAX_RETRIES = 6
+DEFAULT_BASE_DELAY = 1.0
+# Completion tokens assumed per request when reserving the tokens-per-minute budget
+DEFAULT_COMPLETION_TOKENS = 256
+
+
+def is_rate_limit_error(e: BaseException) -> bool:
+    return isinstance(e, RateLimitError) or getattr(e, "status_code", None) == 429
+
+
+def retry_delay(e: BaseException, attempt: int, base_delay: float = DEFAULT_BASE_DELAY) -> float:
+    """The server's retry-after-ms / retry-after header if present, else exponential backoff with jitter."""
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            return max(0.0, float(headers.get(header)) * scale)
+        except (TypeError, ValueError):
+            continue
+    return base_delay * 2 ** attempt * random.uniform(0.5, 1.0)
+
+
+def estimate_request_tokens(messages: Sequence[Dict[str, Any]], completion_tokens: int = DEFAULT_COMPLETION_TOKENS) -> int:
+    return sum(count_tokens(message.get("content") or "") for message in messages) + completion_tokens
+
+
+class _Bucket:
+    """Token bucket refilled continuously at `per_minute` per minute, starting full."""
+
+    def __init__(self, per_minute: float, now: float) -> None:
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = now
+
+    def wait(self, amount: float, now: float) -> float:
+        """Seconds until `amount` is available (requests larger than the bucket wait for a full one)."""
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        missing = min(amount, self.capacity) - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """
+    Name:
+        RateLimiter
+
+    Purpose:
+        Schedule LLM requests from many coroutines within one API key's limits. A request
+        waits for a concurrency slot and for the requests-per-minute and tokens-per-minute
+        budgets before it is sent. A rate-limit error (HTTP 429) pauses every request for
+        the server's retry-after time (or an exponential backoff) and the request is retried,
+        so concurrent callers back off together instead of hammering the API.
+
+    Inputs:
+        requests_per_minute (float): Request budget; 0 disables it.
+        tokens_per_minute (float): Token budget; 0 disables it.
+        max_concurrency (int): Requests in flight at once.
+        max_retries (int): Retries of a rate-limited request before the error is raised.
+        base_delay (float): First backoff delay when the server sends no retry-after.
+
+    Output Schema:
+        stats (Counter): "requests", "throttled" (waited for budget), "rate_limited" (429s)
+        and "wait_seconds".
+
+    Error Handling:
+        Errors other than rate limits, and rate limits after max_retries, are raised to the caller.
+
+    Fallback Behavior:
+        With no budgets configured, only the concurrency limit and 429 handling apply.
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0, max_concurrency: int = 16,
+                 max_retries: int = DEFAULT_MAX_RETRIES, base_delay: float = DEFAULT_BASE_DELAY) -> None:
+        now = time.monotonic()
+        self._requests: Optional[_Bucket] = _Bucket(requests_per_minute, now) if requests_per_minute else None
+        self._tokens: Optional[_Bucket] = _Bucket(tokens_per_minute, now) if tokens_per_minute else None
+        self._slots = asyncio.Semaphore(max(1, max_concurrency))
+        self._paused_until = 0.0
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.stats: Counter = Counter()
+
+    async def acquire(self, tokens: int) -> None:
+        """Wait for a slot and for budget for one request of `tokens` tokens."""
+        await self._slots.acquire()
+        throttled = False
+        while True:
+            now = time.monotonic()
+            wait = max(
+                self._paused_until - now,
+                self._requests.wait(1, now) if self._requests else 0.0,
+                self._tokens.wait(tokens, now) if self._tokens else 0.0,
+            )
+            if wait <= 0:
+                break
+            throttled = True
+            self.stats["wait_seconds"] += wait
+            await asyncio.sleep(wait)
+        if self._requests:
+            self._requests.take(1)
+        if self._tokens:
+            self._tokens.take(tokens)
+        self.stats["requests"] += 1
+        self.stats["throttled"] += throttled
+
+    def release(self) -> None:
+        self._slots.release()
+
+    def back_off(self, seconds: float) -> None:
+        """Pause every request for `seconds` (after a rate-limit error)."""
+        self.stats["rate_limited"] += 1
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def send(self, request: Callable[[], Awaitable[Any]], tokens: int) -> Any:
+        """
+        Await `request()` once a slot and budget are available, retrying rate-limit errors.
+        On success the slot stays held until release() (a stream holds it while it is read).
+        """
+        attempt = 0
+        await self.acquire(tokens)
+        while True:
+            try:
+                return await request()
+            except Exception as e:
+                self.release()
+                if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                    raise
+                self.back_off(retry_delay(e, attempt, self.base_delay))
+                attempt += 1
+            await self.acquire(tokens)
+
+
+class _LimitedStream:
+    """Async context manager that opens a chat completion stream through a RateLimiter."""
+
+    def __init__(self, limiter: RateLimiter, open_stream: Callable[[], Any], tokens: int) -> None:
+        self._limiter = limiter
+        self._open_stream = open_stream
+        self._tokens = tokens
+        self._manager: Any = None
+
+    async def __aenter__(self) -> Any:
+        async def enter() -> Any:
+            # The request is sent when the stream is entered, so a fresh manager is needed per attempt
+            self._manager = self._open_stream()
+            return await self._manager.__aenter__()
+        return await self._limiter.send(enter, self._tokens)
+
+    async def __aexit__(self, *exc_info: Any) -> Any:
+        try:
+            return await self._manager.__aexit__(*exc_info)
+        finally:
+            self._limiter.release()
+
+
+class RateLimitedClient:
+    """
+    AsyncOpenAI wrapper whose chat.completions.create() and .stream() go through a shared
+    RateLimiter; everything else is passed to the wrapped client.
+    """
+
+    def __init__(self, client: Any, limiter: RateLimiter) -> None:
+        self._client = client
+        self.limiter = limiter
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create, stream=self._stream))
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._client, name)
+
+    async def _create(self, **kwargs: Any) -> Any:
+        tokens = estimate_request_tokens(kwargs.get("messages", ()))
+        completion = await self.limiter.send(lambda: self._client.chat.completions.create(**kwargs), tokens)
+        self.limiter.release()
+        return completion
+
+    def _stream(self, **kwargs: Any) -> _LimitedStream:
+        tokens = estimate_request_tokens(kwargs.get("messages", ()))
+        return _LimitedStream(self.limiter, lambda: self._client.chat.completions.stream(**kwargs), tokens)
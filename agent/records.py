@@ -0,0 +1,192 @@
+import sys
+from array import array
+from collections.abc import Sequence
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+
+class _Record:
+    """
+    Fixed-field record stored in __slots__ instead of a per-record dict. List values
+    become tuples, and strings of INTERNED fields (and of list fields) are interned, so
+    values repeated across records (cities, availability, side effects, ...) are shared.
+    Fields missing from the source dict are None and omitted again by to_json(); keys
+    outside FIELDS are kept in `extra`.
+    """
+
+    __slots__ = ("extra",)
+    FIELDS: Tuple[str, ...] = ()
+    INTERNED: frozenset = frozenset()
+
+    def __init__(self, **values: Any) -> None:
+        for name in self.FIELDS:
+            setattr(self, name, values.pop(name, None))
+        self.extra: Optional[Dict[str, Any]] = values or None
+
+    @classmethod
+    def from_dict(cls, record: Dict[str, Any]) -> "_Record":
+        values: Dict[str, Any] = {}
+        for name, value in record.items():
+            if isinstance(value, list):
+                value = tuple(sys.intern(item) if isinstance(item, str) else item for item in value)
+            elif name in cls.INTERNED and isinstance(value, str):
+                value = sys.intern(value)
+            values[name] = value
+        return cls(**values)
+
+    def to_json(self) -> Dict[str, Any]:
+        """JSON-serializable dict in the database.json schema."""
+        result: Dict[str, Any] = {}
+        for name in self.FIELDS:
+            value = getattr(self, name)
+            if value is not None:
+                result[name] = list(value) if isinstance(value, tuple) else value
+        if self.extra:
+            result.update(self.extra)
+        return result
+
+    def __eq__(self, other: Any) -> bool:
+        return type(other) is type(self) and self.to_json() == other.to_json()
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_json()!r})"
+
+
+class User(_Record):
+    """A pharmacy customer (see database.json "users")."""
+
+    __slots__ = ("id", "name", "age", "dob", "city", "prescriptions")
+    FIELDS = ("id", "name", "age", "dob", "city", "prescriptions")
+    INTERNED = frozenset({"city"})
+
+
+class Medication(_Record):
+    """An inventory entry (see database.json "pharmacy_inventory")."""
+
+    __slots__ = ("name", "dosages", "usage_instructions", "availability", "active_ingredients",
+                 "generic_name", "side_effects", "price", "manufacturer")
+    FIELDS = ("name", "dosages", "usage_instructions", "availability", "active_ingredients",
+              "generic_name", "side_effects", "price", "manufacturer")
+    INTERNED = frozenset({"usage_instructions", "availability", "manufacturer"})
+
+
+class LogEntry(NamedTuple):
+    """The fields of a prescription fill log that tools return."""
+    medication: str
+    date_filled: str
+    quantity: Any
+    status: str
+
+
+class LogTable:
+    """
+    Name:
+        LogTable
+
+    Purpose:
+        Append-only columnar store of prescription fill logs. Each LogEntry field is an
+        array of 4-byte codes into one table of distinct values, so the columns take 16
+        bytes per log and repeated medication names, dates and statuses are stored once.
+        The distinct values come on top: a table of the benchmark's synthetic logs holds
+        about 50 bytes per log, and a loaded store about 100 with its per-user position
+        arrays (see benchmark.py).
+
+    Inputs:
+        None; logs are added with append().
+
+    Output Schema:
+        view(positions) returns a LogView over the given log positions.
+
+    Error Handling:
+        append() raises TypeError for unhashable field values.
+
+    Fallback Behavior:
+        Missing fields are stored as None.
+    """
+
+    def __init__(self) -> None:
+        self._values: List[Any] = []
+        self._codes: Dict[Tuple[type, Any], int] = {}
+        self._columns: Tuple[array, ...] = tuple(array("I") for _ in LogEntry._fields)
+
+    def __len__(self) -> int:
+        return len(self._columns[0])
+
+    def _code(self, value: Any) -> int:
+        # Keyed by type as well, so e.g. 30 and 30.0 keep their own JSON representation
+        key = (type(value), value)
+        code = self._codes.get(key)
+        if code is None:
+            code = self._codes[key] = len(self._values)
+            self._values.append(value)
+        return code
+
+    def append(self, log: Dict[str, Any]) -> int:
+        """Add a log in the database.json schema and return its position."""
+        for column, name in zip(self._columns, LogEntry._fields):
+            column.append(self._code(log.get(name)))
+        return len(self) - 1
+
+    def entry(self, position: int) -> LogEntry:
+        values = self._values
+        return LogEntry(*(values[column[position]] for column in self._columns))
+
+    def view(self, positions: Sequence[int]) -> "LogView":
+        return LogView(self, positions)
+
+    @classmethod
+    def from_logs(cls, logs: Iterable[Dict[str, Any]]) -> "LogView":
+        """Pack logs decoded for a single lookup and return a view over all of them."""
+        table = cls()
+        for log in logs:
+            table.append(log)
+        return table.view(range(len(table)))
+
+
+class LogView(Sequence):
+    """Read-only sequence of LogEntry over selected positions of a LogTable, in position order."""
+
+    __slots__ = ("_table", "_positions")
+
+    def __init__(self, table: LogTable, positions: Sequence[int]) -> None:
+        self._table = table
+        self._positions = positions
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def __getitem__(self, index: Any) -> Any:
+        if isinstance(index, slice):
+            return LogView(self._table, self._positions[index])
+        return self._table.entry(self._positions[index])
+
+    def __iter__(self) -> Iterator[LogEntry]:
+        entry = self._table.entry
+        return (entry(position) for position in self._positions)
+
+    def to_json(self) -> List[Dict[str, Any]]:
+        """One {medication, date_filled, quantity, status} dict per log."""
+        values = self._table._values
+        medication, date_filled, quantity, status = self._table._columns
+        return [
+            {
+                "medication": values[medication[position]],
+                "date_filled": values[date_filled[position]],
+                "quantity": values[quantity[position]],
+                "status": values[status[position]],
+            }
+            for position in self._positions
+        ]
+
+    def __repr__(self) -> str:
+        return f"LogView({len(self)} logs)"
+
+
+def to_json(value: Any) -> Any:
+    """Convert records (and lists, tuples and dicts containing them) into JSON-serializable values."""
+    if isinstance(value, (_Record, LogView)):
+        return value.to_json()
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if isinstance(value, dict):
+        return {key: to_json(item) for key, item in value.items()}
+    return value
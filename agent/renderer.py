@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import deque
+from typing import Deque, List, Optional
+
+from rich.console import Console
+
+DEFAULT_FPS = 30.0
+DEFAULT_CHARS_PER_SECOND = 250.0
+
+
+class OutputRenderer:
+    """
+    Name:
+        OutputRenderer
+
+    Purpose:
+        Shared, buffered console writer. Text is queued and a background thread prints
+        everything that arrived during a frame in a single console call, so a stream of
+        small LLM deltas costs one render per frame rather than one per delta. Text written
+        with paced=True (e.g. a replayed explanation) is revealed at chars_per_second,
+        a frame's worth of characters at a time.
+
+    Inputs:
+        console (Console): Console that frames are printed to.
+        fps (float): Frames per second.
+        chars_per_second (float | None): Reveal rate for paced text; None or 0 disables pacing.
+
+    Output Schema:
+        None; output goes to the console.
+
+    Error Handling:
+        This class never raises exceptions from write() or flush().
+
+    Fallback Behavior:
+        flush() prints all pending text at once (used before asking the user for input);
+        drain() waits for it to be printed at the normal pace.
+    """
+
+    def __init__(self, console: Console, fps: float = DEFAULT_FPS,
+                 chars_per_second: Optional[float] = DEFAULT_CHARS_PER_SECOND) -> None:
+        self.console = console
+        self.frame_interval = 1.0 / fps
+        self.chars_per_frame = max(1, int(chars_per_second * self.frame_interval)) if chars_per_second else 0
+        self.frames = 0
+        self._pending: Deque[list] = deque()
+        self._condition = threading.Condition()
+        # Held while a frame is taken from the queue and printed, so frames never interleave
+        self._print_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    def write(self, text: str, end: str = "\n", markup: bool = False, paced: bool = False) -> None:
+        """Queue text for the next frame (Rich markup only if markup=True)."""
+        text += end
+        if not text:
+            return
+        with self._condition:
+            self._pending.append([text, markup, paced and self.chars_per_frame > 0])
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ephraim-renderer", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def flush(self) -> None:
+        """Print everything queued so far immediately, ignoring pacing."""
+        with self._print_lock:
+            with self._condition:
+                segments = [(text, markup) for text, markup, _ in self._pending]
+                self._pending.clear()
+                self._condition.notify_all()
+            self._emit(segments)
+
+    def drain(self) -> None:
+        """Block until everything queued so far has been printed at its normal pace."""
+        with self._condition:
+            while self._pending and not self._closed:
+                self._condition.wait()
+        with self._print_lock:
+            pass
+
+    def close(self) -> None:
+        """Flush pending output and stop the render thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self.flush()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+            # Let a frame's worth of deltas accumulate before rendering them together
+            time.sleep(self.frame_interval)
+            self._render_frame()
+
+    def _render_frame(self) -> None:
+        with self._print_lock:
+            segments: List[tuple] = []
+            budget = self.chars_per_frame
+            with self._condition:
+                while self._pending:
+                    text, markup, paced = self._pending[0]
+                    if not paced:
+                        segments.append((text, markup))
+                        self._pending.popleft()
+                        continue
+                    if budget <= 0:
+                        break
+                    segments.append((text[:budget], markup))
+                    if len(text) > budget:
+                        self._pending[0][0] = text[budget:]
+                        break
+                    budget -= len(text)
+                    self._pending.popleft()
+                self._condition.notify_all()
+            self._emit(segments)
+
+    def _emit(self, segments: List[tuple]) -> None:
+        if not segments:
+            return
+        # Merge neighbouring segments of the same kind into a single print call
+        merged: List[list] = []
+        for text, markup in segments:
+            if merged and merged[-1][1] == markup:
+                merged[-1][0] += text
+            else:
+                merged.append([text, markup])
+        for text, markup in merged:
+            self.console.print(text, end="", markup=markup, highlight=False)
+        self.frames += 1
@@ -0,0 +1,140 @@
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from executor import ExecutionOutcome
+from helpers import is_error
+from tracing import TRACER
+
+TEMPLATE_PATH = "template"
+LLM_PATH = "llm"
+CACHE_PATH = "cache"
+
+TEMPLATES: Dict[str, Dict[str, str]] = {
+    "en": {
+        "inventory": "These medications are currently available: {items}.",
+        "inventory_empty": "No medications are currently in stock.",
+        "RULE_VIOLATION": "I'm sorry, but I can't help with that request because it goes against my service rules ({rule}). "
+                          "Please consult a healthcare professional for medical advice.",
+        "USER_NOT_FOUND": "I'm sorry, I couldn't find a user named {user_name}, so I can't complete your request.",
+        "INVALID_DOB": "I'm sorry, the date of birth {user_dob} is not in the YYYY-MM-DD format, so I can't complete your request.",
+        "INCORRECT_DOB": "I'm sorry, the date of birth you entered doesn't match our records, so I can't complete your request.",
+        "MEDICATION_NOT_FOUND": "I'm sorry, I couldn't find a medication named {medication_name} in our inventory.",
+        "MEDICATION_SUGGESTIONS": "I'm sorry, I couldn't find a medication named {medication_name} in our inventory. "
+                                  "Did you mean {suggestions}?",
+        "NO_PRESCRIPTIONS": "I couldn't find any prescription history for {user_name}.",
+        "TOO_MANY_ATTEMPTS": "I'm sorry, there have been too many incorrect attempts for {user_name}. "
+                             "Please try again in {retry_after_seconds} seconds.",
+        "DECIDER_ERROR": "I'm sorry, I had trouble understanding how to handle your request. Could you please rephrase it?",
+        "logout": "You have been logged out, {user_name}. I'll ask for your name and date of birth next time.",
+        "logout_none": "No one is currently logged in.",
+        "error": "I'm sorry, I couldn't complete your request: {message}",
+    },
+    "he": {
+        "inventory": "התרופות הזמינות כרגע הן: {items}.",
+        "inventory_empty": "אין כרגע תרופות במלאי.",
+        "RULE_VIOLATION": "אני מצטער, אינני יכול לעזור בבקשה זו מכיוון שהיא מפרה את כללי השירות. "
+                          "לייעוץ רפואי אנא פנה לאיש מקצוע בתחום הבריאות.",
+        "USER_NOT_FOUND": "אני מצטער, לא מצאתי משתמש בשם {user_name}, ולכן אינני יכול להשלים את הבקשה.",
+        "INVALID_DOB": "אני מצטער, תאריך הלידה {user_dob} אינו בפורמט YYYY-MM-DD, ולכן אינני יכול להשלים את הבקשה.",
+        "INCORRECT_DOB": "אני מצטער, תאריך הלידה שהוזן אינו תואם לרישומים שלנו, ולכן אינני יכול להשלים את הבקשה.",
+        "MEDICATION_NOT_FOUND": "אני מצטער, לא מצאתי תרופה בשם {medication_name} במלאי שלנו.",
+        "MEDICATION_SUGGESTIONS": "אני מצטער, לא מצאתי תרופה בשם {medication_name} במלאי שלנו. "
+                                  "האם התכוונת ל-{suggestions}?",
+        "NO_PRESCRIPTIONS": "לא מצאתי היסטוריית מרשמים עבור {user_name}.",
+        "TOO_MANY_ATTEMPTS": "אני מצטער, היו יותר מדי ניסיונות שגויים עבור {user_name}. "
+                             "אנא נסה שוב בעוד {retry_after_seconds} שניות.",
+        "DECIDER_ERROR": "אני מצטער, לא הצלחתי להבין כיצד לטפל בבקשה שלך. תוכל לנסח אותה מחדש?",
+        "logout": "התנתקת בהצלחה, {user_name}. בפעם הבאה אבקש שוב את שמך ותאריך הלידה שלך.",
+        "logout_none": "אף משתמש אינו מחובר כרגע.",
+        "error": "אני מצטער, לא הצלחתי להשלים את הבקשה: {message}",
+    },
+}
+
+INVENTORY_EMPTY_MARKER = "No medications currently in stock"
+
+
+def logout_message(user_name: Optional[str], language: str) -> str:
+    """Confirmation of a logout (user_name None if nobody was logged in); English if `language` has no templates."""
+    templates = TEMPLATES.get(language, TEMPLATES["en"])
+    return templates["logout"].format(user_name=user_name) if user_name else templates["logout_none"]
+
+
+class _Defaults(dict):
+    """format_map mapping that renders unknown placeholders as empty strings."""
+
+    def __missing__(self, key: str) -> str:
+        return ""
+
+
+class ResponseRenderer:
+    """
+    Name:
+        ResponseRenderer
+
+    Purpose:
+        Answer plan outcomes that need no synthesis from localized templates, so those
+        turns skip the second LLM call. Covers inventory-only and logout plans, tool
+        errors (including report_broken_rule) and decider failures.
+
+    Inputs:
+        None
+
+    Output Schema:
+        render() returns the final response (str), or None when the LLM must answer.
+        counters (Counter) counts how often each path was taken.
+
+    Error Handling:
+        This class never raises exceptions.
+
+    Fallback Behavior:
+        Languages without templates, and all other plan shapes, fall back to the LLM.
+    """
+
+    def __init__(self) -> None:
+        self.counters: Counter = Counter()
+
+    def record(self, path: str) -> None:
+        """Count a turn answered outside render(), e.g. from the response cache."""
+        self.counters[path] += 1
+        TRACER.inc("ephraim_response_path_total", path=path)
+
+    def render(self, plan: Dict[str, Any], outcome: ExecutionOutcome, language: str) -> Optional[str]:
+        """Return a templated response for the turn, or None if it needs the LLM."""
+        templates = TEMPLATES.get(language)
+        response = None
+        reason = None
+
+        if templates is not None:
+            if is_error(plan):
+                reason = "decider_error"
+                response = templates["DECIDER_ERROR"]
+            elif outcome.error is not None:
+                code = outcome.error.get("code")
+                reason = f"error:{code}"
+                fields = _Defaults(outcome.error.get("details") or {})
+                if code == "MEDICATION_NOT_FOUND" and fields.get("suggestions"):
+                    code = "MEDICATION_SUGGESTIONS"
+                    fields["suggestions"] = ", ".join(fields["suggestions"])
+                template = templates.get(code, templates["error"])
+                fields["message"] = outcome.error.get("message", "")
+                response = template.format_map(fields)
+            elif [step.tool for step in outcome.steps] == ["check_inventory_status"]:
+                reason = "inventory"
+                items = outcome.steps[0].calls[0][1]
+                if items == [INVENTORY_EMPTY_MARKER]:
+                    response = templates["inventory_empty"]
+                else:
+                    response = templates["inventory"].format(items=", ".join(items))
+            elif [step.tool for step in outcome.steps] == ["logout"]:
+                reason = "logout"
+                result = outcome.steps[0].calls[0][1]
+                response = logout_message(result["user_name"] if result["logged_out"] else None, language)
+
+        if response is None:
+            self.counters[LLM_PATH] += 1
+            TRACER.inc("ephraim_response_path_total", path=LLM_PATH)
+            return None
+        self.counters[TEMPLATE_PATH] += 1
+        self.counters[f"{TEMPLATE_PATH}:{reason}"] += 1
+        TRACER.inc("ephraim_response_path_total", path=TEMPLATE_PATH)
+        return response
@@ -0,0 +1,175 @@
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from storage import STORAGE_BACKENDS, import_json_to_sqlite, open_store
+from synthetic import DatabaseSpec, SyntheticDatabase, load_base
+from tools import PharmacyTools
+
+DEFAULT_SCALES = (1_000, 10_000, 100_000)
+SAMPLES_PER_TOOL = 200
+
+
+class Bound(NamedTuple):
+    """
+    Growth allowed for one check between the smallest and largest scale, as the exponent k
+    in cost ~ N^k (0 = flat, 1 = linear), plus an optional absolute p50 budget at the largest scale.
+    """
+    max_exponent: float
+    max_p50_ms: Optional[float] = None
+
+
+# Lookups must stay flat as the database grows. check_inventory_status returns every
+# available medication, so it may grow linearly with the inventory but never faster.
+BOUNDS: Dict[str, Bound] = {
+    "load": Bound(max_exponent=1.2),
+    "get_medication_details_by_name": Bound(max_exponent=0.35, max_p50_ms=2.0),
+    "get_user_prescription_names": Bound(max_exponent=0.35, max_p50_ms=2.0),
+    "get_user_prescription_history": Bound(max_exponent=0.5, max_p50_ms=20.0),
+    "report_broken_rule": Bound(max_exponent=0.35, max_p50_ms=1.0),
+    "check_inventory_status": Bound(max_exponent=1.15),
+}
+
+
+def _tool_inputs(database: SyntheticDatabase, store, rng: random.Random) -> Dict[str, List[Dict[str, Any]]]:
+    """Sample tool arguments uniformly from the generated records, resolving a valid DOB for each user."""
+    users: List[Dict[str, Any]] = []
+    for _ in range(SAMPLES_PER_TOOL):
+        name = database.user_name(rng.randrange(database.user_count))
+        namesake = rng.choice(store.get_users(name))
+        users.append({"user_name": name, "user_dob": namesake.dob})
+    medications = [{"name": database.medication_name(rng.randrange(database.medication_count))}
+                   for _ in range(SAMPLES_PER_TOOL)]
+    return {
+        "get_medication_details_by_name": medications,
+        "get_user_prescription_names": users,
+        "get_user_prescription_history": users,
+        "report_broken_rule": [{"rule": "Do not give medical advice"}] * SAMPLES_PER_TOOL,
+        "check_inventory_status": [{}] * max(5, SAMPLES_PER_TOOL // 20),
+    }
+
+
+def _measure_calls(call: Callable, inputs: Sequence[Dict[str, Any]], measure_memory: bool) -> Dict[str, Any]:
+    durations: List[float] = []
+    for args in inputs:
+        started = time.perf_counter()
+        call(**args)
+        durations.append(time.perf_counter() - started)
+
+    peak = None
+    if measure_memory:
+        peaks: List[int] = []
+        tracemalloc.start()
+        for args in inputs[:20]:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            call(**args)
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+        tracemalloc.stop()
+        peak = statistics.median(peaks)
+    return {"p50_ms": statistics.median(durations) * 1000, "peak_bytes": peak}
+
+
+def measure_scale(records: int, storage: str, workdir: str, seed: int, measure_memory: bool) -> Dict[str, Any]:
+    """Generate a database of `records` records, then time (and trace) store loading and every tool."""
+    base = load_base()
+    database = SyntheticDatabase(DatabaseSpec.from_total(records, base, seed=seed), base)
+    path = os.path.join(workdir, f"scaling_{records}.json")
+    with open(path, "w") as f:
+        database.write(f)
+    if storage == "sqlite":
+        json_path, path = path, os.path.join(workdir, f"scaling_{records}.sqlite3")
+        import_json_to_sqlite(json_path, path)
+
+    started = time.perf_counter()
+    store = open_store(storage, path)
+    load = {"p50_ms": (time.perf_counter() - started) * 1000, "peak_bytes": None}
+    if measure_memory:
+        tracemalloc.start()
+        open_store(storage, path).close()
+        load["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    tools = PharmacyTools(store=store, channel=None, logger=logging.getLogger("scaling"))
+    results: Dict[str, Any] = {"load": load}
+    for tool, inputs in _tool_inputs(database, store, random.Random(seed)).items():
+        results[tool] = _measure_calls(getattr(tools, tool), inputs, measure_memory)
+    store.close()
+    return results
+
+
+def _exponent(small: Tuple[int, float], large: Tuple[int, float]) -> Optional[float]:
+    (n1, v1), (n2, v2) = small, large
+    if not v1 or not v2 or n1 == n2:
+        return None
+    return math.log(v2 / v1) / math.log(n2 / n1)
+
+
+def check_bounds(scales: Sequence[int], measurements: Dict[int, Dict[str, Any]]) -> List[str]:
+    """Return a description of every bound that was exceeded."""
+    failures: List[str] = []
+    small, large = min(scales), max(scales)
+    for check, bound in BOUNDS.items():
+        for metric in ("p50_ms", "peak_bytes"):
+            first, last = measurements[small][check][metric], measurements[large][check][metric]
+            if first is None or last is None:
+                continue
+            exponent = _exponent((small, first), (large, last))
+            measurements[large][check][f"{metric}_exponent"] = exponent
+            if exponent is not None and exponent > bound.max_exponent:
+                failures.append(f"{check}: {metric} grows as N^{exponent:.2f} (allowed N^{bound.max_exponent})")
+        p50 = measurements[large][check]["p50_ms"]
+        if bound.max_p50_ms is not None and p50 > bound.max_p50_ms:
+            failures.append(f"{check}: p50 {p50:.3f} ms at {large:,} records (allowed {bound.max_p50_ms} ms)")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check that store loading and every tool stay within latency/memory growth bounds as N grows")
+    parser.add_argument("--scales", type=int, nargs="+", default=list(DEFAULT_SCALES),
+                        help="Database sizes in records, e.g. 1000 100000 10000000")
+    parser.add_argument("--storage", choices=STORAGE_BACKENDS, default="json", help="Storage backend to check")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc measurements")
+    parser.add_argument("--output", default=None, help="Save the measurements as JSON")
+    cmd_args = parser.parse_args()
+    if len(set(cmd_args.scales)) < 2:
+        parser.error("--scales needs at least two different sizes")
+
+    workdir = tempfile.mkdtemp(prefix="ephraim-scaling-")
+    try:
+        all_measurements = {
+            records: measure_scale(records, cmd_args.storage, workdir, cmd_args.seed, not cmd_args.no_memory)
+            for records in sorted(set(cmd_args.scales))
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    problems = check_bounds(list(all_measurements), all_measurements)
+    for check in BOUNDS:
+        row = "  ".join(
+            f"{all_measurements[records][check]['p50_ms']:>10.3f} ms" for records in all_measurements)
+        print(f"{check:<32} {row}")
+    print(f"{'records':<32} " + "  ".join(f"{records:>13,}" for records in all_measurements))
+
+    if cmd_args.output:
+        with open(cmd_args.output, "w") as f:
+            json.dump({str(records): values for records, values in all_measurements.items()}, f, indent=2)
+
+    if problems:
+        print("\nScaling bounds exceeded:")
+        for problem in problems:
+            print(f"  - {problem}")
+        sys.exit(1)
+    print("\nAll scaling bounds hold.")
@@ -0,0 +1,300 @@
+import re
+import threading
+import unicodedata
+import weakref
+from array import array
+from collections import Counter
+from itertools import groupby
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+DEFAULT_LIMIT = 5
+# Candidates verified with the exact edit distance per query key
+MAX_CANDIDATES = 8
+# Trigram postings counted per query key, rarest trigrams first
+POSTINGS_BUDGET = 2048
+# Sound-alike matches rank below spelling matches of the same distance
+SOUND_WEIGHT = 0.9
+FIELD_RANK = {"name": 0, "generic_name": 1, "active_ingredient": 2}
+
+# Hebrew letters as the Latin consonant they usually transliterate to; letters that usually
+# stand for vowels (א, ה, ו, י, ע) are dropped, as vowels are in sound keys
+HEBREW_TO_LATIN = {
+    "א": "", "ב": "b", "ג": "g", "ד": "d", "ה": "", "ו": "", "ז": "z", "ח": "k", "ט": "t", "י": "",
+    "כ": "k", "ך": "k", "ל": "l", "מ": "m", "ם": "m", "נ": "n", "ן": "n", "ס": "s", "ע": "", "פ": "p",
+    "ף": "p", "צ": "s", "ץ": "s", "ק": "k", "ר": "r", "ש": "s", "ת": "t",
+}
+_HEBREW = str.maketrans(HEBREW_TO_LATIN)
+# Latin spellings folded into one consonant class each, so e.g. "Cetirizine" and "צטיריזין" meet
+_DIGRAPHS = (("ph", "p"), ("ch", "k"), ("ck", "k"), ("sh", "s"), ("th", "t"), ("tz", "s"), ("ts", "s"))
+_SOFT_C = re.compile(r"c(?=[eiy])")
+_LATIN_SOUNDS = str.maketrans({"a": "", "e": "", "i": "", "o": "", "u": "", "y": "", "w": "", "h": "",
+                               "c": "k", "q": "k", "f": "p", "v": "b", "z": "s", "x": "ks", "j": "g"})
+_NON_ALNUM = re.compile(r"[\W_]+")
+# Standalone dosages and pack sizes ("500", "500mg", "10 ml") are not part of a name
+_DOSAGE = re.compile(r"(?<!\w)\d+(?:[.,]\d+)?\s*(?:mg|mcg|ml|g|מ\"?ג|מ\"?ל)?(?!\w)", re.IGNORECASE)
+
+
+def _fold(text: str) -> str:
+    """Case-fold and drop accents and Hebrew vowel points."""
+    text = str(text)
+    if text.isascii():
+        return text.casefold()
+    text = unicodedata.normalize("NFKD", text).casefold()
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def spelling_key(text: str) -> str:
+    """Lower-case letters and digits only: "Pain-Away" and "painaway" share a key."""
+    return _NON_ALNUM.sub("", _fold(text))
+
+
+def sound_key(text: str) -> str:
+    """
+    Consonant skeleton of a name, with Hebrew letters transliterated: "PainAway" and
+    "פיינאוויי" both become "pn". Coarse on purpose; only used to rank near matches.
+    """
+    text = spelling_key(text).translate(_HEBREW)
+    for digraph, sound in _DIGRAPHS:
+        text = text.replace(digraph, sound)
+    text = _SOFT_C.sub("s", text).translate(_LATIN_SOUNDS)
+    return "".join(char for char, _ in groupby(text))
+
+
+def strip_dosages(query: str) -> str:
+    return " ".join(_DOSAGE.sub(" ", query).split())
+
+
+def levenshtein(a: str, b: str, limit: int) -> int:
+    """
+    Edit distance between `a` and `b`, or limit + 1 if it is larger than `limit`. Only the
+    band of 2 * limit + 1 diagonals that can stay within the limit is computed.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    over = limit + 1
+    previous = [j if j <= limit else over for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        char_a = a[i - 1]
+        low, high = max(1, i - limit), min(len(b), i + limit)
+        current = [over] * (len(b) + 1)
+        current[0] = i if i <= limit else over
+        for j in range(low, high + 1):
+            cost = previous[j - 1] if char_a == b[j - 1] else previous[j - 1] + 1
+            if previous[j] < cost:
+                cost = previous[j] + 1
+            if current[j - 1] < cost:
+                cost = current[j - 1] + 1
+            current[j] = cost if cost < over else over
+        if min(current[low - 1:high + 1]) >= over:
+            return over
+        previous = current
+    return previous[-1]
+
+
+def max_distance(key: str) -> int:
+    """Edits tolerated for a query key: none below 5 characters, then one per four characters (up to 2)."""
+    return 0 if len(key) < 5 else min(2, len(key) // 4)
+
+
+def _grams(key: str) -> List[str]:
+    padded = f"^{key}$"
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+class SearchMatch(NamedTuple):
+    """One ranked candidate: the medication, the term it matched on (name, generic name or ingredient) and a 0-1 score."""
+    name: str
+    matched: str
+    field: str
+    score: float
+
+    def to_json(self) -> Dict[str, Any]:
+        return {"name": self.name, "matched": self.matched, "field": self.field, "score": round(self.score, 2)}
+
+
+class _KeyIndex:
+    """Exact and trigram lookups over one kind of key (spelling or sound) of every term."""
+
+    def __init__(self) -> None:
+        self.keys: List[str] = []
+        self.exact: Dict[str, List[int]] = {}
+        self.grams: Dict[str, array] = {}
+
+    def add(self, term_id: int, key: str) -> None:
+        self.keys.append(key)
+        self.exact.setdefault(key, []).append(term_id)
+        grams = self.grams
+        for gram in set(_grams(key)):
+            if gram in grams:
+                grams[gram].append(term_id)
+            else:
+                grams[gram] = array("I", (term_id,))
+
+    def match(self, key: str) -> List[Tuple[int, int]]:
+        """(term id, edit distance) of the terms within max_distance(key) of `key`."""
+        exact = self.exact.get(key)
+        if exact:
+            return [(term_id, 0) for term_id in exact]
+        limit = max_distance(key)
+        if not limit:
+            return []
+        # A key within `limit` edits shares all but at most 3 * limit of the query's trigrams, so
+        # counting the 3 * limit + 1 rarest trigrams finds every such key. Trigrams common to
+        # much of the catalog are skipped beyond the postings budget, trading a little recall
+        # for bounded latency.
+        postings = sorted((self.grams.get(gram, ()) for gram in set(_grams(key))), key=len)
+        overlap: Counter = Counter()
+        counted = 0
+        for posting in postings[:3 * limit + 1]:
+            if counted + len(posting) > POSTINGS_BUDGET:
+                break
+            overlap.update(posting)
+            counted += len(posting)
+        if not overlap:
+            return []
+        # Only the terms sharing (nearly) the most counted trigrams are worth an edit distance
+        best = max(overlap.values())
+        candidates = [term_id for term_id, count in overlap.items() if count == best]
+        if len(candidates) < MAX_CANDIDATES:
+            candidates.extend(term_id for term_id, count in overlap.items() if count == best - 1)
+        matches = []
+        for term_id in candidates[:MAX_CANDIDATES]:
+            distance = levenshtein(key, self.keys[term_id], limit)
+            if distance <= limit:
+                matches.append((term_id, distance))
+        return matches
+
+
+class MedicationSearchIndex:
+    """
+    Name:
+        MedicationSearchIndex
+
+    Purpose:
+        Precomputed fuzzy search over the inventory's medication names, generic names and
+        active ingredients. Every distinct term gets a spelling key and a sound key (Hebrew
+        transliterated, vowels dropped), each with an exact map and a trigram index. A query
+        only verifies the best few trigram candidates with the edit distance, so lookups
+        stay well under a millisecond on a 100k-SKU catalog.
+
+    Inputs:
+        medications (iterable): (name, generic name, active ingredients) per inventory
+            record, as yielded by BaseStore.medication_terms().
+
+    Output Schema:
+        search() returns SearchMatch tuples, best first, one per medication.
+
+    Error Handling:
+        This class never raises exceptions for queries.
+
+    Fallback Behavior:
+        Queries with nothing within the edit-distance limit return an empty list. A
+        multi-word query that matches nothing as a whole is retried word by word.
+    """
+
+    def __init__(self, medications: Iterable[Tuple[str, Optional[str], Sequence[str]]]) -> None:
+        self._terms: List[str] = []
+        # Medications carrying each term, as (medication name, field)
+        self._owners: List[List[Tuple[str, str]]] = []
+        # Best FIELD_RANK among each term's owners
+        self._ranks = array("B")
+        self._term_ids: Dict[str, int] = {}
+        self._spelling = _KeyIndex()
+        self._sound = _KeyIndex()
+        self.size = 0
+        for name, generic_name, active_ingredients in medications:
+            self.size += 1
+            self._add_term(name, name, "name")
+            if generic_name:
+                self._add_term(generic_name, name, "generic_name")
+            for ingredient in active_ingredients:
+                self._add_term(ingredient, name, "active_ingredient")
+
+    def _add_term(self, term: str, owner: str, field: str) -> None:
+        key = spelling_key(term)
+        if not key:
+            return
+        term_id = self._term_ids.get(key)
+        if term_id is None:
+            term_id = self._term_ids[key] = len(self._terms)
+            self._terms.append(term)
+            self._owners.append([])
+            self._ranks.append(FIELD_RANK[field])
+            self._spelling.add(term_id, key)
+            self._sound.add(term_id, sound_key(term))
+        self._owners[term_id].append((owner, field))
+        self._ranks[term_id] = min(self._ranks[term_id], FIELD_RANK[field])
+
+    def _scores(self, query: str) -> Dict[int, float]:
+        """
+        Best score per matching term for one query string. Sound-alike matches are only looked
+        up when the spelling finds nothing (always, for Hebrew, which has no spelling matches).
+        """
+        scores: Dict[int, float] = {}
+        key = spelling_key(query)
+        if not key:
+            return scores
+        for index, weight, query_key in ((self._spelling, 1.0, key), (self._sound, SOUND_WEIGHT, sound_key(query))):
+            if scores or not query_key:
+                break
+            for term_id, distance in index.match(query_key):
+                score = weight * (1 - distance / max(len(query_key), len(index.keys[term_id])))
+                scores[term_id] = max(score, scores.get(term_id, 0.0))
+        return scores
+
+    def search(self, query: str, limit: int = DEFAULT_LIMIT) -> List[SearchMatch]:
+        """Medications whose name, generic name or an active ingredient resembles `query`, best first."""
+        query = strip_dosages(query)
+        scores = self._scores(query)
+        words = query.split()
+        if not scores and len(words) > 1:
+            for word in words:
+                for term_id, score in self._scores(word).items():
+                    scores[term_id] = max(score, scores.get(term_id, 0.0))
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self._ranks[item[0]]))
+        matches: List[SearchMatch] = []
+        seen = set()
+        for term_id, score in ranked:
+            for owner, field in sorted(self._owners[term_id], key=lambda owner: FIELD_RANK[owner[1]]):
+                if owner not in seen:
+                    seen.add(owner)
+                    matches.append(SearchMatch(owner, self._terms[term_id], field, score))
+                    if len(matches) >= limit:
+                        return matches
+        return matches
+
+
+# {store: (store.data_version() the index was built from, index)}
+_indexes: "weakref.WeakKeyDictionary[Any, Tuple[Any, MedicationSearchIndex]]" = weakref.WeakKeyDictionary()
+_indexes_lock = threading.Lock()
+
+
+def medication_index(store: Any) -> MedicationSearchIndex:
+    """
+    The search index of a store, built from store.medication_terms() on first use and kept
+    with the store until its data_version() changes (e.g. a commit to a SQLite database).
+    """
+    version = store.data_version()
+    with _indexes_lock:
+        cached = _indexes.get(store)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        index = MedicationSearchIndex(store.medication_terms())
+        _indexes[store] = (version, index)
+        return index
+
+
+def adopt_index(previous: Any, store: Any, rebuild: bool) -> None:
+    """
+    Carry the search index over to a new snapshot of `previous`: shared as is when the
+    inventory did not change, otherwise built for `store` now (off the request path) if
+    `previous` had one, so the first search after a reload does not pay for the build.
+    Call it once `store` has its final data_version().
+    """
+    with _indexes_lock:
+        cached = _indexes.get(previous)
+        if cached is not None and not rebuild:
+            _indexes[store] = (store.data_version(), cached[1])
+    if cached is not None and rebuild:
+        medication_index(store)
@@ -0,0 +1,365 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+from async_ephraim import AsyncEphraim, create_client
+from cache import ResponseCache
+from channels import SPEAKER_PREFIX, plain
+from consts import DATABASE_FILE_NAME, SQLITE_DATABASE_FILE_NAME
+from executor import PlanExecutor
+from http_utils import Request, RequestTooLarge, end_chunked, read_request, send_json, send_text, start_event_stream, write_chunk
+from identity import FailureLimiter
+from snapshots import open_followed_store
+from storage import STORAGE_BACKENDS, BaseStore
+from tracing import TRACER
+
+DEFAULT_PORT = 8080
+DEFAULT_MAX_BODY_BYTES = 64 * 1024
+
+
+class SessionChannel:
+    """
+    Name:
+        SessionChannel
+
+    Purpose:
+        Async conversation channel for one server session. Output is turned into
+        (event, data) pairs on a bounded queue that the HTTP handler streams to the
+        client; when the client reads slowly the queue fills and the pipeline waits.
+
+    Inputs:
+        max_buffered_events (int): Queue bound (per-session backpressure).
+        prompt_timeout (float): Seconds to wait for an answer to an identity prompt.
+
+    Output Schema:
+        events (asyncio.Queue[(str, dict)]): "explanation", "delta", "text", "prompt",
+        "done" and "error" events.
+
+    Error Handling:
+        This class never raises exceptions.
+
+    Fallback Behavior:
+        An unanswered prompt resolves to an empty answer after prompt_timeout.
+    """
+
+    def __init__(self, max_buffered_events: int, prompt_timeout: float) -> None:
+        self.events: asyncio.Queue = asyncio.Queue(maxsize=max_buffered_events)
+        self.prompt_timeout = prompt_timeout
+        self._answers: asyncio.Queue = asyncio.Queue()
+
+    async def write(self, text: str, end: str = "\n", markup: bool = True, kind: str = "text") -> None:
+        if markup and text == SPEAKER_PREFIX:
+            return
+        text = (plain(text) if markup else text) + end
+        if text:
+            await self.events.put((kind, {"text": text}))
+
+    async def ask(self, question: str) -> str:
+        await self.events.put(("prompt", {"question": plain(question)}))
+        try:
+            return (await asyncio.wait_for(self._answers.get(), timeout=self.prompt_timeout)).strip()
+        except asyncio.TimeoutError:
+            return ""
+
+    def answer(self, text: str) -> None:
+        self._answers.put_nowait(text)
+
+    def drain(self) -> None:
+        """Drop events left over from an interrupted message."""
+        while not self.events.empty():
+            self.events.get_nowait()
+
+
+class Session:
+    """One client conversation: its own agent (and toolbox state), channel and lock."""
+
+    def __init__(self, session_id: str, agent: AsyncEphraim, channel: SessionChannel) -> None:
+        self.id = session_id
+        self.agent = agent
+        self.channel = channel
+        self.lock = asyncio.Lock()
+        self.last_active = time.monotonic()
+
+
+class EphraimServer:
+    """
+    Name:
+        EphraimServer
+
+    Purpose:
+        Multi-session HTTP server for Ephraim. Each session owns an AsyncEphraim with its
+        own toolbox state and a one-thread slot for identity prompts; all sessions share one
+        store, OpenAI client and PlanExecutor, so a session waiting for its user's name or
+        date of birth never holds a shared tool thread. A message whose stream is dropped
+        is cancelled and its pending prompt released.
+        Replies are streamed to the client as Server-Sent Events while they are produced.
+
+        POST   /sessions                  -> 201 {"session_id"}
+        POST   /sessions/<id>/messages    {"message"} -> text/event-stream
+        POST   /sessions/<id>/input       {"text"} answers a "prompt" event
+        POST   /sessions/<id>/logout      -> 200 {"logged_out"} forgets the verified identity and the conversation
+        DELETE /sessions/<id>             -> 204
+        GET    /health                    -> 200 {"sessions", "active"}
+        GET    /metrics                   -> Prometheus text metrics (tracing enabled)
+        GET    /traces                    -> recent spans as OTLP/JSON (tracing enabled)
+
+    Inputs:
+        store, client, executor: Shared resources.
+        max_sessions (int): Open sessions allowed at once.
+        max_concurrent (int): Messages processed at once across all sessions.
+        queue_timeout (float): Seconds a message waits for a free slot before a 503.
+        keepalive (float): Seconds of stream inactivity before an SSE keep-alive comment.
+        session_ttl (float): Idle seconds before a session is closed.
+        max_buffered_events (int): Per-session event buffer (backpressure bound).
+        prompt_timeout (float): Seconds to wait for an identity prompt answer.
+        max_body_bytes (int): Largest request body accepted.
+
+    Output Schema:
+        JSON bodies, or SSE frames "event: <kind>\\ndata: <json>\\n\\n".
+
+    Error Handling:
+        404 unknown session/path, 400 invalid body, 409 session busy, 413 body over
+        max_body_bytes (the connection is then closed), 503 session or concurrency limit reached. Pipeline failures become an "error" event.
+
+    Fallback Behavior:
+        Connections are kept alive between requests unless the client asks to close.
+    """
+
+    def __init__(self, store: BaseStore, client, executor: PlanExecutor, host: str = "127.0.0.1",
+                 port: int = DEFAULT_PORT, max_sessions: int = 1000, max_concurrent: int = 100,
+                 queue_timeout: float = 5.0, keepalive: float = 15.0, session_ttl: float = 1800.0,
+                 max_buffered_events: int = 256, prompt_timeout: float = 120.0,
+                 max_body_bytes: int = DEFAULT_MAX_BODY_BYTES, logger: Optional[logging.Logger] = None) -> None:
+        self.store = store
+        self.client = client
+        self.executor = executor
+        self.host = host
+        self.port = port
+        self.max_sessions = max_sessions
+        self.queue_timeout = queue_timeout
+        self.keepalive = keepalive
+        self.session_ttl = session_ttl
+        self.max_buffered_events = max_buffered_events
+        self.prompt_timeout = prompt_timeout
+        self.max_body_bytes = max_body_bytes
+        self.logger = logger or logging.getLogger(__name__)
+        self.sessions: Dict[str, Session] = {}
+        self.response_cache = ResponseCache()
+        # Failed DOB checks are counted across sessions, so opening a new session does not reset them
+        self.failures = FailureLimiter()
+        self.active = 0
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def serve_forever(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        sweeper = asyncio.create_task(self._expire_sessions())
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            sweeper.cancel()
+
+    async def _expire_sessions(self) -> None:
+        while True:
+            await asyncio.sleep(min(self.session_ttl, 60.0))
+            cutoff = time.monotonic() - self.session_ttl
+            for session_id, session in list(self.sessions.items()):
+                if session.last_active < cutoff and not session.lock.locked():
+                    del self.sessions[session_id]
+                    session.agent.close()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request = await read_request(reader, self.max_body_bytes)
+                if request is None:
+                    break
+                await self._route(request, writer)
+                if not request.keep_alive:
+                    break
+        except RequestTooLarge as e:
+            # The body is left unread, so the connection cannot be reused
+            await send_json(writer, 413, {"error": str(e)})
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, request: Request, writer: asyncio.StreamWriter) -> None:
+        parts = [part for part in request.path.split("?", 1)[0].split("/") if part]
+
+        if request.method == "GET" and parts == ["health"]:
+            await send_json(writer, 200, {"sessions": len(self.sessions), "active": self.active})
+        elif request.method == "GET" and parts == ["metrics"]:
+            await send_text(writer, 200, TRACER.metrics.render(), content_type="text/plain; version=0.0.4")
+        elif request.method == "GET" and parts == ["traces"]:
+            await send_json(writer, 200, TRACER.export_otlp())
+        elif request.method == "POST" and parts == ["sessions"]:
+            await self._create_session(writer)
+        elif len(parts) >= 2 and parts[0] == "sessions":
+            session = self.sessions.get(parts[1])
+            if session is None:
+                await send_json(writer, 404, {"error": "Unknown session"})
+            elif request.method == "DELETE" and len(parts) == 2:
+                self.sessions.pop(session.id, None)
+                session.agent.close()
+                await send_json(writer, 204)
+            elif request.method == "POST" and parts[2:] == ["messages"]:
+                await self._handle_message(request, writer, session)
+            elif request.method == "POST" and parts[2:] == ["input"]:
+                await self._handle_input(request, writer, session)
+            elif request.method == "POST" and parts[2:] == ["logout"]:
+                session.last_active = time.monotonic()
+                await send_json(writer, 200, {"logged_out": session.agent.forget_identity()})
+            else:
+                await send_json(writer, 404, {"error": "Not found"})
+        else:
+            await send_json(writer, 404, {"error": "Not found"})
+
+    async def _create_session(self, writer: asyncio.StreamWriter) -> None:
+        if len(self.sessions) >= self.max_sessions:
+            await send_json(writer, 503, {"error": "Session limit reached"})
+            return
+        session_id = uuid.uuid4().hex
+        channel = SessionChannel(self.max_buffered_events, self.prompt_timeout)
+        agent = AsyncEphraim(self.store, self.client, channel, self.executor, logger=self.logger,
+                             response_cache=self.response_cache, failures=self.failures)
+        self.sessions[session_id] = Session(session_id, agent, channel)
+        await send_json(writer, 201, {"session_id": session_id})
+
+    async def _handle_input(self, request: Request, writer: asyncio.StreamWriter, session: Session) -> None:
+        text, problem = self._body_field(request, "text")
+        if problem:
+            await send_json(writer, 400, {"error": problem})
+            return
+        session.last_active = time.monotonic()
+        session.channel.answer(text)
+        await send_json(writer, 202, {"accepted": True})
+
+    async def _handle_message(self, request: Request, writer: asyncio.StreamWriter, session: Session) -> None:
+        message, problem = self._body_field(request, "message")
+        if problem:
+            await send_json(writer, 400, {"error": problem})
+            return
+        if session.lock.locked():
+            await send_json(writer, 409, {"error": "Session is already handling a message"})
+            return
+        # An unlocked asyncio.Lock is taken without yielding, so nothing runs between the check
+        # and the acquisition: a second message on the session gets the 409, even while this one
+        # waits for a slot
+        await session.lock.acquire()
+        try:
+            try:
+                await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                await send_json(writer, 503, {"error": "Server is at its concurrency limit"})
+                return
+            await self._process_message(writer, session, message)
+        finally:
+            session.lock.release()
+
+    async def _process_message(self, writer: asyncio.StreamWriter, session: Session, message: str) -> None:
+        """Run the pipeline for a message and stream its events; the caller holds the session lock and a slot."""
+        self.active += 1
+        session.last_active = time.monotonic()
+        pipeline = asyncio.create_task(self._run_pipeline(session, message))
+        try:
+            await self._stream_events(writer, session)
+        finally:
+            if not pipeline.done():
+                # Unblock a tool thread waiting for a prompt answer before dropping the pipeline
+                session.agent.interrupt()
+                pipeline.cancel()
+            session.channel.drain()
+            session.last_active = time.monotonic()
+            self.active -= 1
+            self._slots.release()
+
+    async def _run_pipeline(self, session: Session, message: str) -> None:
+        try:
+            await session.agent.handle_user_message(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.exception("Session %s failed", session.id)
+            await session.channel.events.put(("error", {"message": str(e)}))
+        else:
+            await session.channel.events.put(("done", {}))
+
+    async def _stream_events(self, writer: asyncio.StreamWriter, session: Session) -> None:
+        start_event_stream(writer)
+        while True:
+            try:
+                kind, data = await asyncio.wait_for(session.channel.events.get(), timeout=self.keepalive)
+            except asyncio.TimeoutError:
+                await write_chunk(writer, b": keep-alive\n\n")
+                continue
+            await write_chunk(writer, f"event: {kind}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode())
+            if kind in ("done", "error"):
+                break
+        await end_chunked(writer)
+
+    @staticmethod
+    def _body_field(request: Request, field: str) -> Tuple[Any, Optional[str]]:
+        try:
+            value = request.json().get(field)
+        except (ValueError, AttributeError):
+            return None, "Body must be a JSON object"
+        if not isinstance(value, str):
+            return None, f"Body must contain a string '{field}'"
+        return value, None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve Ephraim sessions over HTTP with streamed replies")
+    parser.add_argument("--debug", action="store_true", help="Enable debug logging")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--storage", choices=STORAGE_BACKENDS, default="json", help="Storage backend to query")
+    parser.add_argument("--database", default=None, help="Database file for the selected storage backend")
+    parser.add_argument("--base-url", default=None, help="OpenAI-compatible endpoint, e.g. a local mock_llm.py server")
+    parser.add_argument("--max-sessions", type=int, default=1000)
+    parser.add_argument("--max-concurrent", type=int, default=100, help="Messages processed at once")
+    parser.add_argument("--max-workers", type=int, default=32, help="Concurrent tool calls across sessions")
+    parser.add_argument("--keepalive", type=float, default=15.0, help="Seconds between SSE keep-alive comments")
+    parser.add_argument("--max-body-bytes", type=int, default=DEFAULT_MAX_BODY_BYTES,
+                        help="Largest request body accepted (larger requests get a 413)")
+    parser.add_argument("--watch", type=float, default=0, metavar="SECONDS",
+                        help="Reload the database in the background when it changes, checking every SECONDS")
+    parser.add_argument("--trace", action="store_true", help="Record spans and metrics for /metrics and /traces")
+    cmd_args = parser.parse_args()
+    if cmd_args.trace:
+        TRACER.enabled = True
+
+    logging.basicConfig(
+        level=logging.DEBUG if cmd_args.debug else logging.WARNING,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        datefmt="%H:%M:%S"
+    )
+    database_path = cmd_args.database or (
+        SQLITE_DATABASE_FILE_NAME if cmd_args.storage == "sqlite" else DATABASE_FILE_NAME)
+
+    async def main() -> None:
+        server = EphraimServer(
+            store=open_followed_store(cmd_args.storage, database_path, cmd_args.watch),
+            client=create_client(cmd_args.base_url),
+            executor=PlanExecutor(max_workers=cmd_args.max_workers),
+            host=cmd_args.host,
+            port=cmd_args.port,
+            max_sessions=cmd_args.max_sessions,
+            max_concurrent=cmd_args.max_concurrent,
+            keepalive=cmd_args.keepalive,
+            max_body_bytes=cmd_args.max_body_bytes,
+        )
+        print(f"Ephraim server listening on http://{cmd_args.host}:{cmd_args.port}")
+        await server.serve_forever()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,269 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from records import LogView, Medication, User
+from search import adopt_index
+from storage import BaseStore, InMemoryStore, LazyJsonStore, open_store
+
+DEFAULT_POLL_INTERVAL = 2.0
+_WHITESPACE = " \t\r\n"
+
+
+def read_sections(path: str) -> Dict[str, Tuple[str, Any]]:
+    """
+    Parse a database.json file into {section: (digest, value)}. Each digest is the SHA-256
+    of the section's source text, so unchanged sections are recognized without comparing
+    (or re-indexing) their records.
+    """
+    with open(path, "r") as f:
+        text = f.read()
+    decoder = json.JSONDecoder()
+    sections: Dict[str, Tuple[str, Any]] = {}
+
+    def skip(position: int) -> int:
+        while position < len(text) and text[position] in _WHITESPACE:
+            position += 1
+        return position
+
+    position = skip(0)
+    if text[position:position + 1] != "{":
+        raise ValueError(f"{path}: expected a JSON object")
+    position = skip(position + 1)
+    while text[position:position + 1] != "}":
+        name, position = decoder.raw_decode(text, position)
+        position = skip(position)
+        if text[position:position + 1] != ":":
+            raise ValueError(f"{path}: expected ':' at offset {position}")
+        start = skip(position + 1)
+        value, position = decoder.raw_decode(text, start)
+        sections[name] = (hashlib.sha256(text[start:position].encode()).hexdigest(), value)
+        position = skip(position)
+        if text[position:position + 1] == ",":
+            position = skip(position + 1)
+        elif text[position:position + 1] != "}":
+            raise ValueError(f"{path}: expected ',' or '}}' at offset {position}")
+    return sections
+
+
+class SnapshotCopyStore(LazyJsonStore):
+    """
+    LazyJsonStore over a private copy of a database file. A snapshot maps its copy, so the
+    original can be rewritten in place (not only replaced by an atomic rename) without
+    changing the bytes under a live mapping. The copy is deleted when the store is closed.
+    """
+
+    def __init__(self, path: str) -> None:
+        fd, copy = tempfile.mkstemp(prefix="ephraim-snapshot-", suffix=".json")
+        os.close(fd)
+        try:
+            shutil.copyfile(path, copy)
+            super().__init__(copy)
+        except BaseException:
+            os.remove(copy)
+            raise
+        self.source_path = path
+
+    def close(self) -> None:
+        super().close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def _file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class SnapshotManager(BaseStore):
+    """
+    Name:
+        SnapshotManager
+
+    Purpose:
+        Store that follows a database file without restarting the agent. A background
+        thread polls the file's mtime/size; when it changes, a new indexed snapshot is
+        built off the request path and swapped in atomically. Snapshots are never modified
+        after they are published (copy-on-write): snapshot() pins the current one for a
+        turn, and a run keeps that consistent view even if a newer snapshot is swapped in
+        meanwhile; a replaced snapshot is closed once the last turn pinning it calls
+        release(). Each swap increments data_version(), which invalidates cached responses.
+
+        For the "json" backend, a reload is incremental: only the sections whose source
+        text changed (typically pharmacy_inventory) are re-indexed, and the other indexes
+        are shared with the previous snapshot. "lazy" snapshots are re-scanned in full,
+        each from a private copy of the file (SnapshotCopyStore), so a writer rewriting the
+        file in place cannot corrupt a mapping that a turn is still reading.
+
+    Inputs:
+        backend (str): "json" or "lazy" (see storage.open_store).
+        path (str): Database file to follow.
+        poll_interval (float): Seconds between checks of the file.
+        logger (logging.Logger | None): Receives reload results and failures.
+
+    Output Schema:
+        Same as BaseStore; lookups go to the current snapshot.
+
+    Error Handling:
+        The initial load propagates I/O and JSON errors. A failed reload, whatever the
+        error (e.g. a file caught half-written), is logged and retried at the next change;
+        the current snapshot stays in service.
+
+    Fallback Behavior:
+        Until start() is called, the first snapshot is served and the file is not followed.
+    """
+
+    def __init__(self, backend: str, path: str, poll_interval: float = DEFAULT_POLL_INTERVAL,
+                 logger: Optional[logging.Logger] = None) -> None:
+        if backend not in ("json", "lazy"):
+            raise ValueError(f"Snapshots follow database.json files; the '{backend}' backend is not supported")
+        self.backend = backend
+        self.path = path
+        self.poll_interval = poll_interval
+        self.logger = logger or logging.getLogger(__name__)
+        self._signature = _file_signature(path)
+        self._digests: Dict[str, str] = {}
+        self._current: BaseStore
+        self._current, _, self._digests = self._build(None)
+        # {id(snapshot): number of turns holding it}
+        self._pins: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self.reloads: int = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _build(self, previous: Optional[BaseStore]) -> Tuple[BaseStore, bool, Dict[str, str]]:
+        """
+        Build the next snapshot from the file, reusing unchanged sections of `previous`.
+        Returns the snapshot, whether its inventory may differ from the previous one, and
+        the section digests to compare the next reload against.
+        """
+        if self.backend == "lazy":
+            return SnapshotCopyStore(self.path), True, {}
+        sections = read_sections(self.path)
+        digests = {name: digest for name, (digest, _) in sections.items()}
+        changed = {name: value for name, (digest, value) in sections.items() if self._digests.get(name) != digest}
+        # Sections removed from the file become empty
+        changed.update({name: [] for name in self._digests if name not in sections})
+        if isinstance(previous, InMemoryStore):
+            store = previous.updated(changed)
+        else:
+            store = InMemoryStore({name: value for name, (_, value) in sections.items()})
+        self.logger.info(f"Snapshot of {self.path}: re-indexed {sorted(changed) or 'nothing'}")
+        return store, "pharmacy_inventory" in changed, digests
+
+    def start(self) -> "SnapshotManager":
+        """Start following the file on a daemon thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._follow, name="snapshot-reload", daemon=True)
+            self._thread.start()
+        return self
+
+    def _follow(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            self.check()
+
+    def check(self) -> bool:
+        """Reload if the file changed since the last snapshot; return whether a new snapshot was swapped in."""
+        signature = _file_signature(self.path)
+        if signature is None or signature == self._signature:
+            return False
+        previous = self._current
+        store: Optional[BaseStore] = None
+        try:
+            store, inventory_changed, digests = self._build(previous)
+            store.version = previous.version + 1
+            adopt_index(previous, store, rebuild=inventory_changed)
+        except Exception:
+            self.logger.exception(f"Reloading {self.path} failed, keeping the current snapshot")
+            if store is not None:
+                store.close()
+            self._signature = signature
+            return False
+        self._digests = digests
+        # Publishing is a single reference assignment; turns holding the previous snapshot keep it
+        with self._lock:
+            self._current = store
+            idle = id(previous) not in self._pins
+        if idle:
+            previous.close()
+        self._signature = signature
+        self.reloads += 1
+        return True
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def snapshot(self) -> BaseStore:
+        with self._lock:
+            store = self._current
+            self._pins[id(store)] = self._pins.get(id(store), 0) + 1
+        return store
+
+    def release(self, snapshot: BaseStore) -> None:
+        with self._lock:
+            pins = self._pins.get(id(snapshot))
+            if pins is None:
+                return
+            if pins > 1:
+                self._pins[id(snapshot)] = pins - 1
+                return
+            del self._pins[id(snapshot)]
+            retired = snapshot is not self._current
+        if retired:
+            snapshot.close()
+
+    def data_version(self) -> int:
+        return self._current.data_version()
+
+    def get_user(self, name: Any) -> Optional[User]:
+        return self._current.get_user(name)
+
+    def get_users(self, name: Any) -> List[User]:
+        return self._current.get_users(name)
+
+    def get_medication(self, name: Any) -> Optional[Medication]:
+        return self._current.get_medication(name)
+
+    def get_medications(self, names: Sequence[Any]) -> List[Optional[Medication]]:
+        return self._current.get_medications(names)
+
+    def available_medication_names(self) -> List[str]:
+        return self._current.available_medication_names()
+
+    def medication_names_by_availability(self, availability: str) -> List[str]:
+        return self._current.medication_names_by_availability(availability)
+
+    def get_prescription_logs(self, user_name: Any) -> LogView:
+        return self._current.get_prescription_logs(user_name)
+
+    def medication_terms(self) -> Iterator[Tuple[str, Optional[str], Any]]:
+        return self._current.medication_terms()
+
+    def close(self) -> None:
+        self.stop()
+        self._current.close()
+
+
+def open_followed_store(backend: str, path: str, poll_interval: float = 0,
+                        logger: Optional[logging.Logger] = None) -> BaseStore:
+    """
+    open_store(), or with a poll interval a started SnapshotManager. SQLite needs no
+    snapshots: each query sees the last committed data and data_version tracks commits.
+    """
+    if not poll_interval or backend == "sqlite":
+        return open_store(backend, path)
+    return SnapshotManager(backend, path, poll_interval, logger).start()
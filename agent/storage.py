@@ -0,0 +1,704 @@
+import argparse
+import codecs
+import json
+import mmap
+import os
+import queue
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from records import LogTable, LogView, Medication, User
+
+OUT_OF_STOCK = "Out of stock"
+STORAGE_BACKENDS = ("json", "sqlite", "lazy")
+
+
+def _key(name: Any) -> str:
+    """Normalize a lookup name into its case-folded index key."""
+    return str(name).strip().casefold()
+
+
+class BaseStore(ABC):
+    """
+    Name:
+        BaseStore
+
+    Purpose:
+        Storage interface queried by PharmacyTools. Backends only need to answer
+        the lookups below; they decide how data is held and indexed.
+
+    Inputs:
+        Backend-specific.
+
+    Output Schema:
+        Users and medications are returned as User and Medication records, prescription
+        logs as a LogView of LogEntry tuples (see records.py).
+
+    Error Handling:
+        Lookups never raise for unknown keys; they return None or empty lists.
+
+    Fallback Behavior:
+        Missing sections are treated as empty.
+    """
+
+    # Snapshot generation (see snapshots.SnapshotManager); reported by data_version()
+    version: int = 0
+
+    @abstractmethod
+    def get_user(self, name: Any) -> Optional[User]:
+        """Return the user record with the given name (case-insensitive), or None."""
+
+    def get_users(self, name: Any) -> List[User]:
+        """Return every user record sharing the given name (case-insensitive), in database order."""
+        user = self.get_user(name)
+        return [user] if user is not None else []
+
+    @abstractmethod
+    def get_medication(self, name: Any) -> Optional[Medication]:
+        """Return the first inventory record with the given name (case-insensitive), or None."""
+
+    def get_medications(self, names: Sequence[Any]) -> List[Optional[Medication]]:
+        """Return get_medication(name) for each name, in order, in a single lookup where the backend allows."""
+        return [self.get_medication(name) for name in names]
+
+    @abstractmethod
+    def available_medication_names(self) -> List[str]:
+        """Return names of all medications that are not out of stock, in inventory order."""
+
+    @abstractmethod
+    def medication_names_by_availability(self, availability: str) -> List[str]:
+        """Return names of all medications with exactly the given availability value."""
+
+    @abstractmethod
+    def get_prescription_logs(self, user_name: Any) -> LogView:
+        """Return the fill logs recorded for a user (case-insensitive), in log order."""
+
+    @abstractmethod
+    def medication_terms(self) -> Iterator[Tuple[str, Optional[str], Sequence[str]]]:
+        """Yield (name, generic name, active ingredients) of every inventory record, in inventory order."""
+
+    def data_version(self) -> int:
+        """Counter that changes whenever the underlying data changes (used for cache invalidation)."""
+        return self.version
+
+    def snapshot(self) -> "BaseStore":
+        """
+        A view that stays consistent for one turn; a store that never changes under a run is its
+        own snapshot. Every snapshot taken must be handed back with release().
+        """
+        return self
+
+    def release(self, snapshot: "BaseStore") -> None:
+        """Return a snapshot taken with snapshot() once the turn using it is over."""
+
+    def close(self) -> None:
+        """Release any resources held by the backend."""
+
+
+class InMemoryStore(BaseStore):
+    """
+    Name:
+        InMemoryStore
+
+    Purpose:
+        Indexed, read-only view over the pharmacy database used by PharmacyTools.
+        All indexes are built once at construction so every tool lookup is O(1)
+        or O(k) in the size of its result instead of O(N) in the database size.
+        Records are converted to compact User/Medication records and a columnar
+        LogTable, so the parsed dicts can be freed once the store is built.
+
+    Inputs:
+        data (dict): Parsed database with "users", "pharmacy_inventory"
+            and "prescription_logs" lists.
+
+    Output Schema:
+        Lookup-specific outputs (records are shared, not copied; treat them as read-only).
+
+    Error Handling:
+        Lookups never raise for unknown keys; they return None or empty lists.
+
+    Fallback Behavior:
+        Missing sections are treated as empty.
+    """
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self._index_users(data.get("users", []))
+        self._index_inventory(data.get("pharmacy_inventory", []))
+        self._index_logs(data.get("prescription_logs", []))
+
+    def updated(self, sections: Dict[str, List[Dict[str, Any]]]) -> "InMemoryStore":
+        """
+        A new store with `sections` (e.g. {"pharmacy_inventory": [...]}) re-indexed; the indexes of
+        every other section are shared with this store, which is left unchanged (copy-on-write).
+        """
+        store = object.__new__(InMemoryStore)
+        store.__dict__.update(self.__dict__)
+        indexers = {"users": store._index_users, "pharmacy_inventory": store._index_inventory,
+                    "prescription_logs": store._index_logs}
+        for section, records in sections.items():
+            if section in indexers:
+                indexers[section](records)
+        return store
+
+    def _index_users(self, records: List[Dict[str, Any]]) -> None:
+        # Later records win on name collisions, matching the previous dict rebuild;
+        # only names shared by several users also keep the full list of namesakes
+        self._users_by_name: Dict[str, User] = {}
+        self._namesakes: Dict[str, List[User]] = {}
+        for record in records:
+            user = User.from_dict(record)
+            key = _key(user.name)
+            previous = self._users_by_name.get(key)
+            if previous is not None:
+                self._namesakes.setdefault(key, [previous]).append(user)
+            self._users_by_name[key] = user
+
+    def _index_inventory(self, records: List[Dict[str, Any]]) -> None:
+        self._medications: List[Medication] = []
+        self._medications_by_name: Dict[str, Medication] = {}
+        self._medications_by_availability: Dict[str, List[str]] = {}
+        self._available_names: List[str] = []
+        for record in records:
+            med = Medication.from_dict(record)
+            self._medications.append(med)
+            self._medications_by_name.setdefault(_key(med.name), med)
+            self._medications_by_availability.setdefault(med.availability, []).append(med.name)
+            if med.availability != OUT_OF_STOCK:
+                self._available_names.append(med.name)
+
+    def _index_logs(self, records: List[Dict[str, Any]]) -> None:
+        # Log positions per user, as 4-byte arrays into one shared LogTable
+        self._logs = LogTable()
+        self._logs_by_user: Dict[str, array] = {}
+        for log in records:
+            key = _key(log["user_name"])
+            positions = self._logs_by_user.get(key)
+            if positions is None:
+                positions = self._logs_by_user[key] = array("I")
+            positions.append(self._logs.append(log))
+
+    def get_user(self, name: Any) -> Optional[User]:
+        """Return the user record with the given name (case-insensitive), or None."""
+        return self._users_by_name.get(_key(name))
+
+    def get_users(self, name: Any) -> List[User]:
+        key = _key(name)
+        namesakes = self._namesakes.get(key)
+        if namesakes is not None:
+            return list(namesakes)
+        user = self._users_by_name.get(key)
+        return [user] if user is not None else []
+
+    def get_medication(self, name: Any) -> Optional[Medication]:
+        """Return the first inventory record with the given name (case-insensitive), or None."""
+        return self._medications_by_name.get(_key(name))
+
+    def available_medication_names(self) -> List[str]:
+        """Return names of all medications that are not out of stock, in inventory order."""
+        return list(self._available_names)
+
+    def medication_names_by_availability(self, availability: str) -> List[str]:
+        """Return names of all medications with exactly the given availability value."""
+        return list(self._medications_by_availability.get(availability, []))
+
+    def get_prescription_logs(self, user_name: Any) -> LogView:
+        """Return the fill logs recorded for a user (case-insensitive), in log order."""
+        return self._logs.view(self._logs_by_user.get(_key(user_name), ()))
+
+    def medication_terms(self) -> Iterator[Tuple[str, Optional[str], Sequence[str]]]:
+        for med in self._medications:
+            yield med.name, med.generic_name, med.active_ingredients or ()
+
+
+_WHITESPACE = re.compile(r"[ \t\r\n]*")
+
+
+class _JsonScanner:
+    """
+    Forward-only reader over a UTF-8 JSON document that decodes one value at a time
+    and tracks the byte offset of the read position, so values can be re-read later
+    from their byte span. Only a chunk-sized window of the document is held in memory.
+    """
+
+    CHUNK_SIZE = 1 << 22
+
+    def __init__(self, read: Callable[[int, int], bytes], size: int) -> None:
+        self._read = read
+        self._size = size
+        self._next_byte = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._text = ""
+        self._ascii = True
+        self._i = 0
+        self.offset = 0  # byte offset of self._text[self._i] in the document
+
+    def _fill(self) -> bool:
+        """Append the next chunk to the window, dropping what was already consumed."""
+        if self._next_byte >= self._size:
+            return False
+        chunk = self._read(self._next_byte, self.CHUNK_SIZE)
+        self._next_byte += len(chunk)
+        self._text = self._text[self._i:] + self._decoder.decode(chunk, self._next_byte >= self._size)
+        self._i = 0
+        self._ascii = self._text.isascii()
+        return True
+
+    def _advance(self, end: int) -> None:
+        consumed = end - self._i if self._ascii else len(self._text[self._i:end].encode("utf-8"))
+        self.offset += consumed
+        self._i = end
+
+    def peek(self) -> str:
+        """Skip whitespace and return the next character ("" at the end of the document)."""
+        while True:
+            self._advance(_WHITESPACE.match(self._text, self._i).end())
+            if self._i < len(self._text):
+                return self._text[self._i]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected '{char}' at byte {self.offset} of the database, found '{found}'")
+        self._advance(self._i + 1)
+
+    def value(self) -> Any:
+        """Decode the next JSON value, reading further chunks until it is complete."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._text, self._i)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A number ending exactly at the window edge may continue in the next chunk
+            if end == len(self._text) and self._fill():
+                continue
+            self._advance(end)
+            return value
+
+    def array(self) -> Iterator[Tuple[int, int, Any]]:
+        """Yield (byte offset, byte length, value) for each element of the next array."""
+        self.expect("[")
+        if self.peek() == "]":
+            self._advance(self._i + 1)
+            return
+        while True:
+            start = self.offset
+            value = self.value()
+            yield start, self.offset - start, value
+            if self.peek() == ",":
+                self._advance(self._i + 1)
+                continue
+            self.expect("]")
+            return
+
+
+class _HashIndex:
+    """
+    Compact multimap from key to record positions: two parallel arrays of 8-byte
+    integers sorted by the key's hash, so equal keys are contiguous and in record
+    order. Callers verify the decoded record, since different keys may share a hash.
+    """
+
+    __slots__ = ("_hashes", "_positions")
+
+    def __init__(self, hashes: array) -> None:
+        order = sorted(range(len(hashes)), key=hashes.__getitem__)
+        self._positions = array("q", order)
+        self._hashes = array("q", (hashes[position] for position in order))
+
+    def positions(self, key: str) -> List[int]:
+        digest = hash(key)
+        i = bisect_left(self._hashes, digest)
+        found: List[int] = []
+        while i < len(self._hashes) and self._hashes[i] == digest:
+            found.append(self._positions[i])
+            i += 1
+        return found
+
+
+class LazyJsonStore(BaseStore):
+    """
+    Name:
+        LazyJsonStore
+
+    Purpose:
+        Backend for large database.json files that never parses the whole document at
+        once. A single streaming pass records the byte span of every record plus compact
+        hash indexes (a few arrays of 8-byte integers per section) for user names,
+        medication names and log owners; records are decoded from their span only when
+        a lookup needs them. A user's prescription logs are decoded on first access and
+        kept in a bounded LRU cache. By default the file is memory-mapped, so several
+        worker processes serving the same file share its pages through the OS page cache.
+
+    Inputs:
+        path (str): File in the database.json schema.
+        use_mmap (bool): Memory-map the file; otherwise records are read with seek/read.
+        log_cache_size (int): Number of users whose decoded logs are kept.
+
+    Output Schema:
+        Same as BaseStore.
+
+    Error Handling:
+        Propagates I/O errors, and JSON errors for malformed documents, at construction.
+
+    Fallback Behavior:
+        Missing sections are treated as empty; unknown top-level keys are skipped.
+    """
+
+    def __init__(self, path: str, use_mmap: bool = True, log_cache_size: int = 1024) -> None:
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._mmap: Optional[mmap.mmap] = None
+        if use_mmap and size:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._read_lock = threading.Lock()
+
+        # Byte spans of every record, in document order, per section
+        self._spans: Dict[str, Tuple[array, array]] = {}
+        self._medications_by_availability: Dict[str, List[str]] = {}
+        self._available_names: List[str] = []
+        hashes: Dict[str, array] = {}
+        scanner = _JsonScanner(self._read, size)
+        scanner.expect("{")
+        while scanner.peek() != "}":
+            section = scanner.value()
+            scanner.expect(":")
+            if section not in _INDEXED_FIELDS or scanner.peek() != "[":
+                scanner.value()
+            else:
+                offsets, lengths, digests = array("q"), array("q"), array("q")
+                field = _INDEXED_FIELDS[section]
+                for offset, length, record in scanner.array():
+                    offsets.append(offset)
+                    lengths.append(length)
+                    digests.append(hash(_key(record[field])))
+                    if section == "pharmacy_inventory":
+                        self._index_availability(record)
+                self._spans[section] = (offsets, lengths)
+                hashes[section] = digests
+            if scanner.peek() == ",":
+                scanner.expect(",")
+        scanner.expect("}")
+
+        self._indexes: Dict[str, _HashIndex] = {
+            section: _HashIndex(hashes.get(section, array("q"))) for section in _INDEXED_FIELDS
+        }
+        self._log_cache: "OrderedDict[str, LogView]" = OrderedDict()
+        self._log_cache_size = log_cache_size
+        self._log_cache_lock = threading.Lock()
+
+    def _index_availability(self, med: Dict[str, Any]) -> None:
+        availability = med.get("availability")
+        self._medications_by_availability.setdefault(availability, []).append(med["name"])
+        if availability != OUT_OF_STOCK:
+            self._available_names.append(med["name"])
+
+    def _read(self, offset: int, length: int) -> bytes:
+        if self._mmap is not None:
+            return self._mmap[offset:offset + length]
+        with self._read_lock:
+            self._file.seek(offset)
+            return self._file.read(length)
+
+    def _records(self, section: str, key: str) -> List[Dict[str, Any]]:
+        """Decode the records of `section` whose indexed field matches `key`, in document order."""
+        if section not in self._spans:
+            return []
+        offsets, lengths = self._spans[section]
+        field = _INDEXED_FIELDS[section]
+        records = (json.loads(self._read(offsets[position], lengths[position]))
+                   for position in self._indexes[section].positions(key))
+        return [record for record in records if _key(record[field]) == key]
+
+    def get_user(self, name: Any) -> Optional[User]:
+        """Return the user record with the given name (case-insensitive), or None."""
+        users = self._records("users", _key(name))
+        return User.from_dict(users[-1]) if users else None
+
+    def get_users(self, name: Any) -> List[User]:
+        return [User.from_dict(user) for user in self._records("users", _key(name))]
+
+    def get_medication(self, name: Any) -> Optional[Medication]:
+        """Return the first inventory record with the given name (case-insensitive), or None."""
+        medications = self._records("pharmacy_inventory", _key(name))
+        return Medication.from_dict(medications[0]) if medications else None
+
+    def available_medication_names(self) -> List[str]:
+        """Return names of all medications that are not out of stock, in inventory order."""
+        return list(self._available_names)
+
+    def medication_names_by_availability(self, availability: str) -> List[str]:
+        """Return names of all medications with exactly the given availability value."""
+        return list(self._medications_by_availability.get(availability, []))
+
+    def get_prescription_logs(self, user_name: Any) -> LogView:
+        """Return the fill logs recorded for a user (case-insensitive), in log order."""
+        key = _key(user_name)
+        with self._log_cache_lock:
+            logs = self._log_cache.get(key)
+            if logs is not None:
+                self._log_cache.move_to_end(key)
+                return logs
+        logs = LogTable.from_logs(self._records("prescription_logs", key))
+        with self._log_cache_lock:
+            self._log_cache[key] = logs
+            if len(self._log_cache) > self._log_cache_size:
+                self._log_cache.popitem(last=False)
+        return logs
+
+    def medication_terms(self) -> Iterator[Tuple[str, Optional[str], Sequence[str]]]:
+        offsets, lengths = self._spans.get("pharmacy_inventory", ((), ()))
+        for offset, length in zip(offsets, lengths):
+            med = json.loads(self._read(offset, length))
+            yield med["name"], med.get("generic_name"), med.get("active_ingredients") or ()
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+
+# Field each LazyJsonStore section is indexed by
+_INDEXED_FIELDS = {"users": "name", "pharmacy_inventory": "name", "prescription_logs": "user_name"}
+
+
+_SCHEMA = """
+CREATE TABLE users (
+    position INTEGER PRIMARY KEY,
+    name_key TEXT NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE INDEX users_name_key ON users (name_key);
+
+CREATE TABLE pharmacy_inventory (
+    position INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    availability TEXT,
+    record TEXT NOT NULL
+);
+CREATE INDEX pharmacy_inventory_name_key ON pharmacy_inventory (name_key);
+CREATE INDEX pharmacy_inventory_availability ON pharmacy_inventory (availability);
+
+CREATE TABLE prescription_logs (
+    position INTEGER PRIMARY KEY,
+    user_key TEXT NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE INDEX prescription_logs_user_key ON prescription_logs (user_key, position);
+"""
+
+# Fixed query texts so each pooled connection prepares them once and reuses
+# them from its statement cache.
+_SELECT_USER = "SELECT record FROM users WHERE name_key = ? ORDER BY position DESC LIMIT 1"
+_SELECT_USERS = "SELECT record FROM users WHERE name_key = ? ORDER BY position"
+_SELECT_MEDICATION = "SELECT record FROM pharmacy_inventory WHERE name_key = ? ORDER BY position LIMIT 1"
+# Names are passed as one JSON array, so a single prepared statement serves any batch size
+_SELECT_MEDICATIONS = ("SELECT name_key, record FROM pharmacy_inventory "
+                       "WHERE name_key IN (SELECT value FROM json_each(?)) ORDER BY position DESC")
+_SELECT_AVAILABLE = "SELECT name FROM pharmacy_inventory WHERE availability IS NOT ? ORDER BY position"
+_SELECT_BY_AVAILABILITY = "SELECT name FROM pharmacy_inventory WHERE availability = ? ORDER BY position"
+_SELECT_LOGS = "SELECT record FROM prescription_logs WHERE user_key = ? ORDER BY position"
+_SELECT_INVENTORY = "SELECT record FROM pharmacy_inventory ORDER BY position"
+
+
+class SqliteStore(BaseStore):
+    """
+    Name:
+        SqliteStore
+
+    Purpose:
+        Read-only SQLite backend. Rows are looked up through indexed key columns,
+        so memory use and startup time do not depend on the database size, and
+        several processes can open the same file concurrently.
+
+    Inputs:
+        path (str): SQLite file created by import_json_to_sqlite.
+        pool_size (int): Number of pooled read-only connections.
+
+    Output Schema:
+        Same as BaseStore.
+
+    Error Handling:
+        Raises FileNotFoundError at construction if the database file is missing.
+
+    Fallback Behavior:
+        Lookups for unknown keys return None or empty lists.
+    """
+
+    def __init__(self, path: str, pool_size: int = 4) -> None:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"SQLite database '{path}' not found. Import one with storage.py import.")
+        self.path = path
+        self._pool: queue.Queue = queue.Queue(maxsize=pool_size)
+        for _ in range(pool_size):
+            self._pool.put(self._connect())
+        # PRAGMA data_version is only comparable on one connection, so it gets its own
+        self._version_conn = self._connect()
+        self._version_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a read-only connection that may be shared across threads via the pool."""
+        conn = sqlite3.connect(
+            f"file:{self.path}?mode=ro",
+            uri=True,
+            check_same_thread=False,
+            cached_statements=32,
+        )
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a pooled connection for the duration of one query."""
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    def _fetch_one(self, sql: str, params: tuple) -> Optional[Dict[str, Any]]:
+        with self._connection() as conn:
+            row = conn.execute(sql, params).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _fetch_column(self, sql: str, params: tuple) -> List[Any]:
+        with self._connection() as conn:
+            return [row[0] for row in conn.execute(sql, params)]
+
+    def get_user(self, name: Any) -> Optional[User]:
+        user = self._fetch_one(_SELECT_USER, (_key(name),))
+        return User.from_dict(user) if user is not None else None
+
+    def get_users(self, name: Any) -> List[User]:
+        return [User.from_dict(json.loads(record)) for record in self._fetch_column(_SELECT_USERS, (_key(name),))]
+
+    def get_medication(self, name: Any) -> Optional[Medication]:
+        med = self._fetch_one(_SELECT_MEDICATION, (_key(name),))
+        return Medication.from_dict(med) if med is not None else None
+
+    def get_medications(self, names: Sequence[Any]) -> List[Optional[Medication]]:
+        keys = [_key(name) for name in names]
+        with self._connection() as conn:
+            # Descending position, so the first record of each name is the one left in the dict
+            records = dict(conn.execute(_SELECT_MEDICATIONS, (json.dumps(sorted(set(keys))),)).fetchall())
+        return [Medication.from_dict(json.loads(records[key])) if key in records else None for key in keys]
+
+    def available_medication_names(self) -> List[str]:
+        return self._fetch_column(_SELECT_AVAILABLE, (OUT_OF_STOCK,))
+
+    def medication_names_by_availability(self, availability: str) -> List[str]:
+        return self._fetch_column(_SELECT_BY_AVAILABILITY, (availability,))
+
+    def get_prescription_logs(self, user_name: Any) -> LogView:
+        return LogTable.from_logs(
+            json.loads(record) for record in self._fetch_column(_SELECT_LOGS, (_key(user_name),)))
+
+    def medication_terms(self) -> Iterator[Tuple[str, Optional[str], Sequence[str]]]:
+        for record in self._fetch_column(_SELECT_INVENTORY, ()):
+            med = json.loads(record)
+            yield med["name"], med.get("generic_name"), med.get("active_ingredients") or ()
+
+    def data_version(self) -> int:
+        with self._version_lock:
+            return self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def close(self) -> None:
+        self._version_conn.close()
+        while not self._pool.empty():
+            self._pool.get_nowait().close()
+
+
+def import_json_to_sqlite(json_path: str, sqlite_path: str) -> None:
+    """
+    Name:
+        import_json_to_sqlite
+
+    Purpose:
+        One-shot import of a database.json file into a new SQLite database for SqliteStore.
+
+    Inputs:
+        json_path (str): Source file in the database.json schema.
+        sqlite_path (str): Destination file. Replaced atomically once the import succeeds.
+
+    Output Schema:
+        None
+
+    Error Handling:
+        Propagates I/O and JSON errors; a failed import never leaves a partial destination file.
+
+    Fallback Behavior:
+        Missing sections are imported as empty tables.
+    """
+    with open(json_path, "r") as f:
+        data = json.load(f)
+
+    tmp_path = f"{sqlite_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(_SCHEMA)
+        conn.executemany(
+            "INSERT INTO users (name_key, record) VALUES (?, ?)",
+            ((_key(user["name"]), json.dumps(user)) for user in data.get("users", [])),
+        )
+        conn.executemany(
+            "INSERT INTO pharmacy_inventory (name, name_key, availability, record) VALUES (?, ?, ?, ?)",
+            ((med["name"], _key(med["name"]), med.get("availability"), json.dumps(med))
+             for med in data.get("pharmacy_inventory", [])),
+        )
+        conn.executemany(
+            "INSERT INTO prescription_logs (user_key, record) VALUES (?, ?)",
+            ((_key(log["user_name"]), json.dumps(log)) for log in data.get("prescription_logs", [])),
+        )
+        conn.commit()
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, sqlite_path)
+
+
+def load_json_store(path: str) -> InMemoryStore:
+    """Parse a database.json file and index it in memory."""
+    with open(path, "r") as f:
+        return InMemoryStore(json.load(f))
+
+
+def open_store(backend: str, path: str) -> BaseStore:
+    """Open the storage backend named by `backend` ("json", "sqlite" or "lazy") at `path`."""
+    if backend == "json":
+        return load_json_store(path)
+    if backend == "sqlite":
+        return SqliteStore(path)
+    if backend == "lazy":
+        return LazyJsonStore(path)
+    raise ValueError(f"Unknown storage backend '{backend}'. Choose one of: {', '.join(STORAGE_BACKENDS)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ephraim storage utilities")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="Import a database.json file into SQLite")
+    import_parser.add_argument("json_path", help="Source database.json file")
+    import_parser.add_argument("sqlite_path", help="Destination SQLite file")
+    cmd_args = parser.parse_args()
+
+    if cmd_args.command == "import":
+        import_json_to_sqlite(cmd_args.json_path, cmd_args.sqlite_path)
+        print(f"Imported {cmd_args.json_path} into {cmd_args.sqlite_path}")
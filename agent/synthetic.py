@@ -0,0 +1,233 @@
+import argparse
+import hashlib
+import json
+import random
+from array import array
+from datetime import date, timedelta
+from itertools import accumulate
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, TextIO
+
+from consts import DATABASE_FILE_NAME
+
+AVAILABILITY = ("In stock", "Low stock", "Out of stock")
+CITIES = ("Tel Aviv", "Jerusalem", "Haifa", "Beer Sheva")
+SIDE_EFFECTS = ("Nausea", "Dizziness", "Headache", "Drowsiness", "Dry mouth", "Stomach upset", "Rash")
+
+ENGLISH_FIRST_NAMES = ("Alice", "Bob", "Charlie", "David", "Eve", "Frank", "Grace", "Hannah", "Isaac", "Julia",
+                       "Kevin", "Laura", "Michael", "Natalie", "Oliver", "Rachel", "Samuel", "Tamar", "Victor", "Zoe")
+ENGLISH_LAST_NAMES = ("Cohen", "Levi", "Smith", "Johnson", "Brown", "Miller", "Davis", "Wilson", "Taylor", "Clark",
+                      "Lewis", "Walker", "Hall", "Young", "King", "Wright", "Green", "Baker", "Adams", "Nelson")
+HEBREW_FIRST_NAMES = ("אברהם", "שרה", "יצחק", "רבקה", "יעקב", "רחל", "לאה", "משה", "דוד", "נועה",
+                      "תמר", "יוסף", "מרים", "אורי", "יעל", "איתי", "שירה", "עומר", "מאיה", "אריאל")
+HEBREW_LAST_NAMES = ("כהן", "לוי", "מזרחי", "פרץ", "ביטון", "דהן", "אברהם", "פרידמן", "אזולאי", "מלכה",
+                     "כץ", "יוסף", "דוד", "עמר", "אוחיון", "חדד", "גבאי", "בן דוד", "שפירא", "אשכנזי")
+
+# Share of generated records per section when only a total is given
+USER_SHARE = 0.4
+MEDICATION_SHARE = 0.1
+
+
+class DatabaseSpec(NamedTuple):
+    """Shape of a synthetic database; counts exclude the base database's records."""
+    users: int
+    medications: int
+    logs: int
+    collision_rate: float = 0.05
+    hebrew_share: float = 0.2
+    log_skew: float = 1.1
+    seed: int = 0
+
+    @classmethod
+    def from_total(cls, records: int, base: Dict[str, Any], **options: Any) -> "DatabaseSpec":
+        """Split roughly `records` total records (including the base records) between the sections."""
+        extra = max(0, records - sum(len(base.get(section, [])) for section in SECTIONS))
+        medications = int(extra * MEDICATION_SHARE)
+        users = int(extra * USER_SHARE)
+        return cls(users=users, medications=medications, logs=extra - users - medications, **options)
+
+
+SECTIONS = ("users", "pharmacy_inventory", "prescription_logs")
+
+
+def _digest(seed: int, kind: str, index: int) -> bytes:
+    return hashlib.blake2b(f"{seed}:{kind}:{index}".encode(), digest_size=16).digest()
+
+
+class SyntheticDatabase:
+    """
+    Name:
+        SyntheticDatabase
+
+    Purpose:
+        Deterministic generator of large databases in the database.json schema. Every
+        record is derived from (seed, index), so sections can be streamed to disk one
+        record at a time without keeping names or records in memory. The base database
+        is kept first, so scripted scenarios (e.g. Alice, PainAway) still resolve.
+
+        - collision_rate: share of generated users whose name is drawn from a small pool
+          of common first/last name pairs, so many users share the same name
+        - hebrew_share: share of generated users with Hebrew names
+        - log_skew: Zipf exponent of prescription logs per user (a few users own most logs)
+
+    Inputs:
+        spec (DatabaseSpec): Section sizes and distribution parameters.
+        base (dict): Parsed base database.
+
+    Output Schema:
+        users(), medications(), logs() yield records; write() streams JSON to a file.
+
+    Error Handling:
+        This class never raises exceptions for valid specs.
+
+    Fallback Behavior:
+        A spec with zero counts reproduces the base database.
+    """
+
+    def __init__(self, spec: DatabaseSpec, base: Dict[str, Any]) -> None:
+        self.spec = spec
+        self.base = {section: list(base.get(section, [])) for section in SECTIONS}
+        self.user_count = len(self.base["users"]) + spec.users
+        self.medication_count = len(self.base["pharmacy_inventory"]) + spec.medications
+
+    def user_name(self, index: int) -> str:
+        base_users = self.base["users"]
+        if index < len(base_users):
+            return base_users[index]["name"]
+        digest = _digest(self.spec.seed, "user", index)
+        hebrew = digest[0] / 255 < self.spec.hebrew_share
+        first_names, last_names = (HEBREW_FIRST_NAMES, HEBREW_LAST_NAMES) if hebrew else (
+            ENGLISH_FIRST_NAMES, ENGLISH_LAST_NAMES)
+        first = first_names[digest[1] % len(first_names)]
+        last = last_names[digest[2] % len(last_names)]
+        if digest[3] / 255 < self.spec.collision_rate:
+            return f"{first} {last}"
+        return f"{first} {last} {index:x}"
+
+    def medication_name(self, index: int) -> str:
+        base_medications = self.base["pharmacy_inventory"]
+        if index < len(base_medications):
+            return base_medications[index]["name"]
+        return f"Med{index - len(base_medications):07d}"
+
+    def users(self) -> Iterator[Dict[str, Any]]:
+        yield from self.base["users"]
+        next_id = max((user["id"] for user in self.base["users"]), default=0) + 1
+        rng = random.Random(f"{self.spec.seed}:users")
+        for offset in range(self.spec.users):
+            index = len(self.base["users"]) + offset
+            born = date(1940, 1, 1) + timedelta(days=rng.randrange(365 * 65))
+            yield {
+                "id": next_id + offset,
+                "name": self.user_name(index),
+                "age": 2025 - born.year,
+                "dob": born.isoformat(),
+                "city": rng.choice(CITIES),
+                "prescriptions": [self.medication_name(rng.randrange(self.medication_count))
+                                  for _ in range(rng.randint(1, 3))],
+            }
+
+    def medications(self) -> Iterator[Dict[str, Any]]:
+        yield from self.base["pharmacy_inventory"]
+        rng = random.Random(f"{self.spec.seed}:medications")
+        for offset in range(self.spec.medications):
+            yield {
+                "name": self.medication_name(len(self.base["pharmacy_inventory"]) + offset),
+                "dosages": [f"{rng.choice((5, 10, 20, 50, 100, 200, 500))}mg"],
+                "usage_instructions": "Take as directed by your physician.",
+                "availability": rng.choice(AVAILABILITY),
+                "active_ingredients": [f"Compound{rng.randrange(1000):03d}"],
+                "generic_name": f"Generic{offset:07d}",
+                "side_effects": rng.sample(SIDE_EFFECTS, 2),
+                "price": round(rng.uniform(2, 200), 2),
+                "manufacturer": f"Manufacturer {rng.randrange(100)}",
+            }
+
+    def logs(self) -> Iterator[Dict[str, Any]]:
+        yield from self.base["prescription_logs"]
+        if not self.spec.logs:
+            return
+        rng = random.Random(f"{self.spec.seed}:logs")
+        # Zipf weights over a shuffled ranking of users, as compact arrays rather than lists
+        ranking = array("q", range(self.user_count))
+        rng.shuffle(ranking)
+        cumulative = array("d", accumulate(1.0 / (rank + 1) ** self.spec.log_skew for rank in range(self.user_count)))
+        population = range(self.user_count)
+        next_id = max((log["id"] for log in self.base["prescription_logs"]), default=0) + 1
+        batch = 4096
+        for start in range(0, self.spec.logs, batch):
+            ranks = rng.choices(population, cum_weights=cumulative, k=min(batch, self.spec.logs - start))
+            for offset, rank in enumerate(ranks):
+                yield {
+                    "id": next_id + start + offset,
+                    "user_name": self.user_name(ranking[rank]),
+                    "medication": self.medication_name(rng.randrange(self.medication_count)),
+                    "date_filled": (date(2020, 1, 1) + timedelta(days=rng.randrange(365 * 6))).isoformat(),
+                    "quantity": rng.choice((10, 20, 30, 60, 90)),
+                    "status": "Completed",
+                }
+
+    def sections(self) -> Dict[str, Iterator[Dict[str, Any]]]:
+        return {"users": self.users(), "pharmacy_inventory": self.medications(), "prescription_logs": self.logs()}
+
+    def write(self, f: TextIO) -> None:
+        """Stream the database as JSON, one record at a time."""
+        f.write("{")
+        for number, (section, records) in enumerate(self.sections().items()):
+            f.write(f'{", " if number else ""}"{section}": [')
+            for position, record in enumerate(records):
+                f.write(",\n" if position else "\n")
+                f.write(json.dumps(record))
+            f.write("\n]")
+        f.write("}\n")
+
+    def to_dict(self) -> Dict[str, List[Dict[str, Any]]]:
+        return {section: list(records) for section, records in self.sections().items()}
+
+
+def load_base(base_path: str = DATABASE_FILE_NAME) -> Dict[str, Any]:
+    """Load the database whose records every synthetic database keeps (database.json by default)."""
+    with open(base_path, "r") as f:
+        return json.load(f)
+
+
+def generate_database(records: int, seed: int = 0, base_path: str = DATABASE_FILE_NAME,
+                      **options: Any) -> Dict[str, Any]:
+    """Build a synthetic database of roughly `records` records in memory (see SyntheticDatabase)."""
+    base = load_base(base_path)
+    return SyntheticDatabase(DatabaseSpec.from_total(records, base, seed=seed, **options), base).to_dict()
+
+
+def write_database(path: str, records: int, seed: int = 0, base_path: str = DATABASE_FILE_NAME,
+                   spec: Optional[DatabaseSpec] = None, **options: Any) -> DatabaseSpec:
+    """Stream a synthetic database of roughly `records` records (or exactly `spec`) to `path`."""
+    base = load_base(base_path)
+    spec = spec or DatabaseSpec.from_total(records, base, seed=seed, **options)
+    with open(path, "w") as f:
+        SyntheticDatabase(spec, base).write(f)
+    return spec
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic database.json for benchmarks")
+    parser.add_argument("output", help="Path of the JSON file to write")
+    parser.add_argument("--records", type=int, default=1000, help="Approximate total number of records")
+    parser.add_argument("--users", type=int, default=None, help="Generated users (overrides --records)")
+    parser.add_argument("--medications", type=int, default=None, help="Generated medications (overrides --records)")
+    parser.add_argument("--logs", type=int, default=None, help="Generated prescription logs (overrides --records)")
+    parser.add_argument("--collision-rate", type=float, default=0.05, help="Share of users with a common shared name")
+    parser.add_argument("--hebrew-share", type=float, default=0.2, help="Share of users with Hebrew names")
+    parser.add_argument("--log-skew", type=float, default=1.1, help="Zipf exponent of logs per user")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--base", default=DATABASE_FILE_NAME, help="Database whose records are kept")
+    cmd_args = parser.parse_args()
+
+    options = dict(collision_rate=cmd_args.collision_rate, hebrew_share=cmd_args.hebrew_share,
+                   log_skew=cmd_args.log_skew, seed=cmd_args.seed)
+    explicit = None
+    if None not in (cmd_args.users, cmd_args.medications, cmd_args.logs):
+        explicit = DatabaseSpec(users=cmd_args.users, medications=cmd_args.medications, logs=cmd_args.logs, **options)
+    elif any(count is not None for count in (cmd_args.users, cmd_args.medications, cmd_args.logs)):
+        parser.error("--users, --medications and --logs must be given together")
+    written = write_database(cmd_args.output, cmd_args.records, base_path=cmd_args.base, spec=explicit, **options)
+    print(f"Wrote {written.users} users, {written.medications} medications and {written.logs} logs "
+          f"(plus the base records) to {cmd_args.output}")
@@ -0,0 +1,29 @@
+from cache import ResponseCache
+
+PRICE_PLAN = {"plan": [{"tool": "get_medication_details_by_name", "args": {"name": "PainAway"}}]}
+INVENTORY_PLAN = {"plan": [{"tool": "check_inventory_status", "args": {}}]}
+
+
+def _cache() -> ResponseCache:
+    # Every message embeds to the same vector: the worst case of paraphrases that differ only in a name
+    return ResponseCache(embed=lambda text: [1.0, 0.0])
+
+
+def test_semantic_hit_about_another_medication_is_a_miss():
+    cache = _cache()
+    cache.store_plan("What is the price of PainAway?", PRICE_PLAN, "", "en")
+    assert cache.lookup("What is the price of AllerFree?") is None
+
+
+def test_semantic_hit_about_the_same_medication_is_served():
+    cache = _cache()
+    cache.store_plan("What is the price of PainAway?", PRICE_PLAN, "", "en")
+    entry = cache.lookup("How much does PainAway cost?")
+    assert entry is not None and entry.plan == PRICE_PLAN
+
+
+def test_semantic_hit_without_arguments_is_served():
+    cache = _cache()
+    cache.store_plan("Which medications are in stock?", INVENTORY_PLAN, "", "en")
+    entry = cache.lookup("What do you have in stock?")
+    assert entry is not None and entry.plan == INVENTORY_PLAN
@@ -0,0 +1,24 @@
+import json
+
+from evaluate import check_accuracy
+from mock_llm import scripted_reply
+from prompt_builder import build_evaluator_messages
+
+
+def _mock_accuracy(request, response, expected):
+    verdict = json.loads(scripted_reply(build_evaluator_messages("accuracy", request, response)))
+    return check_accuracy(verdict, expected)[0]
+
+
+def test_mock_evaluator_extracts_the_asked_fact():
+    request = "Who manufactures PainAway?"
+    assert _mock_accuracy(request, "PainAway is made by HealthMed Pharmaceuticals.", ["HealthMed Pharmaceuticals"])
+    assert _mock_accuracy("How much does DigestEase cost?", "DigestEase (250mg) costs 18.5.", ["18.5"])
+
+
+def test_mock_evaluator_fails_a_wrong_response():
+    assert not _mock_accuracy("Who manufactures PainAway?", "PainAway is made by MediPharm Inc.", ["HealthMed Pharmaceuticals"])
+    # Repeating the question's words is not an answer
+    assert not _mock_accuracy("What are the side effects of AllerFree?", "You asked about AllerFree and its side effects.",
+                              ["Drowsiness"])
+    assert not _mock_accuracy("How much does DigestEase cost?", "DigestEase comes in 18.5mg tablets.", ["18.5"])
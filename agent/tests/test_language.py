@@ -0,0 +1,29 @@
+from language import LanguageDetector, script_language
+
+
+def test_latin_script_is_english_only_with_english_words():
+    assert script_language("Do you have AllerFree in stock?") == "en"
+    assert script_language("Quel est le prix de PainAway?") is None
+    assert script_language("¿Cuál es el precio de PainAway?") is None
+
+
+def test_short_latin_text_keeps_the_session_language():
+    detector = LanguageDetector(fallback=lambda text: "fr")
+    assert detector.detect("Quel est le prix de PainAway?") == "fr"
+    assert detector.detect("PainAway") == "fr"
+
+
+def test_hebrew_script_short_circuits():
+    assert script_language("מה המחיר של התרופה?") == "he"
+
+
+def test_short_english_commands_are_english():
+    for command in ("log me out", "refill my meds", "sign me out", "list all medications"):
+        assert script_language(command) == "en"
+    assert LanguageDetector().detect("log me out") == "en"
+
+
+def test_unsure_unsupported_fallback_keeps_the_session_language():
+    detector = LanguageDetector(fallback=lambda text: "")
+    detector.language = "he"
+    assert detector.detect("Wie viel kostet PainAway heute?") == "he"
@@ -0,0 +1,17 @@
+from executor import ExecutionOutcome, StepRecord
+from memory import ConversationMemory
+
+
+def test_dates_of_birth_are_redacted_before_they_are_kept():
+    outcome = ExecutionOutcome(steps=[StepRecord(
+        tool="get_user_prescription_names",
+        calls=[({"user_name": "Alice", "user_dob": "1995-04-12"}, ["PainAway"])],
+    )])
+    memory = ConversationMemory(recent_tokens=1)
+    memory.add_turn("I'm Alice, born 1995-04-12. What are my prescriptions?",
+                    "Alice (1995-04-12): PainAway, last filled 2024-03-01.", outcome)
+    memory.add_turn("Thanks", "You're welcome!")
+
+    job = memory.take_summary_job()
+    assert "1995-04-12" not in job.transcript() + memory.context()
+    assert "Alice" in job.transcript() and "2024-03-01" in job.transcript()
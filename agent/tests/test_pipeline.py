@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+
+from cache import ResponseCache
+from executor import PlanExecutor
+from pipeline import EphraimPipeline
+from storage import open_store
+from tools import PharmacyTools
+
+DATABASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "database.json")
+
+
+class _Channel:
+    """Blocking channel that records every identity prompt."""
+
+    def __init__(self):
+        self.asked = []
+
+    def ask(self, question):
+        self.asked.append(question)
+        return ""
+
+
+def _pipeline():
+    store = open_store("json", DATABASE)
+    tools = PharmacyTools(store=store, channel=_Channel(), logger=logging.getLogger(__name__))
+    return EphraimPipeline(store, tools, PlanExecutor(max_workers=2), ResponseCache(), logging.getLogger(__name__))
+
+
+def _stream(pipeline, steps):
+    stream = pipeline._start_decision_stream()
+    stream.feed(f"---EXPLANATION---\nLooking it up.\n\n---PLAN---\n{json.dumps({'plan': steps})}")
+    return stream
+
+
+def test_identity_gated_steps_wait_for_the_validated_plan():
+    pipeline = _pipeline()
+    stream = _stream(pipeline, [
+        {"tool": "check_inventory_status", "args": {}},
+        {"tool": "get_user_prescription_names", "args": {}},
+        {"tool": "check_inventory_status", "args": {}},
+    ])
+    assert [step["tool"] for step in stream.dispatched] == ["check_inventory_status"]
+    pipeline.executor.cancel(stream.run)
+    assert pipeline.tools.channel.asked == []
+    pipeline.executor.shutdown()
+
+
+def test_repair_that_changes_step_0_abandons_the_speculative_run():
+    pipeline = _pipeline()
+    stream = _stream(pipeline, [
+        {"tool": "get_medication_details_by_name", "args": {"name": "PainAway"}},
+        {"tool": "no_such_tool", "args": {}},
+        {"tool": "get_user_prescription_names", "args": {}},
+    ])
+    assert len(stream.dispatched) == 1
+    repaired = ("Checking the stock.", {"plan": [{"tool": "check_inventory_status", "args": {}}]})
+
+    abandoned = pipeline._abandoned_run(repaired, stream)
+    assert abandoned is stream.run
+    pipeline.executor.cancel(abandoned)
+    plan = pipeline._settle_decision("What do you have?", "", repaired, stream)
+
+    run = pipeline._take_speculative_run(plan)
+    assert run is not stream.run
+    outcome = pipeline.executor.finish(run)
+    assert [step.tool for step in outcome.steps] == ["check_inventory_status"]
+    assert pipeline.tools.channel.asked == []
+    pipeline.executor.shutdown()
+
+
+def test_explanation_waits_for_the_first_step_and_hides_a_broken_rule():
+    pipeline = _pipeline()
+    stream = pipeline._start_decision_stream()
+    assert stream.feed("---EXPLANATION---\nI will check the stock.\n\n---PLAN---\n{\"plan\": [") == ("", False)
+    assert stream.feed('{"tool": "check_inventory_status", "args": {}}]}') == ("I will check the stock.", True)
+    assert stream.finish() == ("", False)
+    pipeline.executor.cancel(stream.run)
+
+    stream = pipeline._start_decision_stream()
+    stream.feed("---EXPLANATION---\nYou may have the flu.\n\n---PLAN---\n")
+    assert stream.feed('{"plan": [{"tool": "report_broken_rule", "args": {"rule": "No diagnoses"}}]}') == ("", False)
+    assert stream.finish() == ("", False)
+    pipeline.executor.cancel(stream.run)
+    pipeline.executor.shutdown()
@@ -0,0 +1,22 @@
+from plan_schema import PlanValidator
+from tools import PharmacyTools
+
+
+def _problems(plan):
+    return PlanValidator(PharmacyTools).check_plan({"plan": plan})
+
+
+def test_foreach_over_a_list_is_valid():
+    assert _problems([
+        {"tool": "check_inventory_status", "args": {}, "save_as": "names"},
+        {"tool": "get_medication_details_by_name", "foreach": "names", "args": {"name": "$item"}, "save_as": "details"},
+        {"tool": "none", "foreach": "details", "args": {}},
+    ]) == []
+
+
+def test_foreach_over_a_single_result_is_rejected():
+    problems = _problems([
+        {"tool": "get_medication_details_by_name", "args": {"name": "PainAway"}, "save_as": "details"},
+        {"tool": "get_medication_details_by_name", "foreach": "details", "args": {"name": "$item"}},
+    ])
+    assert len(problems) == 1 and "not a list" in problems[0]
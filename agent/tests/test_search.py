@@ -0,0 +1,23 @@
+import os
+import sqlite3
+
+from search import medication_index
+from storage import SqliteStore, import_json_to_sqlite
+
+DATABASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "database.json")
+
+
+def test_index_is_rebuilt_after_a_sqlite_commit(tmp_path):
+    path = str(tmp_path / "database.sqlite3")
+    import_json_to_sqlite(DATABASE, path)
+    store = SqliteStore(path)
+    index = medication_index(store)
+    assert medication_index(store) is index
+    assert not medication_index(store).search("Zzyzxol")
+
+    with sqlite3.connect(path) as connection:
+        connection.execute("UPDATE pharmacy_inventory SET name = 'Zzyzxol', record = json_set(record, '$.name', 'Zzyzxol') "
+                           "WHERE name = 'PainAway'")
+    assert medication_index(store) is not index
+    assert medication_index(store).search("Zzyzxol")[0].name == "Zzyzxol"
+    store.close()
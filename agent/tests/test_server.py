@@ -0,0 +1,85 @@
+import asyncio
+import json
+import os
+
+from executor import PlanExecutor
+from server import EphraimServer
+from storage import open_store
+
+DATABASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "database.json")
+
+
+async def _request(port, method, path, payload=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = b"" if payload is None else json.dumps(payload).encode()
+    writer.write(f"{method} {path} HTTP/1.1\r\nConnection: close\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(body) if body else None
+
+
+def _serve(test, **options):
+    """Run `test(server, port)` against an EphraimServer on a free port (no LLM client needed)."""
+    async def main():
+        server = EphraimServer(open_store("json", DATABASE), client=None, executor=PlanExecutor(max_workers=2), **options)
+        listener = await asyncio.start_server(server._handle_connection, "127.0.0.1", 0)
+        try:
+            await test(server, listener.sockets[0].getsockname()[1])
+        finally:
+            listener.close()
+            for session in server.sessions.values():
+                session.agent.close()
+            server.executor.shutdown()
+    asyncio.run(main())
+
+
+def test_logout_forgets_the_conversation():
+    async def test(server, port):
+        _, created = await _request(port, "POST", "/sessions")
+        agent = server.sessions[created["session_id"]].agent
+        agent.tools.identity.verify(agent.store.get_user("Alice"))
+        agent.memory.add_turn("What are my prescriptions?", "You have PainAway.")
+        assert agent.memory.context()
+
+        status, body = await _request(port, "POST", f"/sessions/{created['session_id']}/logout")
+        assert (status, body) == (200, {"logged_out": True})
+        assert agent.memory.context() == ""
+    _serve(test)
+
+
+def test_failed_dob_checks_are_counted_across_sessions():
+    async def test(server, port):
+        sessions = []
+        for _ in range(2):
+            _, created = await _request(port, "POST", "/sessions")
+            sessions.append(server.sessions[created["session_id"]].agent.tools)
+        limit = server.failures.max_failures
+        for attempt in range(limit):
+            # A guesser moving to a new session keeps their failure count
+            result = sessions[attempt * 2 // limit]._validate_user_name_and_dob("Alice", "2000-01-01")
+            assert result["code"] == "INCORRECT_DOB"
+        result = sessions[1]._validate_user_name_and_dob("Alice", "1995-04-12")
+        assert result["code"] == "TOO_MANY_ATTEMPTS"
+    _serve(test)
+
+
+def test_second_message_on_a_busy_session_gets_409():
+    async def test(server, port):
+        _, created = await _request(port, "POST", "/sessions")
+        path = f"/sessions/{created['session_id']}/messages"
+        await server._slots.acquire()  # the only slot is taken, so the first message waits for it
+        first = asyncio.create_task(_request(port, "POST", path, {"message": "What do you have in stock?"}))
+        await asyncio.sleep(0.05)
+        status, _ = await _request(port, "POST", path, {"message": "And the prices?"})
+        assert status == 409
+        assert (await first)[0] == 503
+    _serve(test, max_concurrent=1, queue_timeout=0.2)
+
+
+def test_oversized_body_gets_413():
+    async def test(server, port):
+        status, _ = await _request(port, "POST", "/sessions/unknown/messages", {"message": "x" * 2048})
+        assert status == 413
+    _serve(test, max_body_bytes=1024)
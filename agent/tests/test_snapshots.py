@@ -0,0 +1,45 @@
+import json
+import os
+import shutil
+
+from snapshots import SnapshotManager
+
+DATABASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "database.json")
+
+
+def _rewrite_in_place(path, data):
+    with open(path, "r+") as f:
+        f.write(json.dumps(data, indent=1))
+        f.truncate()
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_pinned_lazy_snapshot_survives_an_in_place_rewrite(tmp_path):
+    path = str(tmp_path / "database.json")
+    shutil.copyfile(DATABASE, path)
+    manager = SnapshotManager("lazy", path)
+    pinned = manager.snapshot()
+    dob = pinned.get_user("Alice").dob
+
+    data = json.load(open(path))
+    data["users"][0]["dob"] = "1999-09-09"
+    _rewrite_in_place(path, data)
+    assert manager.check()
+    assert pinned.get_user("Alice").dob == dob
+    assert manager.get_user("Alice").dob == "1999-09-09"
+
+    manager.release(pinned)
+    assert pinned._file.closed
+    manager.close()
+
+
+def test_failed_reload_keeps_the_current_snapshot(tmp_path):
+    path = str(tmp_path / "database.json")
+    shutil.copyfile(DATABASE, path)
+    manager = SnapshotManager("json", path)
+    with open(path, "w") as f:
+        f.write('{"users": [1, 2')
+    assert not manager.check()
+    assert manager.get_user("Alice") is not None
+    manager.close()
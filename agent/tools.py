@@ -1,7 +1,22 @@
-import time
+import math
+import threading
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Union
-from helpers import error, log_method_call
+from helpers import bulk_variant, error, is_error, log_method_call, session_tool
+from identity import IdentityCache
+from records import LogView, Medication, User
+from search import medication_index
+from storage import BaseStore
+
+NAME_PROMPTS = {
+    "en": "Please enter your name:",
+    "he": "אנא הזן את שמך:",
+}
+
+DOB_PROMPTS = {
+    "en": "Please enter your date of birth (YYYY-MM-DD):",
+    "he": "אנא הזן את תאריך הלידה שלך (YYYY-MM-DD):",
+}
 
 
 class PharmacyTools:
@@ -14,10 +29,13 @@ class PharmacyTools:
         Handles user validation, inventory queries, and prescription data access.
 
     Inputs:
-        data (dict): In-memory database containing users, inventory, and logs.
+        store (BaseStore): Storage backend holding the users, inventory, and logs.
+        channel: Conversation channel used to prompt the user for missing identity fields.
+        identity (IdentityCache | None): Verified identity of the conversation (a new one by default).
 
     Output Schema:
-        Tool-specific outputs.
+        Tool-specific outputs. Records are returned as compact User/Medication/LogView
+        objects; callers convert them with records.to_json() where JSON is needed.
 
     Error Handling:
         All methods return standardized error dicts instead of raising exceptions.
@@ -26,26 +44,20 @@ class PharmacyTools:
         Prompts for missing user inputs and returns safe defaults where possible.
     """
 
-    def __init__(self, data: Dict[str, Any], console, logger) -> None:
-        self.data = data
-        self.console = console
-        self.explanation_thread = None
+    def __init__(self, store: BaseStore, channel, logger, identity: Optional[IdentityCache] = None) -> None:
+        self.store = store
+        self.channel = channel
+        self.identity: IdentityCache = identity or IdentityCache()
         self.language = "en"
         self.logger = logger
-
-    def _stream_text(self, text, style, delay):
-        """Function to be run in a thread"""
-        self.console.print(f"[bold {style}]Ephraim: [/]", end="")
-        for char in text:
-            self.console.print(char, end="")
-            time.sleep(delay)
-        self.console.print()  # Newline at the end
+        # Plan steps run concurrently; only one of them may prompt the user at a time
+        self._prompt_lock = threading.Lock()
 
     def _validate_user_name_and_dob(
             self,
             user_name: Optional[str] = None,
             user_dob: Optional[str] = None,
-    ) -> Union[Dict[str, Any], Dict[str, Any]]:
+    ) -> Union[User, Dict[str, Any]]:
         """
         Purpose:
             Validate a user's identity using name and date of birth.
@@ -56,7 +68,7 @@ class PharmacyTools:
 
         Output Schema:
             On success:
-                user (dict)
+                user (User)
 
             On failure:
                 standardized error dict
@@ -65,50 +77,60 @@ class PharmacyTools:
             - USER_NOT_FOUND
             - INVALID_DOB
             - INCORRECT_DOB
+            - TOO_MANY_ATTEMPTS after repeated incorrect DOBs for the same name
 
         Fallback Behavior:
-            Prompts for missing inputs.
+            Reuses the session's verified identity when it agrees with the given fields;
+            otherwise prompts for missing inputs.
         """
-        if self.explanation_thread:
-            self.explanation_thread.join()
+        with self._prompt_lock:
+            return self._validate_user_name_and_dob_locked(user_name, user_dob)
 
-        users_dict = {user["name"].lower(): user for user in self.data["users"]}
+    def _validate_user_name_and_dob_locked(
+            self,
+            user_name: Optional[str],
+            user_dob: Optional[str],
+    ) -> Union[User, Dict[str, Any]]:
+        """Body of _validate_user_name_and_dob; callers must hold the prompt lock."""
+        verified = self.identity.match(user_name, user_dob)
+        if verified is not None:
+            return verified
 
         if not user_name:
-            self.console.print("[bold green]Ephraim: [/]", end="")
-            if self.language == "en":
-                self.console.print("Please enter your name:")
-            elif self.language == "he":
-                self.console.print("אנא הזן את שמך:")
-            self.console.print("[bold blue]You: [/]", end="")
-            user_name = input().strip()
-        user_name_lower = user_name.lower()
-
-        if user_name_lower not in users_dict:
+            user_name = self.channel.ask(NAME_PROMPTS.get(self.language, ""))
+
+        retry_after = self.identity.failures.retry_after(user_name)
+        if retry_after:
+            return error(message="Too many failed attempts. Please try again later.", code="TOO_MANY_ATTEMPTS",
+                         details={"user_name": user_name, "retry_after_seconds": math.ceil(retry_after)})
+
+        user = self.store.get_user(user_name)
+
+        if user is None:
             return error(message=f"User '{user_name}' not found", code="USER_NOT_FOUND",
                          details={"user_name": user_name})
 
         if not user_dob:
-            self.console.print("[bold green]Ephraim: [/]", end="")
-            if self.language == "en":
-                self.console.print("Please enter your date of birth (YYYY-MM-DD):")
-            elif self.language == "he":
-                self.console.print("אנא הזן את תאריך הלידה שלך (YYYY-MM-DD):")
-            self.console.print("[bold blue]You: [/]", end="")
-            user_dob = input().strip()
+            user_dob = self.channel.ask(DOB_PROMPTS.get(self.language, ""))
 
         try:
             datetime.strptime(user_dob, "%Y-%m-%d")
         except ValueError:
             return error(message="Invalid DOB format", code="INVALID_DOB", details={"user_dob": user_dob})
 
-        if user_dob != users_dict[user_name_lower]["dob"]:
-            return error(message="Incorrect DOB", code="INCORRECT_DOB", details={"user_dob": user_dob})
+        if user_dob != user.dob:
+            # Several users can share a name; accept the namesake whose date of birth matches
+            user = next((namesake for namesake in self.store.get_users(user_name) if namesake.dob == user_dob), None)
+            if user is None:
+                self.identity.failures.record_failure(user_name)
+                return error(message="Incorrect DOB", code="INCORRECT_DOB", details={"user_dob": user_dob})
 
-        return users_dict[user_name_lower]
+        self.identity.verify(user)
+        return user
 
     @log_method_call
-    def get_medication_details_by_name(self, name: str) -> Dict[str, Any]:
+    @bulk_variant("get_medication_details_by_names", list_arg="names", item_arg="name")
+    def get_medication_details_by_name(self, name: str) -> Union[Medication, Dict[str, Any]]:
         """
         Purpose:
             Retrieve detailed medication information from inventory.
@@ -118,23 +140,88 @@ class PharmacyTools:
 
         Output Schema:
             On success:
-                medication dict
+                Medication
 
             On failure:
                 standardized error dict
 
         Error Handling:
-            - MEDICATION_NOT_FOUND
+            - MEDICATION_NOT_FOUND, with details.suggestions: similar medication names (may be empty)
 
         Fallback Behavior:
             Returns error without raising exceptions.
         """
-        for med in self.data["pharmacy_inventory"]:
-            if med["name"].lower() == name.lower():
-                return med
+        med = self.store.get_medication(name)
+        return med if med is not None else self._medication_not_found(name)
+
+    @log_method_call
+    def get_medication_details_by_names(self, names: List[str]) -> Union[List[Any], Dict[str, Any]]:
+        """
+        Purpose:
+            Retrieve detailed information for several medications in one lookup.
+            Prefer it over one get_medication_details_by_name step per medication.
+
+        Inputs:
+            names (list[str]): Medication names (case-insensitive).
+
+        Output Schema:
+            On success:
+                list with one entry per name, in order: Medication, or a MEDICATION_NOT_FOUND error dict
+
+            On failure:
+                standardized error dict
+
+        Error Handling:
+            - INVALID_ARGUMENT if names is not a list
+
+        Fallback Behavior:
+            Unknown names get their own error entry (with details.suggestions) without failing the others.
+        """
+        if not isinstance(names, list):
+            return error(message="names must be a list of medication names", code="INVALID_ARGUMENT",
+                         details={"names": names})
 
+        medications = self.store.get_medications(names)
+        return [med if med is not None else self._medication_not_found(name) for name, med in zip(names, medications)]
+
+    def _medication_not_found(self, name: str) -> Dict[str, Any]:
+        # The decider may pass anything; only a string can be matched against the inventory
+        suggestions = ([match.name for match in medication_index(self.store).search(name, limit=3)]
+                       if isinstance(name, str) else [])
         return error(message=f"Medication '{name}' not found", code="MEDICATION_NOT_FOUND",
-                     details={"medication_name": name})
+                     details={"medication_name": name, "suggestions": suggestions})
+
+    @log_method_call
+    def search_medications(self, query: str) -> Union[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Purpose:
+            Find inventory medications whose name, generic name or active ingredient resembles the query.
+            Tolerates typos, spacing, dosages ("Painaway 500") and Hebrew spellings of Latin names.
+            Use it when a medication name may not be exact, then get details by the returned name.
+
+        Inputs:
+            query (str): Medication name, generic name or active ingredient as the user wrote it.
+
+        Output Schema:
+            On success:
+                list[{name, matched, field, score}], best match first
+                (field is "name", "generic_name" or "active_ingredient"; score is 0-1)
+
+            On failure:
+                standardized error dict
+
+        Error Handling:
+            - MEDICATION_NOT_FOUND if nothing in the inventory is similar
+
+        Fallback Behavior:
+            Returns error without raising exceptions.
+        """
+        matches = medication_index(self.store).search(query) if isinstance(query, str) else []
+        if matches:
+            return [match.to_json() for match in matches]
+
+        return error(message=f"No medication similar to '{query}' found", code="MEDICATION_NOT_FOUND",
+                     details={"medication_name": query, "suggestions": []})
 
     @log_method_call
     def get_user_prescription_names(
@@ -165,10 +252,10 @@ class PharmacyTools:
         """
         user = self._validate_user_name_and_dob(user_name, user_dob)
 
-        if "error" in user:
+        if is_error(user):
             return user
 
-        return user.get("prescriptions", ["No Current Medications"])
+        return list(user.prescriptions) if user.prescriptions is not None else ["No Current Medications"]
 
     @log_method_call
     def check_inventory_status(self) -> Union[List[str], Dict[str, Any]]:
@@ -194,11 +281,7 @@ class PharmacyTools:
         """
 
         try:
-            available = [
-                med["name"]
-                for med in self.data["pharmacy_inventory"]
-                if med.get("availability") != "Out of stock"
-            ]
+            available = self.store.available_medication_names()
             return available if available else ["No medications currently in stock"]
         except Exception as e:
             return error(message="Failed to retrieve inventory status", code="INVENTORY_ERROR",
@@ -225,12 +308,37 @@ class PharmacyTools:
         return error(message="I cannot complete your request because it violates a service rule.",
                      code="RULE_VIOLATION", details={"rule": rule})
 
+    @log_method_call
+    @session_tool
+    def logout(self) -> Dict[str, Any]:
+        """
+        Purpose:
+            End the verified session, so the next identity-gated tool asks for name and DOB again.
+
+        Inputs:
+            None
+
+        Output Schema:
+            {
+                logged_out: bool,
+                user_name: str | None
+            }
+
+        Error Handling:
+            This tool cannot fail.
+
+        Fallback Behavior:
+            Returns logged_out=False if no user was verified.
+        """
+        user = self.identity.logout()
+        return {"logged_out": user is not None, "user_name": user.name if user is not None else None}
+
     @log_method_call
     def get_user_prescription_history(
             self,
             user_name: Optional[str] = None,
             user_dob: Optional[str] = None
-    ) -> Union[List[Dict[str, Any]], Dict[str, Any]]:
+    ) -> Union[LogView, Dict[str, Any]]:
         """
         Purpose:
             Retrieve a user's historical prescription fill records.
@@ -241,12 +349,8 @@ class PharmacyTools:
 
         Output Schema:
             On success:
-                list[{
-                    medication: str,
-                    date_filled: str,
-                    quantity: int,
-                    status: str
-                }]
+                LogView of LogEntry(medication, date_filled, quantity, status),
+                serialized as list[{medication, date_filled, quantity, status}]
 
             On failure:
                 standardized error dict
@@ -260,21 +364,12 @@ class PharmacyTools:
         """
         user = self._validate_user_name_and_dob(user_name, user_dob)
 
-        if "error" in user:
+        if is_error(user):
             return user
 
-        logs = [
-            {
-                "medication": log["medication"],
-                "date_filled": log["date_filled"],
-                "quantity": log["quantity"],
-                "status": log["status"]
-            }
-            for log in self.data.get("prescription_logs", [])
-            if log["user_name"].lower() == user["name"].lower()
-        ]
+        logs = self.store.get_prescription_logs(user.name)
 
         if not logs:
-            return error(message="No prescriptions found", code="NO_PRESCRIPTIONS", details={"user_name": user["name"]})
+            return error(message="No prescriptions found", code="NO_PRESCRIPTIONS", details={"user_name": user.name})
 
         return logs
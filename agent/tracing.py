@@ -0,0 +1,342 @@
+import contextvars
+import functools
+import inspect
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+TRACING_ENV_VAR_NAME = "EPHRAIM_TRACING"
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 1000)
+
+METRICS = {
+    "ephraim_span_duration_seconds": ("histogram", "Duration of pipeline stages and tool calls", DURATION_BUCKETS),
+    "ephraim_tool_calls_total": ("counter", "Tool calls by tool and status", None),
+    "ephraim_errors_total": ("counter", "Standardized errors by code and source", None),
+    "ephraim_llm_tokens_total": ("counter", "OpenAI tokens by call and token type", None),
+    "ephraim_plan_steps": ("histogram", "Number of steps per execution plan", COUNT_BUCKETS),
+    "ephraim_foreach_fanout": ("histogram", "Tool calls made by a foreach step", COUNT_BUCKETS),
+    "ephraim_response_path_total": ("counter", "Turns by response path", None),
+    "ephraim_plan_repairs_total": ("counter", "Plan repair requests by status", None),
+}
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("ephraim_current_span", default=None)
+
+
+class _NoopSpan:
+    """Span returned while tracing is disabled; every operation does nothing."""
+
+    __slots__ = ()
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_error(self, code: str) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        return None
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """One timed operation; entering it makes it the parent of spans started in the same context."""
+
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns",
+                 "attributes", "status", "_token", "_started")
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: Dict[str, Any]) -> None:
+        parent = _current_span.get()
+        self.tracer = tracer
+        self.name = name
+        self.trace_id: str = parent.trace_id if parent is not None else secrets.token_hex(16)
+        self.span_id: str = secrets.token_hex(8)
+        self.parent_id: Optional[str] = parent.span_id if parent is not None else None
+        self.start_ns = 0
+        self.end_ns = 0
+        self.attributes = attributes
+        self.status: Optional[str] = None
+        self._token = None
+        self._started = 0.0
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_error(self, code: str) -> None:
+        self.status = "ERROR"
+        self.attributes["error.code"] = code
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        self.start_ns = time.time_ns()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        duration = time.perf_counter() - self._started
+        self.end_ns = self.start_ns + int(duration * 1e9)
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.status = "ERROR"
+            self.attributes["exception.type"] = exc_type.__name__
+        self.tracer.finish(self, duration)
+
+
+class MetricsRegistry:
+    """
+    Name:
+        MetricsRegistry
+
+    Purpose:
+        Thread-safe counters and fixed-bucket histograms, rendered in the Prometheus
+        text exposition format. Metric names and types are declared in METRICS.
+
+    Inputs:
+        None
+
+    Output Schema:
+        render() returns the exposition text (str).
+
+    Error Handling:
+        Unknown metric names raise KeyError.
+
+    Fallback Behavior:
+        None
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, tuple], float] = {}
+        self._histograms: Dict[Tuple[str, tuple], List[float]] = {}
+
+    def inc(self, name: str, amount: float = 1, **labels: Any) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            # Layout: one cumulative count per bucket, then +Inf count, then sum
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [0.0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self) -> str:
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(series) for key, series in self._histograms.items()}
+
+        lines: List[str] = []
+        for name, (kind, description, buckets) in METRICS.items():
+            if kind == "counter":
+                samples = [(labels, value) for (metric, labels), value in counters.items() if metric == name]
+            else:
+                samples = [(labels, series) for (metric, labels), series in histograms.items() if metric == name]
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(samples, key=lambda sample: sample[0]):
+                if kind == "counter":
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                    continue
+                for bound, count in zip(buckets, value):
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', _number(bound)),))} {_number(count)}")
+                lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {_number(value[-2])}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(value[-1])}")
+                lines.append(f"{name}_count{_labels(labels)} {_number(value[-2])}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+class Tracer:
+    """
+    Name:
+        Tracer
+
+    Purpose:
+        Records spans for pipeline stages and tool calls and feeds the metrics registry.
+        Finished spans are kept in a bounded buffer and exported in the OTLP/JSON layout
+        used by OpenTelemetry collectors.
+
+    Inputs:
+        enabled (bool): When False, span() returns a shared no-op span and nothing is recorded.
+        max_spans (int): Finished spans kept for export.
+        service_name (str): service.name resource attribute of exported spans.
+
+    Output Schema:
+        export_otlp() returns {"resourceSpans": [...]}; metrics.render() Prometheus text.
+
+    Error Handling:
+        This class never raises exceptions.
+
+    Fallback Behavior:
+        The oldest spans are dropped once max_spans is reached.
+    """
+
+    def __init__(self, enabled: bool = False, max_spans: int = 10000, service_name: str = "ephraim") -> None:
+        self.enabled = enabled
+        self.service_name = service_name
+        self.metrics = MetricsRegistry()
+        self._spans: Deque[Span] = deque(maxlen=max_spans)
+
+    def span(self, name: str, **attributes: Any):
+        """Context manager timing `name`; a no-op when tracing is disabled."""
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, attributes)
+
+    def current(self):
+        """The innermost active span in this context, or the no-op span."""
+        if not self.enabled:
+            return NOOP_SPAN
+        return _current_span.get() or NOOP_SPAN
+
+    def inc(self, name: str, amount: float = 1, **labels: Any) -> None:
+        if self.enabled:
+            self.metrics.inc(name, amount, **labels)
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        if self.enabled:
+            self.metrics.observe(name, value, **labels)
+
+    def finish(self, span: Span, duration: float) -> None:
+        self._spans.append(span)
+        self.metrics.observe("ephraim_span_duration_seconds", duration, span=span.name)
+
+    def finished_spans(self) -> List[Span]:
+        return list(self._spans)
+
+    def export_otlp(self, clear: bool = False) -> Dict[str, Any]:
+        """Finished spans as an OTLP/JSON ExportTraceServiceRequest body."""
+        spans = self.finished_spans()
+        if clear:
+            self._spans.clear()
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [_attribute("service.name", self.service_name)]},
+                "scopeSpans": [{
+                    "scope": {"name": "ephraim.tracing"},
+                    "spans": [{
+                        "traceId": span.trace_id,
+                        "spanId": span.span_id,
+                        "parentSpanId": span.parent_id or "",
+                        "name": span.name,
+                        "kind": 1,
+                        "startTimeUnixNano": str(span.start_ns),
+                        "endTimeUnixNano": str(span.end_ns),
+                        "attributes": [_attribute(key, value) for key, value in span.attributes.items()],
+                        "status": {"code": 2} if span.status == "ERROR" else {"code": 1},
+                    } for span in spans],
+                }],
+            }]
+        }
+
+
+TRACER = Tracer(enabled=os.getenv(TRACING_ENV_VAR_NAME, "").lower() in ("1", "true", "yes"))
+
+
+def traced(name: str) -> Callable:
+    """Decorator wrapping a function or coroutine function in a TRACER span called `name`."""
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                if not TRACER.enabled:
+                    return await func(*args, **kwargs)
+                with Span(TRACER, name, {}):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not TRACER.enabled:
+                return func(*args, **kwargs)
+            with Span(TRACER, name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def usage_counts(usage: Any) -> Dict[str, int]:
+    """Prompt, cached prompt (provider prefix cache hits) and completion tokens of an OpenAI usage object."""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", None) or 0,
+        "cached_tokens": getattr(details, "cached_tokens", None) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", None) or 0,
+    }
+
+
+def record_usage(call: str, usage: Any) -> Dict[str, int]:
+    """
+    Count prompt/cached/completion tokens from an OpenAI usage object, attach them to the
+    current span, and return them (see usage_counts). The "cached_prompt" token type is
+    the part of "prompt" that was served from the provider's prefix cache.
+    """
+    counts = usage_counts(usage)
+    if not TRACER.enabled or usage is None:
+        return counts
+    span = TRACER.current()
+    typed = {"prompt": counts["prompt_tokens"], "cached_prompt": counts["cached_tokens"],
+             "completion": counts["completion_tokens"]}
+    for token_type, count in typed.items():
+        TRACER.metrics.inc("ephraim_llm_tokens_total", count, call=call, type=token_type)
+    for name, count in counts.items():
+        span.set_attribute(f"llm.{name}", count)
+    return counts
+
+
+def log_usage(logger: Any, turn_usage: Dict[str, Dict[str, int]]) -> None:
+    """Debug-log one turn's prompt tokens per LLM call, split into cached and uncached."""
+    if not turn_usage:
+        return
+    logger.debug("Prompt tokens: " + ", ".join(
+        f"{call} {counts['prompt_tokens']} ({counts['cached_tokens']} cached, "
+        f"{counts['prompt_tokens'] - counts['cached_tokens']} uncached)"
+        for call, counts in turn_usage.items()))
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        f'{key}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for key, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}